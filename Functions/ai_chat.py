@@ -1,16 +1,27 @@
-from langchain_openai import ChatOpenAI
 from langchain.agents import create_openai_functions_agent
-from langchain.schema import HumanMessage, AIMessage, BaseMessage
+from langchain.schema import HumanMessage, AIMessage, BaseMessage, SystemMessage
 from langchain.tools.base import BaseTool
 from langchain.agents.agent import AgentExecutor
-from langchain.tools import tool
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain.tools import StructuredTool, tool
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from . import ai_tool
-from . import sub_agent
+from . import chat_store
+from . import history
+from . import llm_client
+import asyncio
+import contextvars
+import functools
+import inspect
 import sqlite3
-from typing import List, Optional, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, List, Optional, Set, Tuple, Type
 
 from dotenv import load_dotenv
+from pydantic import BaseModel, create_model
 import os
 from .log_config import get_logger
 
@@ -22,21 +33,36 @@ logger = get_logger(__name__)
 
 
 @tool
-def get_html_code(container_name: str) -> str:
-    """取得 container 中的 HTML 原始碼"""
-    return ai_tool.get_html_code(container_name)
+def get_html_code(container_name: str, start: Optional[int] = None, end: Optional[int] = None, outline: bool = False) -> str:
+    """取得 container 中的 HTML 原始碼（含行數）
+
+    大檔案可先以 outline=True 查看結構與行號範圍，再以 start/end 讀取需要的行
+    """
+    return ai_tool.get_html_code(container_name, start, end, outline)
+
+
+@tool
+def get_css_code(container_name: str, start: Optional[int] = None, end: Optional[int] = None, outline: bool = False) -> str:
+    """取得 container 中的 CSS 原始碼（含行數）
+
+    大檔案可先以 outline=True 查看結構與行號範圍，再以 start/end 讀取需要的行
+    """
+    return ai_tool.get_css_code(container_name, start, end, outline)
 
 
 @tool
-def get_css_code(container_name: str) -> str:
-    """取得 container 中的 CSS 原始碼"""
-    return ai_tool.get_css_code(container_name)
+def get_js_code(container_name: str, start: Optional[int] = None, end: Optional[int] = None, outline: bool = False) -> str:
+    """取得 container 中的 JavaScript 原始碼（含行數）
+
+    大檔案可先以 outline=True 查看結構與行號範圍，再以 start/end 讀取需要的行
+    """
+    return ai_tool.get_js_code(container_name, start, end, outline)
 
 
 @tool
-def get_js_code(container_name: str) -> str:
-    """取得 container 中的 JavaScript 原始碼"""
-    return ai_tool.get_js_code(container_name)
+def get_project_files(container_name: str) -> str:
+    """一次取得 container 中的 HTML、CSS、JavaScript 原始碼（含行數）"""
+    return ai_tool.get_project_files(container_name)
 
 
 @tool
@@ -60,14 +86,156 @@ def edit_request(container_name: str, session_id: str, project_name: Optional[st
 
 # ---------- Tool & Agent Management ---------- #
 
+AGENT_CACHE_SIZE = int(os.getenv("AGENT_CACHE_SIZE", "32"))
+
+# async 路徑的執行緒：工具（子代理的 Docker 與 LLM 工作，可能長達數分鐘）與
+# 資料庫讀寫、建立 agent 等短工作各用一個有上限的 pool，不共用 event loop 的預設 executor，
+# 多個編輯任務同時執行時也不會讓其他串流的資料庫步驟排隊
+AGENT_TOOL_WORKERS = int(os.getenv("AGENT_TOOL_WORKERS", "8"))
+CHAT_TURN_WORKERS = int(os.getenv("CHAT_TURN_WORKERS", "4"))
+_tool_executor = ThreadPoolExecutor(max_workers=AGENT_TOOL_WORKERS, thread_name_prefix="agent-tool")
+_turn_executor = ThreadPoolExecutor(max_workers=CHAT_TURN_WORKERS, thread_name_prefix="chat-turn")
+
+# 已建立的 agent，依專案名稱快取（LRU）
+_agent_cache: "OrderedDict[Optional[str], AgentExecutor]" = OrderedDict()
+_agent_cache_lock = threading.Lock()
+
+# 單次聊天請求的上下文；快取中的 agent 由多個請求共用，工具執行時從這裡取得 session_id
+_request_context: ContextVar[dict] = ContextVar("chat_request_context", default={})
+
+# 串流事件回調：event_callback(event_type, message)
+# event_type 為 "status"、"token"、"tool_start"、"tool_end" 其中之一
+EventCallback = Callable[[str, str], None]
+
+# 工具開始執行時回報給前端的狀態文字
+TOOL_STATUS_MESSAGES = {
+    'get_html_code': '正在讀取 HTML 代碼...',
+    'get_css_code': '正在讀取 CSS 代碼...',
+    'get_js_code': '正在讀取 JavaScript 代碼...',
+    'get_project_files': '正在讀取專案代碼...',
+    'edit_request': '正在執行代碼編輯任務...'
+}
+
+
+async def _run_in(executor: ThreadPoolExecutor, func: Callable, *args: Any, **kwargs: Any) -> Any:
+    """在指定的 executor 中執行同步函式，並帶上目前的 contextvars（例如 _request_context）"""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
 def get_registered_tools() -> List[BaseTool]:
-    return [get_html_code, get_css_code, get_js_code, edit_request]
+    return [get_html_code, get_css_code, get_js_code, get_project_files, edit_request]
+
+
+def resolve_container_name(project_name: Optional[str]) -> Optional[str]:
+    """智能處理容器名稱 - 如果 project_name 已經包含完整的容器名稱，直接使用"""
+    if not project_name:
+        return None
+    if project_name.startswith('ai-web-ide_') and project_name.endswith('_container'):
+        return project_name
+    return f'ai-web-ide_{project_name}_container'
+
+
+def _bound_args_schema(original_tool: BaseTool, injected: Set[str]) -> Type[BaseModel]:
+    """移除由系統注入的參數後的 args schema；模型省略這些參數時不會在注入前就驗證失敗"""
+    fields = {
+        name: (field.annotation, field)
+        for name, field in original_tool.args_schema.model_fields.items()
+        if name not in injected
+    }
+    return create_model(f"{original_tool.args_schema.__name__}Bound", **fields)
+
+
+def _bind_tool(original_tool: BaseTool, container_name: Optional[str], project_name: Optional[str]) -> BaseTool:
+    """
+    包裝工具以記錄調用過程並自動注入參數
+    需要注入哪些參數在建立 agent 時就決定好，執行時只讀取請求上下文；
+    注入的參數不會出現在給模型的 schema 中，模型即使自行填入也一律以系統的值為準
+    """
+    tool_params = inspect.signature(original_tool.func).parameters
+    inject_container = 'container_name' in tool_params and container_name is not None
+    inject_session = original_tool.name == 'edit_request'
+
+    injected: Set[str] = set()
+    if inject_container:
+        injected.add('container_name')
+    if inject_session:
+        injected.update({'session_id', 'project_name'})
+
+    def bound_func(**kwargs):
+        context = _request_context.get()
+        logger.info(f"開始調用工具: {original_tool.name}")
+
+        if inject_container:
+            kwargs['container_name'] = container_name
+            logger.info(f"自動注入參數: container_name='{container_name}'")
+
+        # 特殊處理 edit_request 工具，自動注入 session_id 和 project_name
+        if inject_session:
+            kwargs['session_id'] = context.get("session_id")
+            kwargs['project_name'] = project_name
+            logger.info(f"edit_request 自動注入參數: session_id={kwargs['session_id']}, project_name={project_name}")
+
+        logger.info(f"參數: kwargs={kwargs}")
+        try:
+            result = original_tool.func(**kwargs)
+            logger.info(f"工具 {original_tool.name} 執行成功，結果長度: {len(str(result))}")
+            return result
+        except Exception as e:
+            logger.error(f"工具 {original_tool.name} 執行失敗: {str(e)}", exc_info=True)
+            raise e
+
+    async def async_bound_func(**kwargs):
+        # async agent 執行工具時不佔用 event loop，也不使用 loop 的預設 executor
+        return await _run_in(_tool_executor, bound_func, **kwargs)
+
+    return StructuredTool.from_function(
+        func=bound_func,
+        coroutine=async_bound_func,
+        name=original_tool.name,
+        description=original_tool.description,
+        args_schema=_bound_args_schema(original_tool, injected) if injected else original_tool.args_schema,
+    )
+
+
+class StreamEventHandler(BaseCallbackHandler):
+    """
+    將 agent 執行過程轉成串流事件：LLM 產生的 token 與工具開始 / 結束
+    工具內部（例如子代理）的 LLM 呼叫也會繼承這個 handler，因此只轉送工具以外的 token
+    """
+
+    # async agent 執行時也直接在 event loop 中呼叫，確保 token 順序不被打亂
+    run_inline = True
+
+    def __init__(self, event_callback: EventCallback):
+        self.event_callback = event_callback
+        self._tool_depth = 0
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token and self._tool_depth == 0:
+            self.event_callback("token", token)
+
+    def on_tool_start(self, serialized: dict, input_str: str, **kwargs: Any) -> None:
+        self._tool_depth += 1
+        name = (serialized or {}).get("name") or kwargs.get("name", "")
+        self.event_callback("tool_start", TOOL_STATUS_MESSAGES.get(name, f"正在執行工具 {name}..."))
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self._tool_depth = max(self._tool_depth - 1, 0)
+        name = kwargs.get("name", "")
+        self.event_callback("tool_end", f"工具 {name} 執行完成" if name else "工具執行完成")
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._tool_depth = max(self._tool_depth - 1, 0)
+        self.event_callback("tool_end", f"工具執行失敗：{error}")
 
 
 def build_agent_with_tools(
     tools: List[BaseTool], project_name: Optional[str] = None
 ) -> AgentExecutor:
-    llm = ChatOpenAI(model="gpt-4o", temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
+    # streaming=True：有掛上 StreamEventHandler 時可逐 token 轉送；一般 invoke 仍回傳完整結果
+    llm = llm_client.get_chat_model("gpt-4o", temperature=0, streaming=True)
 
     system_message = """You are a helpful assistant that can use tools to interact with Docker containers.
 
@@ -76,7 +244,8 @@ All responses and explanations must be written in Traditional Chinese.
 When using tools that require a 'container_name' parameter, you MUST provide the container name.
 
 🔧 **主要工作流程**：
-1. 當使用者詢問或要求查看代碼時，使用對應的查看工具 (get_html_code, get_css_code, get_js_code)
+1. 當使用者詢問或要求查看代碼時，使用對應的查看工具 (get_html_code, get_css_code, get_js_code)；
+   需要查看一個以上的檔案時，改用 get_project_files 一次取得全部
 2. 當使用者要求修改、編輯、改進網頁時，直接使用 edit_request 工具
 
 ⚡ **重要指引**：
@@ -87,14 +256,9 @@ When using tools that require a 'container_name' parameter, you MUST provide the
 IMPORTANT: For CSS styling preferences, the sub-agent will prefer using Tailwind CSS utility classes for better consistency and aesthetics.
 """
 
+    container_name = resolve_container_name(project_name)
     if project_name:
-        # 智能處理容器名稱 - 如果 project_name 已經包含完整的容器名稱，直接使用
-        if project_name.startswith('ai-web-ide_') and project_name.endswith('_container'):
-            container_name = project_name
-            logger.info(f"使用完整容器名稱: {container_name}")
-        else:
-            container_name = f'ai-web-ide_{project_name}_container'
-            logger.info(f"生成容器名稱: {container_name} (來自專案: {project_name})")
+        logger.info(f"使用容器名稱: {container_name} (來自專案: {project_name})")
 
         system_message += f"""
 You are currently working on the project '{project_name}'.
@@ -104,6 +268,9 @@ For all tools that require parameters, the system will automatically provide the
 - get_html_code(container_name): 查看 HTML 代碼及行數 - 自動使用 container_name='{container_name}'
 - get_css_code(container_name): 查看 CSS 代碼及行數 - 自動使用 container_name='{container_name}'
 - get_js_code(container_name): 查看 JavaScript 代碼及行數 - 自動使用 container_name='{container_name}'
+- get_project_files(container_name): 一次查看 HTML、CSS、JavaScript 三個檔案及行數 - 自動使用 container_name='{container_name}'
+- 檔案很大（輸出被截斷）時，先以 outline=True 查看結構與行號範圍，再以 start/end 只讀取需要的行，
+  例如 get_html_code(container_name='{container_name}', outline=True)、get_html_code(container_name='{container_name}', start=120, end=180)
 - edit_request(container_name, session_id, project_name): 執行代碼編輯任務 - 系統自動填入所有參數
 
 📝 **使用範例**：
@@ -135,8 +302,38 @@ No project is currently selected. You need to ask the user for the project name
         ]
     )
 
-    agent = create_openai_functions_agent(llm=llm, tools=tools, prompt=prompt)
-    return AgentExecutor(agent=agent, tools=tools)
+    bound_tools = [_bind_tool(t, container_name, project_name) for t in tools]
+    agent = create_openai_functions_agent(llm=llm, tools=bound_tools, prompt=prompt)
+    return AgentExecutor(agent=agent, tools=bound_tools)
+
+
+def _cached_agent_executor(project_name: Optional[str]) -> Optional[AgentExecutor]:
+    """從 LRU 快取取得已建立的 agent；沒有時回傳 None，不會建立"""
+    with _agent_cache_lock:
+        agent_executor = _agent_cache.get(project_name)
+        if agent_executor is not None:
+            _agent_cache.move_to_end(project_name)
+        return agent_executor
+
+
+def get_agent_executor(project_name: Optional[str] = None) -> AgentExecutor:
+    """取得專案的 agent，已建立過的直接從 LRU 快取取用"""
+    agent_executor = _cached_agent_executor(project_name)
+    if agent_executor is not None:
+        return agent_executor
+
+    tools = get_registered_tools()
+    logger.info(f"建立 agent，可用工具: {[t.name for t in tools]} (專案: {project_name})")
+    agent_executor = build_agent_with_tools(tools, project_name)
+
+    with _agent_cache_lock:
+        # 其他執行緒可能同時建好了同一個 agent，以先放入快取的為準
+        agent_executor = _agent_cache.setdefault(project_name, agent_executor)
+        _agent_cache.move_to_end(project_name)
+        while len(_agent_cache) > AGENT_CACHE_SIZE:
+            evicted, _ = _agent_cache.popitem(last=False)
+            logger.info(f"agent 快取已滿，移除專案: {evicted}")
+    return agent_executor
 
 
 # ---------- 專案相關的 session 管理 ---------- #
@@ -168,70 +365,21 @@ def init_chat_session(session_id: str, project_name: Optional[str] = None) -> No
     """初始化聊天 session，支援專案分離"""
     full_session_id = create_project_session_id(session_id, project_name)
 
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
-
-    # 創建訊息表（如果不存在）
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            role TEXT,
-            content TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-
-    # 檢查是否需要添加 project_name 欄位（資料庫遷移）
-    try:
-        c.execute("SELECT project_name FROM messages LIMIT 1")
-    except sqlite3.OperationalError:
-        # project_name 欄位不存在，需要添加
-        logger.info("升級資料庫結構：添加 project_name 欄位")
-        c.execute("ALTER TABLE messages ADD COLUMN project_name TEXT")
-        conn.commit()
-
-    # 檢查 session 是否已存在
-    c.execute("SELECT 1 FROM messages WHERE session_id = ?", (full_session_id,))
-    if c.fetchone() is None:
-        # 初始化新的 session
-        c.execute(
-            "INSERT INTO messages (session_id, project_name, role, content) VALUES (?, ?, ?, ?)",
-            (full_session_id, project_name, "system", f"Session initialized for project: {project_name or 'default'}"),
-        )
-
-    conn.commit()
-    conn.close()
+    # 資料表與索引由 chat_store 的遷移負責建立，這裡只需確保 session 存在
+    chat_store.ensure_session(
+        full_session_id,
+        project_name,
+        f"Session initialized for project: {project_name or 'default'}",
+    )
 
 
 def save_message_to_db(session_id: str, role: str, content: str, project_name: Optional[str] = None) -> None:
     """儲存訊息到資料庫，支援專案分離"""
     full_session_id = create_project_session_id(session_id, project_name)
+    chat_store.insert_message(full_session_id, project_name, role, content)
 
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO messages (session_id, project_name, role, content)
-        VALUES (?, ?, ?, ?)
-    """, (full_session_id, project_name, role, content))
-    conn.commit()
-    conn.close()
-
-
-def load_chat_history(session_id: str, project_name: Optional[str] = None) -> List[BaseMessage]:
-    """載入聊天歷史，支援專案分離"""
-    full_session_id = create_project_session_id(session_id, project_name)
-
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
-    c.execute("""
-        SELECT role, content FROM messages
-        WHERE session_id = ?
-        ORDER BY timestamp ASC
-    """, (full_session_id,))
-    rows = c.fetchall()
-    conn.close()
 
+def _rows_to_messages(rows: List[Tuple[str, str]]) -> List[BaseMessage]:
     messages: List[BaseMessage] = []
     for role, content in rows:
         if role == "user":
@@ -241,115 +389,102 @@ def load_chat_history(session_id: str, project_name: Optional[str] = None) -> Li
     return messages
 
 
+def load_chat_history(
+    session_id: str,
+    project_name: Optional[str] = None,
+    token_budget: Optional[int] = None,
+    max_turns: int = history.HISTORY_MAX_TURNS,
+) -> List[BaseMessage]:
+    """
+    載入聊天歷史，支援專案分離
+
+    token_budget 為 None 時回傳完整歷史（供頁面顯示）；
+    否則回傳「滾動摘要 + 最近的回合」：只從資料庫倒序讀取摘要之後最近 max_turns 個回合，
+    並保留在 token 預算內的部分（供 agent prompt 使用）
+    """
+    full_session_id = create_project_session_id(session_id, project_name)
+
+    if token_budget is None:
+        return _rows_to_messages(chat_store.fetch_messages(full_session_id))
+
+    messages: List[BaseMessage] = []
+    summary, window = history.select_window(full_session_id, token_budget, max_turns)
+    if summary:
+        content, _, _, covered_count = summary
+        messages.append(SystemMessage(content=history.summary_message_text(content, covered_count)))
+
+    logger.info(f"聊天歷史視窗：{'摘要 + ' if summary else ''}保留 {len(window)} 則訊息")
+    messages.extend(_rows_to_messages([(role, content) for _, role, content in window]))
+    return messages
+
+
 def get_all_sessions() -> List[dict]:
     """從資料庫中取得所有 session，按專案分組並按最後訊息時間排序，只包含有真正對話內容的 session"""
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
     try:
-        # 修改查詢條件，排除只有 system 訊息的 session
-        c.execute("""
-            SELECT session_id, project_name, MAX(timestamp) as last_message_time
-            FROM messages
-            WHERE role != 'system'
-            GROUP BY session_id
-            HAVING COUNT(*) > 0
-            ORDER BY last_message_time DESC
-        """)
-        rows = c.fetchall()
-
-        sessions = []
-        for session_id, project_name, last_message_time in rows:
-            # 解析 session_id 來取得原始的 session_id
-            parsed_project, parsed_session = parse_project_session_id(session_id)
-
-            sessions.append({
-                'session_id': parsed_session,
-                'full_session_id': session_id,
-                'project_name': project_name or parsed_project,
-                'last_message_time': last_message_time
-            })
-
-        return sessions
+        rows = chat_store.fetch_sessions()
     except sqlite3.OperationalError:
-        # 如果資料庫或資料表不存在，回傳空列表
+        # 如果資料庫無法存取，回傳空列表
         return []
-    finally:
-        conn.close()
+
+    sessions = []
+    for session_id, project_name, last_message_time, title, message_count in rows:
+        # 解析 session_id 來取得原始的 session_id
+        parsed_project, parsed_session = parse_project_session_id(session_id)
+
+        sessions.append({
+            'session_id': parsed_session,
+            'full_session_id': session_id,
+            'project_name': project_name or parsed_project,
+            'last_message_time': last_message_time,
+            'title': title,
+            'message_count': message_count,
+        })
+
+    return sessions
 
 
 def get_sessions_by_project(project_name: str) -> List[dict]:
     """取得特定專案的所有 session，只包含有真正對話內容的 session"""
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
     try:
-        # 修改查詢條件，排除只有 system 訊息的 session
-        c.execute("""
-            SELECT session_id, MAX(timestamp) as last_message_time
-            FROM messages
-            WHERE project_name = ? AND role != 'system'
-            GROUP BY session_id
-            HAVING COUNT(*) > 0
-            ORDER BY last_message_time DESC
-        """, (project_name,))
-        rows = c.fetchall()
-
-        sessions = []
-        for session_id, last_message_time in rows:
-            # 解析 session_id 來取得原始的 session_id
-            _, parsed_session = parse_project_session_id(session_id)
-
-            sessions.append({
-                'session_id': parsed_session,
-                'full_session_id': session_id,
-                'project_name': project_name,
-                'last_message_time': last_message_time
-            })
-
-        return sessions
+        rows = chat_store.fetch_sessions(project_name)
     except sqlite3.OperationalError:
         return []
-    finally:
-        conn.close()
+
+    sessions = []
+    for session_id, _, last_message_time, title, message_count in rows:
+        # 解析 session_id 來取得原始的 session_id
+        _, parsed_session = parse_project_session_id(session_id)
+
+        sessions.append({
+            'session_id': parsed_session,
+            'full_session_id': session_id,
+            'project_name': project_name,
+            'last_message_time': last_message_time,
+            'title': title,
+            'message_count': message_count,
+        })
+
+    return sessions
 
 
 def delete_session(session_id: str, project_name: Optional[str] = None) -> None:
     """從資料庫中刪除指定 session 的所有訊息，支援專案分離"""
     full_session_id = create_project_session_id(session_id, project_name)
-
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE session_id = ?", (full_session_id,))
-    conn.commit()
-    conn.close()
+    chat_store.delete_session_messages(full_session_id)
 
 
 def get_project_list() -> List[str]:
     """取得所有有聊天記錄的專案列表"""
-    conn = sqlite3.connect("chat_history.db")
-    c = conn.cursor()
     try:
-        c.execute("""
-            SELECT DISTINCT project_name
-            FROM messages
-            WHERE project_name IS NOT NULL AND project_name != ''
-            ORDER BY project_name
-        """)
-        rows = c.fetchall()
-        return [row[0] for row in rows if row[0]]
+        return chat_store.fetch_project_names()
     except sqlite3.OperationalError:
         return []
-    finally:
-        conn.close()
 
 
 # ---------- 主聊天流程 ---------- #
 
-def chat_with_ai(
-    user_input: str, session_id: str, project_name: Optional[str] = None
-) -> str:
-    """主聊天函數，支援專案分離"""
-    logger.info(f"開始處理聊天請求 - 專案: {project_name}")
-
+def _prepare_turn(user_input: str, session_id: str, project_name: Optional[str]) -> List[BaseMessage]:
+    """初始化 session、儲存使用者訊息並載入送進 agent 的歷史"""
     # 初始化 session（包含專案資訊）
     init_chat_session(session_id, project_name)
 
@@ -358,193 +493,130 @@ def chat_with_ai(
     logger.info("已儲存使用者訊息到資料庫")
 
     # 取得歷史訊息（專案特定）
-    history = load_chat_history(session_id, project_name)
-    logger.info(f"載入聊天歷史，共 {len(history)} 條訊息")
+    chat_history = load_chat_history(session_id, project_name, token_budget=history.HISTORY_TOKEN_BUDGET)
+    logger.info(f"載入聊天歷史，共 {len(chat_history)} 條訊息")
+    return chat_history
 
-    # 建立 agent
-    tools = get_registered_tools()
-    logger.info(f"建立 agent，可用工具: {[tool.name for tool in tools]}")
-
-    agent_executor = build_agent_with_tools(tools, project_name)
 
-    # 智能處理容器名稱
-    container_name = None
-    if project_name:
-        if project_name.startswith('ai-web-ide_') and project_name.endswith('_container'):
-            container_name = project_name
-        else:
-            container_name = f'ai-web-ide_{project_name}_container'
-
-    # 包裝工具以捕獲調用過程並自動注入參數
-    original_tools = agent_executor.tools
-    wrapped_tools = []
-
-    for tool in original_tools:
-        def create_wrapped_tool(original_tool):
-            def wrapped_func(*args, **kwargs):
-                logger.info(f"開始調用工具: {original_tool.name}")
-
-                # 檢查工具是否需要 'container_name'
-                import inspect
-                tool_params = inspect.signature(original_tool.func).parameters
-
-                if 'container_name' in tool_params and container_name and 'container_name' not in kwargs:
-                    kwargs['container_name'] = container_name
-                    logger.info(f"自動注入參數: container_name='{container_name}'")
-
-                # 特殊處理 edit_request 工具，自動注入 session_id 和 project_name
-                if original_tool.name == 'edit_request':
-                    kwargs['session_id'] = session_id
-                    kwargs['project_name'] = project_name
-                    logger.info(f"edit_request 自動注入參數: session_id={session_id}, project_name={project_name}")
-
-                logger.info(f"參數: args={args}, kwargs={kwargs}")
-                try:
-                    result = original_tool.func(*args, **kwargs)
-                    logger.info(f"工具 {original_tool.name} 執行成功，結果長度: {len(str(result))}")
-                    return result
-                except Exception as e:
-                    logger.error(f"工具 {original_tool.name} 執行失敗: {str(e)}", exc_info=True)
-                    raise e
-
-            # 保持原有的工具屬性
-            wrapped_func.name = original_tool.name
-            wrapped_func.description = original_tool.description
-            return wrapped_func
-
-        # 建立包裝後的工具
-        from langchain.tools import tool as tool_decorator
-        wrapped_tool = tool_decorator(
-            description=tool.description
-        )(create_wrapped_tool(tool))
-        # 手動設定工具名稱
-        wrapped_tool.name = tool.name
-        wrapped_tools.append(wrapped_tool)
-
-    # 更新 agent_executor 的工具
-    agent_executor.tools = wrapped_tools
-
-    logger.info("開始執行 agent...")
-    # 執行 agent
-    response = agent_executor.invoke(
-        {
-            "input": user_input,
-            "chat_history": history,
-        }
-    )
-
-    # 儲存 AI 回覆（包含專案資訊）
+def _finish_turn(response: dict, session_id: str, project_name: Optional[str]) -> str:
+    """儲存 AI 回覆並排入摘要更新"""
+    # 儲存 AI 回覆（包含專案資訊）；串流過程中不寫入，完成後只寫一次
     ai_response = response.get("output", "")
     logger.info(f"Agent 執行完成，回應長度: {len(ai_response)} 字元")
 
     save_message_to_db(session_id, "ai", ai_response, project_name)
 
+    # 背景將落出視窗的舊回合併入滾動摘要
+    history.schedule_summary(create_project_session_id(session_id, project_name))
+
     return ai_response
 
 
-def chat_with_ai_stream(
+def _agent_callbacks(event_callback: Optional[EventCallback]) -> List[BaseCallbackHandler]:
+    if not event_callback:
+        return []
+    event_callback("status", "AI 正在分析您的請求...")
+    return [StreamEventHandler(event_callback)]
+
+
+def _run_agent(
     user_input: str,
     session_id: str,
-    project_name: Optional[str] = None,
-    status_callback=None
+    project_name: Optional[str],
+    event_callback: Optional[EventCallback] = None,
 ) -> str:
-    """主聊天函數，支援專案分離和狀態回調"""
-    logger.info(f"開始處理 streaming 聊天請求 - 專案: {project_name}")
+    """儲存使用者訊息、以快取的 agent 執行並儲存 AI 回覆"""
+    chat_history = _prepare_turn(user_input, session_id, project_name)
+    agent_executor = get_agent_executor(project_name)
+    callbacks = _agent_callbacks(event_callback)
 
-    # 初始化 session（包含專案資訊）
-    init_chat_session(session_id, project_name)
+    logger.info("開始執行 agent...")
+    token = _request_context.set({"session_id": session_id})
+    try:
+        response = agent_executor.invoke(
+            {
+                "input": user_input,
+                "chat_history": chat_history,
+            },
+            config={"callbacks": callbacks},
+        )
+    finally:
+        _request_context.reset(token)
 
-    # 儲存使用者訊息
-    save_message_to_db(session_id, "user", user_input, project_name)
-    logger.info("已儲存使用者訊息到資料庫 (stream)")
+    return _finish_turn(response, session_id, project_name)
 
-    # 取得歷史訊息（專案特定）
-    history = load_chat_history(session_id, project_name)
-    logger.info(f"載入聊天歷史，共 {len(history)} 條訊息 (stream)")
 
-    # 建立 agent
-    tools = get_registered_tools()
-    logger.info(f"建立 agent，可用工具: {[tool.name for tool in tools]} (stream)")
+async def _arun_agent(
+    user_input: str,
+    session_id: str,
+    project_name: Optional[str],
+    event_callback: Optional[EventCallback] = None,
+) -> str:
+    """
+    _run_agent 的 asyncio 版本：agent 與 OpenAI 呼叫走 async 路徑，
+    資料庫操作與建立 agent 在 _turn_executor、工具在 _tool_executor 執行，不阻塞 event loop
+    """
+    chat_history = await _run_in(_turn_executor, _prepare_turn, user_input, session_id, project_name)
+    agent_executor = _cached_agent_executor(project_name)
+    if agent_executor is None:
+        agent_executor = await _run_in(_turn_executor, get_agent_executor, project_name)
+    callbacks = _agent_callbacks(event_callback)
+
+    logger.info("開始執行 agent (async)...")
+    token = _request_context.set({"session_id": session_id})
+    try:
+        response = await agent_executor.ainvoke(
+            {
+                "input": user_input,
+                "chat_history": chat_history,
+            },
+            config={"callbacks": callbacks},
+        )
+    finally:
+        _request_context.reset(token)
 
-    agent_executor = build_agent_with_tools(tools, project_name)
+    return await _run_in(_turn_executor, _finish_turn, response, session_id, project_name)
 
-    # 智能處理容器名稱
-    container_name = None
-    if project_name:
-        if project_name.startswith('ai-web-ide_') and project_name.endswith('_container'):
-            container_name = project_name
-        else:
-            container_name = f'ai-web-ide_{project_name}_container'
-
-    # 建立工具名稱映射表
-    tool_name_map = {
-        'get_html_code': '正在讀取 HTML 代碼...',
-        'get_css_code': '正在讀取 CSS 代碼...',
-        'get_js_code': '正在讀取 JavaScript 代碼...',
-        'edit_request': '正在執行代碼編輯任務...'
-    }
 
-    # 包裝工具以自動注入參數
-    original_tools = agent_executor.tools
-    wrapped_tools = []
-
-    for tool in original_tools:
-        def create_wrapped_tool(original_tool):
-            def wrapped_func(*args, **kwargs):
-                # 檢查工具是否需要 'container_name'
-                import inspect
-                tool_params = inspect.signature(original_tool.func).parameters
-
-                if 'container_name' in tool_params and container_name and 'container_name' not in kwargs:
-                    kwargs['container_name'] = container_name
-                    if status_callback:
-                        status_callback(f"正在為專案 '{project_name}' 準備工具...")
-
-                # 特殊處理 edit_request 工具，自動注入參數
-                if original_tool.name == 'edit_request':
-                    kwargs['session_id'] = session_id
-                    kwargs['project_name'] = project_name
-                    if status_callback:
-                        status_callback("正在執行代碼編輯任務...")
-                elif original_tool.name in tool_name_map and status_callback:
-                    status_callback(tool_name_map[original_tool.name])
-
-                return original_tool.func(*args, **kwargs)
-
-            # 保持原有的工具屬性
-            wrapped_func.name = original_tool.name
-            wrapped_func.description = original_tool.description
-            return wrapped_func
-
-        # 建立包裝後的工具
-        from langchain.tools import tool as tool_decorator
-        wrapped_tool = tool_decorator(
-            description=tool.description
-        )(create_wrapped_tool(tool))
-        wrapped_tool.name = tool.name
-        wrapped_tools.append(wrapped_tool)
-
-    # 更新 agent_executor 的工具
-    agent_executor.tools = wrapped_tools
-
-    if status_callback:
-        status_callback("AI 正在分析您的請求...")
-
-    logger.info("開始執行 agent (stream)...")
-    response = agent_executor.invoke(
-        {
-            "input": user_input,
-            "chat_history": history,
-        }
-    )
+def chat_with_ai(
+    user_input: str, session_id: str, project_name: Optional[str] = None
+) -> str:
+    """主聊天函數，支援專案分離"""
+    logger.info(f"開始處理聊天請求 - 專案: {project_name}")
+    return _run_agent(user_input, session_id, project_name)
 
-    # 儲存 AI 回覆（包含專案資訊）
-    ai_response = response.get("output", "")
-    logger.info(f"Agent 執行完成，回應長度: {len(ai_response)} 字元 (stream)")
 
-    save_message_to_db(session_id, "ai", ai_response, project_name)
+def chat_with_ai_stream(
+    user_input: str,
+    session_id: str,
+    project_name: Optional[str] = None,
+    event_callback: Optional[EventCallback] = None,
+) -> str:
+    """
+    主聊天函數，支援專案分離和串流事件回調
+    event_callback 會依序收到狀態、LLM token 與工具開始 / 結束事件，回傳值為完整回覆
+    """
+    logger.info(f"開始處理 streaming 聊天請求 - 專案: {project_name}")
+    return _run_agent(user_input, session_id, project_name, event_callback)
 
-    return ai_response
+
+async def achat_with_ai(
+    user_input: str, session_id: str, project_name: Optional[str] = None
+) -> str:
+    """chat_with_ai 的 asyncio 版本，供 ASGI 服務使用"""
+    logger.info(f"開始處理 async 聊天請求 - 專案: {project_name}")
+    return await _arun_agent(user_input, session_id, project_name)
+
+
+async def achat_with_ai_stream(
+    user_input: str,
+    session_id: str,
+    project_name: Optional[str] = None,
+    event_callback: Optional[EventCallback] = None,
+) -> str:
+    """chat_with_ai_stream 的 asyncio 版本；event_callback 在 event loop 執行緒中被呼叫，不可阻塞"""
+    logger.info(f"開始處理 async streaming 聊天請求 - 專案: {project_name}")
+    return await _arun_agent(user_input, session_id, project_name, event_callback)
 
 
 # ---------- 測試入口 ---------- #
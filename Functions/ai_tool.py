@@ -1,93 +1,220 @@
-import docker
-import tempfile
-import os
-import sys
-from io import StringIO
-from typing import Optional
+from typing import Dict, Optional, Sequence
 import tarfile
 import io
-import sqlite3
-from .sub_agent import run_sub_agent_edit_task  # 你之後會實作的副 agent 邏輯
+import posixpath
+import time
+import uuid
+from . import chat_store
+from . import docker_client
+from . import file_cache
+from . import source_context
+from . import workspace
 from .log_config import get_logger
 
 logger = get_logger(__name__)
 
+# 專案原始碼在容器內的目錄
+SOURCE_DIR = workspace.CONTAINER_DIR
+# 寫入時暫存檔的目錄：與 SOURCE_DIR 在同一個檔案系統（rename 才是原子的），但不在 nginx 提供的目錄內
+STAGING_DIR = posixpath.dirname(SOURCE_DIR)
+# 專案的三個原始碼檔案
+PROJECT_FILES = ("index.html", "index.css", "index.js")
+FILE_LANGUAGES = {"index.html": "HTML", "index.css": "CSS", "index.js": "JavaScript"}
 
-def get_html_code(container_name: str):
-    client = docker.from_env()
-    container = client.containers.get(container_name)
 
-    result = container.exec_run("cat /usr/share/nginx/html/index.html")
-    content = result.output.decode("utf-8")
+def get_html_code(container_name: str, start: Optional[int] = None, end: Optional[int] = None, outline: bool = False):
+    return read_code(container_name, "index.html", start, end, outline)
 
-    # 為每一行添加行數標記，保留所有空行
-    lines = content.splitlines(keepends=True)  # 保留換行符
-    numbered_lines = []
 
-    for i, line in enumerate(lines, 1):
-        # 移除末尾的換行符來顯示，但保留原始結構
-        line_content = line.rstrip('\n\r')
-        numbered_lines.append(f"{i:2d}: {line_content}")
+def get_js_code(container_name: str, start: Optional[int] = None, end: Optional[int] = None, outline: bool = False):
+    return read_code(container_name, "index.js", start, end, outline)
 
-    # 如果原始內容為空或只有換行符，也要顯示行號
-    if not lines:
-        numbered_lines.append("1: ")
 
-    return '\n'.join(numbered_lines)
+def get_css_code(container_name: str, start: Optional[int] = None, end: Optional[int] = None, outline: bool = False):
+    return read_code(container_name, "index.css", start, end, outline)
 
 
-def get_js_code(container_name: str):
-    client = docker.from_env()
-    container = client.containers.get(container_name)
-
-    result = container.exec_run("cat /usr/share/nginx/html/index.js")
-    content = result.output.decode("utf-8")
+def read_code(
+    container_name: str,
+    filename: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    outline: bool = False,
+    max_bytes: int = source_context.VIEW_MAX_BYTES,
+) -> str:
+    """
+    讀取檔案並加上行數標記（保留所有空行）
+    可指定 start/end 行範圍；outline=True 時只列出結構與其行號範圍；
+    輸出超過 max_bytes 時截斷並提示改用行範圍或大綱
+    """
+    try:
+        content = read_source_file(container_name, filename)
+    except FileNotFoundError as e:
+        return str(e)
+    return source_context.render_view(content, FILE_LANGUAGES.get(filename, ""), start, end, max_bytes, outline)
 
-    # 為每一行添加行數標記，保留所有空行
-    lines = content.splitlines(keepends=True)  # 保留換行符
-    numbered_lines = []
 
-    for i, line in enumerate(lines, 1):
-        # 移除末尾的換行符來顯示，但保留原始結構
-        line_content = line.rstrip('\n\r')
-        numbered_lines.append(f"{i:2d}: {line_content}")
+def read_source_file(container_name: str, filename: str, max_age: Optional[float] = None) -> str:
+    """
+    讀取容器內專案檔案的原始內容（不含行號）
+    內容經由 file_cache 快取，只有檔案被外部修改時才會重新 cat 整個檔案；
+    以工作目錄模式建立的專案直接讀取主機上的檔案
 
-    # 如果原始內容為空或只有換行符，也要顯示行號
-    if not lines:
-        numbered_lines.append("1: ")
+    max_age 覆寫快取直接信任的秒數；max_age=0 時一定先向容器確認檔案沒有被外部修改
+    """
+    return read_source_entry(container_name, filename, max_age).content
 
-    return '\n'.join(numbered_lines)
 
+def read_source_entry(container_name: str, filename: str, max_age: Optional[float] = None) -> file_cache.CachedFile:
+    """讀取檔案內容與其快取版本號"""
+    directory = workspace.workspace_dir(container_name)
+    if directory:
+        return workspace.read_file(container_name, directory, filename)
 
-def get_css_code(container_name: str):
-    client = docker.from_env()
-    container = client.containers.get(container_name)
+    path = f"{SOURCE_DIR}/{filename}"
 
-    result = container.exec_run("cat /usr/share/nginx/html/index.css")
-    content = result.output.decode("utf-8")
+    def load():
+        result = docker_client.with_container(container_name, lambda container: container.exec_run(["cat", path]))
+        if result.exit_code != 0:
+            raise FileNotFoundError(f"無法讀取 {path}: {result.output.decode('utf-8').strip()}")
+        return result.output.decode("utf-8")
 
-    # 為每一行添加行數標記，保留所有空行
-    lines = content.splitlines(keepends=True)  # 保留換行符
-    numbered_lines = []
+    def stat():
+        # 檔案不存在時回傳空字串，必定與快取的指紋不同
+        result = docker_client.with_container(
+            container_name, lambda container: container.exec_run(["sha256sum", path])
+        )
+        return result.output.decode("utf-8").split(" ", 1)[0] if result.exit_code == 0 else ""
 
-    for i, line in enumerate(lines, 1):
-        # 移除末尾的換行符來顯示，但保留原始結構
-        line_content = line.rstrip('\n\r')
-        numbered_lines.append(f"{i:2d}: {line_content}")
+    # 指紋是內容雜湊，可由 cat 的結果直接算出：未命中時只需要一次 exec
+    return file_cache.get_cache().get(
+        container_name, path, load, stat, max_age=max_age, fingerprint_of=file_cache.content_digest
+    )
 
-    # 如果原始內容為空或只有換行符，也要顯示行號
-    if not lines:
-        numbered_lines.append("1: ")
 
-    return '\n'.join(numbered_lines)
+def read_project_files(container_name: str, filenames: Sequence[str] = PROJECT_FILES) -> Dict[str, str]:
+    """
+    一次讀取多個專案檔案的原始內容（不含行號）
 
+    快取都還在確認期限內、或專案使用主機工作目錄時直接逐一讀取；否則以一次 get_archive 取得整個原始碼目錄的 tar，
+    在記憶體中解開並填入 file_cache，取代逐一 cat 每個檔案的多次往返。
+    目錄中不存在的檔案不會出現在回傳結果中。
+    """
+    cache = file_cache.get_cache()
+    paths = {name: f"{SOURCE_DIR}/{name}" for name in filenames}
+    cached = {name: cache.peek(container_name, path) for name, path in paths.items()}
+    if workspace.workspace_dir(container_name) or all(entry is not None for entry in cached.values()):
+        files = {}
+        for name in filenames:
+            try:
+                files[name] = read_source_file(container_name, name)
+            except FileNotFoundError:
+                continue
+        return files
+
+    stream, _ = docker_client.with_container(container_name, lambda container: container.get_archive(SOURCE_DIR))
+    archive = io.BytesIO(b"".join(stream))
+
+    contents = {}
+    with tarfile.open(fileobj=archive, mode="r") as tar:
+        for member in tar.getmembers():
+            # 目錄的 tar 以目錄名稱開頭，例如 html/index.html
+            name = member.name.split("/", 1)[-1]
+            if not member.isfile() or name not in paths:
+                continue
+            content = tar.extractfile(member).read().decode("utf-8")
+            cache.record_read(container_name, paths[name], content, file_cache.content_digest(content))
+            contents[name] = content
+
+    logger.info(f"以一次 get_archive 讀取 {container_name} 的 {len(contents)} 個檔案")
+    return {name: contents[name] for name in filenames if name in contents}
+
+
+def get_project_files(container_name: str) -> str:
+    """以一次讀取取得 HTML、CSS、JavaScript 三個檔案，依檔名分段並加上行號"""
+    files = read_project_files(container_name)
+    sections = []
+    for name in PROJECT_FILES:
+        if name in files:
+            # 三個檔案平分輸出上限，過大的檔案會提示改用單一檔案的行範圍或大綱
+            view = source_context.render_view(
+                files[name], FILE_LANGUAGES[name], max_bytes=source_context.VIEW_MAX_BYTES // len(PROJECT_FILES)
+            )
+            sections.append(f"=== {name} ===\n{view}")
+        else:
+            sections.append(f"=== {name} ===\n（檔案不存在）")
+    return "\n\n".join(sections)
+
+
+# 寫入前發現檔案已被外部修改（內容與 expected_digest 不同），沒有寫入
+FileChangedError = workspace.FileChangedError
+
+
+# 目前內容的雜湊與預期不同（或檔案已不存在）時刪除暫存檔並以 _CHANGED_EXIT_CODE 結束，否則改名取代原檔
+_CHANGED_EXIT_CODE = 3
+_CHECKED_RENAME = (
+    'if [ "$(sha256sum "$2" 2>/dev/null | cut -d " " -f 1)" != "$3" ]; then rm -f "$1"; exit 3; fi; '
+    'mv -f "$1" "$2"'
+)
+
+
+def write_source_file(
+    container_name: str, filename: str, content: str, expected_digest: Optional[str] = None
+) -> int:
+    """
+    將檔案內容原子地寫入容器，不需要在主機建立暫存檔
+    先以一次 put_archive 上傳到 STAGING_DIR 的暫存檔名，再以 mv 改名取代原檔：
+    nginx 與其他讀取者只會看到舊的或新的完整內容，不會讀到寫到一半的檔案，
+    殘留的暫存檔也不會被 nginx 對外提供。
+    寫入後直接更新 file_cache，回傳新的快取版本號；
+    以工作目錄模式建立的專案直接寫入主機上的檔案（同樣是寫入暫存檔後改名）
+
+    指定 expected_digest 時，改名前在同一次 exec 中確認目前檔案的內容雜湊仍相同，
+    不同時不寫入並拋出 FileChangedError（讀取-修改-寫入不必事先再 stat 一次）
+    """
+    directory = workspace.workspace_dir(container_name)
+    if directory:
+        return workspace.write_file(container_name, directory, filename, content, expected_digest)
+
+    path = f"{SOURCE_DIR}/{filename}"
+    temp_name = f".{filename}.{uuid.uuid4().hex[:8]}.tmp"
+    data = content.encode("utf-8")
+    info = tarfile.TarInfo(name=temp_name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = int(time.time())
 
-def create_tar_from_file(filepath: str, arcname: str) -> bytes:
     tar_stream = io.BytesIO()
     with tarfile.open(fileobj=tar_stream, mode='w') as tar:
-        tar.add(filepath, arcname=arcname)
-    tar_stream.seek(0)
-    return tar_stream.read()
+        tar.addfile(info, io.BytesIO(data))
+    archive = tar_stream.getvalue()
+
+    temp_path = f"{STAGING_DIR}/{temp_name}"
+
+    def upload_and_rename(container):
+        if not container.put_archive(path=STAGING_DIR, data=archive):
+            raise IOError(f"上傳 {temp_path} 失敗")
+        # 同一個檔案系統內的 rename 是原子操作
+        if expected_digest is None:
+            result = container.exec_run(["mv", "-f", temp_path, path])
+        else:
+            result = container.exec_run(["sh", "-c", _CHECKED_RENAME, "sh", temp_path, path, expected_digest])
+            if result.exit_code == _CHANGED_EXIT_CODE:
+                raise FileChangedError(f"{path} 在讀取後被外部修改，未寫入")
+        if result.exit_code != 0:
+            cleanup = container.exec_run(["rm", "-f", temp_path])
+            if cleanup.exit_code != 0:
+                logger.warning(f"無法刪除暫存檔 {container_name}:{temp_path}: {cleanup.output.decode('utf-8').strip()}")
+            raise IOError(f"寫入 {path} 失敗: {result.output.decode('utf-8').strip()}")
+
+    try:
+        docker_client.with_container(container_name, upload_and_rename)
+    except Exception:
+        file_cache.get_cache().invalidate(container_name, path)
+        raise
+    # 指紋是內容雜湊，寫入後的指紋已知
+    entry = file_cache.get_cache().record_write(container_name, path, content, file_cache.content_digest(content))
+    return entry.version
 
 
 def get_latest_user_message(session_id: str, project_name: Optional[str] = None) -> Optional[str]:
@@ -101,19 +228,9 @@ def get_latest_user_message(session_id: str, project_name: Optional[str] = None)
         full_session_id = session_id
 
     try:
-        conn = sqlite3.connect("chat_history.db")
-        c = conn.cursor()
-        c.execute("""
-            SELECT content FROM messages
-            WHERE session_id = ? AND role = 'user'
-            ORDER BY timestamp DESC
-            LIMIT 1
-        """, (full_session_id,))
-        result = c.fetchone()
-        conn.close()
-
+        result = chat_store.fetch_latest_user_message(full_session_id)
         if result:
-            return result[0]
+            return result
         logger.warning(f"在 session '{full_session_id}' 中找不到使用者訊息")
         return None
     except Exception as e:
@@ -129,5 +246,8 @@ def edit_request(container_name: str, session_id: str, project_name: Optional[st
     if not latest_input:
         return "[❌] 無法取得最近的使用者輸入。請確認聊天歷史存在。"
 
+    # sub_agent 在模組層級 import ai_tool，這裡延後 import 以免形成循環 import
+    from .sub_agent import run_sub_agent_edit_task
+
     logger.info(f"使用最新使用者輸入執行編輯任務: '{latest_input[:100]}...'")
     return run_sub_agent_edit_task(container_name, latest_input)
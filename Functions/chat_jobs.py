@@ -0,0 +1,109 @@
+"""
+聊天回合的伺服器端工作
+
+每個聊天回合都是一個帶有 id 的工作，事件完整保留在 EventChannel 中。
+EventSource 斷線後瀏覽器會自動以同一個網址（含 turn_id）重連，並在 Last-Event-ID 標頭
+帶上最後收到的事件編號；這時只會接上既有工作、從該編號之後繼續送出事件，
+不會再寫入一次使用者訊息或重新執行 agent。
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from .event_channel import EventChannel
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+# 工作結束後保留事件紀錄的秒數，期間內重連仍可取得完整結果
+CHAT_JOB_TTL = float(os.getenv("CHAT_JOB_TTL", "600"))
+
+
+class ChatJob:
+    """一個聊天回合的工作與其事件紀錄"""
+
+    def __init__(self, job_id: str, session_id: str, project_name: Optional[str], user_input: str):
+        self.id = job_id
+        self.session_id = session_id
+        self.project_name = project_name
+        self.user_input = user_input
+        self.channel = EventChannel()
+        self.finished_at: Optional[float] = None
+
+    def publish(self, event_type: str, message: str = "") -> None:
+        self.channel.publish(event_type, message)
+
+    def finish(self, response: str) -> None:
+        """送出最終回覆並結束工作"""
+        self.channel.publish("response", response)
+        self.channel.close()
+        self.finished_at = time.monotonic()
+
+    def fail(self, message: str) -> None:
+        """送出錯誤並結束工作"""
+        self.channel.fail(message)
+        self.finished_at = time.monotonic()
+
+    def belongs_to(self, session_id: str, project_name: Optional[str]) -> bool:
+        return self.session_id == session_id and self.project_name == project_name
+
+
+_jobs: Dict[str, ChatJob] = {}
+_jobs_lock = threading.Lock()
+
+
+def _prune_finished_jobs() -> None:
+    """移除結束超過 CHAT_JOB_TTL 的工作，呼叫時必須持有 _jobs_lock"""
+    now = time.monotonic()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished_at is not None and now - job.finished_at > CHAT_JOB_TTL
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def get_or_create_job(
+    job_id: str,
+    session_id: str,
+    project_name: Optional[str],
+    user_input: str,
+    start: Callable[[ChatJob], None],
+) -> Tuple[ChatJob, bool]:
+    """
+    取得既有工作，或建立新工作並以 start(job) 啟動；同一個 job_id 只會啟動一次
+
+    Returns:
+        (job, created)
+
+    Raises:
+        ValueError: job_id 已屬於其他 session
+    """
+    with _jobs_lock:
+        _prune_finished_jobs()
+        job = _jobs.get(job_id)
+        if job is not None:
+            if not job.belongs_to(session_id, project_name):
+                raise ValueError(f"turn id {job_id} 已被其他對話使用")
+            return job, False
+        job = ChatJob(job_id, session_id, project_name, user_input)
+        _jobs[job_id] = job
+
+    logger.info(f"建立聊天工作 {job_id} - 專案: {project_name}")
+    job.publish("status", "開始處理您的請求...")
+    start(job)
+    return job, True
+
+
+def get_job(job_id: str) -> Optional[ChatJob]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """解析 Last-Event-ID 標頭，無效時視為從頭開始"""
+    try:
+        return max(int(value), 0) if value else 0
+    except ValueError:
+        return 0
@@ -0,0 +1,486 @@
+"""
+聊天紀錄的 SQLite 儲存層
+
+所有對 chat_history.db 的存取都集中在這個模組：
+- 共用一個執行緒安全的連線池，避免每次查詢都重新 connect
+- 每條連線都啟用 WAL 與調校過的 pragma，讀寫不再互相阻塞
+- 以 PRAGMA user_version 記錄 schema 版本，依序執行遷移
+- sessions 表在每次寫入訊息時同步更新，列出 session 不必掃描 messages
+- session_summaries 表保存較舊回合的滾動摘要，以及它涵蓋的訊息 id 範圍
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+DB_PATH = os.getenv("CHAT_DB_PATH", "chat_history.db")
+POOL_SIZE = int(os.getenv("CHAT_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("CHAT_DB_POOL_TIMEOUT", "10"))
+SESSION_TITLE_LENGTH = 50
+
+# 每條新連線都會套用的 pragma
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",       # 約 16MB page cache
+    "PRAGMA mmap_size=134217728",     # 128MB memory-mapped I/O
+)
+
+# messages 表的複合索引，對應各查詢的 WHERE / ORDER BY
+INDEX_STATEMENTS = (
+    "CREATE INDEX IF NOT EXISTS idx_messages_session_time "
+    "ON messages(session_id, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_session_role_time "
+    "ON messages(session_id, role, timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_messages_project_session "
+    "ON messages(project_name, session_id, role, timestamp)",
+)
+
+
+# ---------- Migrations ---------- #
+
+def _migration_1(conn: sqlite3.Connection) -> None:
+    """建立 messages 表，並為舊資料庫補上 project_name 欄位"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            project_name TEXT,
+            role TEXT,
+            content TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+    if "project_name" not in columns:
+        logger.info("升級資料庫結構：添加 project_name 欄位")
+        conn.execute("ALTER TABLE messages ADD COLUMN project_name TEXT")
+
+
+def _migration_2(conn: sqlite3.Connection) -> None:
+    """建立 messages 的複合索引"""
+    for statement in INDEX_STATEMENTS:
+        conn.execute(statement)
+
+
+def _migration_3(conn: sqlite3.Connection) -> None:
+    """建立 sessions 摘要表並從既有訊息回填"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            project_name TEXT,
+            title TEXT,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            last_message_time DATETIME
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sessions_project_time "
+        "ON sessions(project_name, last_message_time)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sessions_time "
+        "ON sessions(last_message_time)"
+    )
+    rebuild_sessions(conn)
+
+
+def _migration_4(conn: sqlite3.Connection) -> None:
+    """建立 session_summaries 滾動摘要表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            content TEXT NOT NULL,
+            first_message_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            message_count INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+# 索引 + 1 即為該遷移完成後的 schema 版本，只能在尾端新增
+MIGRATIONS = (
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+)
+
+
+def rebuild_sessions(conn: sqlite3.Connection) -> None:
+    """
+    依 messages 重新計算整張 sessions 表
+    只在遷移或大量匯入資料後使用；平常由 insert_message 逐筆維護
+    """
+    conn.execute("DELETE FROM sessions")
+    conn.execute(f"""
+        INSERT INTO sessions (session_id, project_name, title, message_count, last_message_time)
+        SELECT
+            m.session_id,
+            MAX(m.project_name),
+            (
+                SELECT substr(f.content, 1, {SESSION_TITLE_LENGTH}) FROM messages f
+                WHERE f.session_id = m.session_id AND f.role = 'user'
+                ORDER BY f.timestamp ASC, f.id ASC
+                LIMIT 1
+            ),
+            COUNT(*),
+            MAX(m.timestamp)
+        FROM messages m
+        WHERE m.role != 'system'
+        GROUP BY m.session_id
+    """)
+
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """依序執行尚未套用的遷移，回傳目前的 schema 版本"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for target_version, migration in enumerate(MIGRATIONS, 1):
+        if target_version <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 取得寫入鎖後再確認一次，避免多個行程重複遷移
+            current = conn.execute("PRAGMA user_version").fetchone()[0]
+            if current < target_version:
+                logger.info(f"執行資料庫遷移 v{target_version}: {migration.__doc__}")
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {target_version}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        version = target_version
+    return version
+
+
+# ---------- Connection Pool ---------- #
+
+class ConnectionPool:
+    """
+    執行緒安全的 SQLite 連線池
+
+    連線以 check_same_thread=False 建立，並在借出期間只由一個執行緒使用；
+    池內最多保留 max_size 條連線，用完時等待其他執行緒歸還。
+    """
+
+    def __init__(self, db_path: str, max_size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.timeout,
+            check_same_thread=False,
+            isolation_level=None,  # 交易由 transaction() 明確控制
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("連線池已關閉")
+            if self._created < self.max_size:
+                self._created += 1
+                create_new = True
+            else:
+                create_new = False
+
+        if create_new:
+            try:
+                return self._connect()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"等待資料庫連線逾時（{self.timeout} 秒）")
+
+    def _release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        with self._lock:
+            if self._closed:
+                self._created -= 1
+                conn.close()
+                return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """借出一條連線，離開 with 區塊時自動歸還"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    def close(self) -> None:
+        """關閉所有閒置連線，借出中的連線會在歸還時關閉"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            conn.close()
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.RLock()
+
+
+def configure(db_path: str = DB_PATH, max_size: int = POOL_SIZE) -> ConnectionPool:
+    """（重新）建立全域連線池並執行遷移；測試與 benchmark 可藉此切換資料庫檔案"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        pool = ConnectionPool(db_path, max_size=max_size)
+        with pool.connection() as conn:
+            run_migrations(conn)
+        _pool = pool
+        return pool
+
+
+def get_pool() -> ConnectionPool:
+    """取得全域連線池，第一次使用時才建立"""
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                configure()
+    return _pool
+
+
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """借出一條連線做唯讀查詢（autocommit）"""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """借出一條連線並包在 BEGIN IMMEDIATE 交易中，成功時 commit，例外時 rollback"""
+    with get_pool().connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+# ---------- Queries ---------- #
+
+def ensure_session(full_session_id: str, project_name: Optional[str], system_content: str) -> bool:
+    """若 session 尚無任何訊息，寫入一筆 system 初始化訊息；回傳是否為新 session"""
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM messages WHERE session_id = ? LIMIT 1", (full_session_id,)
+        ).fetchone()
+        if row is not None:
+            return False
+        conn.execute(
+            "INSERT INTO messages (session_id, project_name, role, content) VALUES (?, ?, ?, ?)",
+            (full_session_id, project_name, "system", system_content),
+        )
+        return True
+
+
+def insert_message(full_session_id: str, project_name: Optional[str], role: str, content: str) -> int:
+    """新增一筆訊息並同步更新 sessions 摘要，回傳訊息 id"""
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO messages (session_id, project_name, role, content) VALUES (?, ?, ?, ?)",
+            (full_session_id, project_name, role, content),
+        )
+        message_id = cursor.lastrowid
+
+        # system 訊息不算實際對話，不計入 sessions
+        if role != "system":
+            title = content[:SESSION_TITLE_LENGTH] if role == "user" else None
+            conn.execute("""
+                INSERT INTO sessions (session_id, project_name, title, message_count, last_message_time)
+                VALUES (?, ?, ?, 1, (SELECT timestamp FROM messages WHERE id = ?))
+                ON CONFLICT(session_id) DO UPDATE SET
+                    project_name = COALESCE(sessions.project_name, excluded.project_name),
+                    title = COALESCE(sessions.title, excluded.title),
+                    message_count = sessions.message_count + 1,
+                    last_message_time = excluded.last_message_time
+            """, (full_session_id, project_name, title, message_id))
+        return message_id
+
+
+def fetch_messages(full_session_id: str) -> List[Tuple[str, str]]:
+    """依時間順序取得 session 的所有 (role, content)"""
+    with connection() as conn:
+        return conn.execute("""
+            SELECT role, content FROM messages
+            WHERE session_id = ?
+            ORDER BY timestamp ASC, id ASC
+        """, (full_session_id,)).fetchall()
+
+
+def fetch_recent_messages(full_session_id: str, limit: int, after_id: int = 0) -> List[Tuple[str, str]]:
+    """由新到舊取得 session 中 id 大於 after_id 的最近 limit 筆使用者 / AI 訊息 (role, content)"""
+    return [(role, content) for _, role, content in fetch_recent_message_rows(full_session_id, limit, after_id)]
+
+
+def fetch_recent_message_rows(full_session_id: str, limit: int, after_id: int = 0) -> List[Tuple[int, str, str]]:
+    """同 fetch_recent_messages，但包含訊息 id：(id, role, content)"""
+    with connection() as conn:
+        return conn.execute("""
+            SELECT id, role, content FROM messages
+            WHERE session_id = ? AND role IN ('user', 'ai') AND id > ?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT ?
+        """, (full_session_id, after_id, limit)).fetchall()
+
+
+def fetch_messages_after(
+    full_session_id: str, after_id: int, limit: int, before_id: Optional[int] = None
+) -> List[Tuple[int, str, str]]:
+    """依時間順序取得 id 大於 after_id（且小於 before_id）的前 limit 筆使用者 / AI 訊息 (id, role, content)"""
+    with connection() as conn:
+        return conn.execute("""
+            SELECT id, role, content FROM messages
+            WHERE session_id = ? AND role IN ('user', 'ai') AND id > ? AND (? IS NULL OR id < ?)
+            ORDER BY id ASC
+            LIMIT ?
+        """, (full_session_id, after_id, before_id, before_id, limit)).fetchall()
+
+
+def count_messages_after(full_session_id: str, after_id: int, before_id: Optional[int] = None) -> int:
+    """計算 id 大於 after_id（且小於 before_id）的使用者 / AI 訊息數"""
+    with connection() as conn:
+        return conn.execute("""
+            SELECT COUNT(*) FROM messages
+            WHERE session_id = ? AND role IN ('user', 'ai') AND id > ? AND (? IS NULL OR id < ?)
+        """, (full_session_id, after_id, before_id, before_id)).fetchone()[0]
+
+
+def fetch_summary(full_session_id: str) -> Optional[Tuple[str, int, int, int]]:
+    """
+    取得 session 的滾動摘要
+    回傳：(content, first_message_id, last_message_id, message_count) 或 None
+    """
+    with connection() as conn:
+        return conn.execute("""
+            SELECT content, first_message_id, last_message_id, message_count
+            FROM session_summaries
+            WHERE session_id = ?
+        """, (full_session_id,)).fetchone()
+
+
+def save_summary(
+    full_session_id: str,
+    content: str,
+    first_message_id: int,
+    last_message_id: int,
+    message_count: int,
+) -> bool:
+    """
+    寫入 session 的滾動摘要，回傳是否寫入成功
+    只接受涵蓋範圍比現有摘要更新的版本；session 已被刪除時不寫入
+    """
+    with transaction() as conn:
+        cursor = conn.execute("""
+            INSERT INTO session_summaries
+                (session_id, content, first_message_id, last_message_id, message_count)
+            SELECT ?, ?, ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM messages WHERE id = ? AND session_id = ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                content = excluded.content,
+                first_message_id = excluded.first_message_id,
+                last_message_id = excluded.last_message_id,
+                message_count = excluded.message_count,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE session_summaries.last_message_id < excluded.last_message_id
+        """, (
+            full_session_id, content, first_message_id, last_message_id, message_count,
+            last_message_id, full_session_id,
+        ))
+        return cursor.rowcount > 0
+
+
+def fetch_latest_user_message(full_session_id: str) -> Optional[str]:
+    """取得 session 中最新一筆使用者訊息內容"""
+    with connection() as conn:
+        row = conn.execute("""
+            SELECT content FROM messages
+            WHERE session_id = ? AND role = 'user'
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        """, (full_session_id,)).fetchone()
+    return row[0] if row else None
+
+
+def fetch_sessions(project_name: Optional[str] = None) -> List[Tuple[str, Optional[str], str, Optional[str], int]]:
+    """
+    取得有實際對話內容（非 system 訊息）的 session，依最後訊息時間新到舊排序
+    回傳：[(session_id, project_name, last_message_time, title, message_count), ...]
+    """
+    with connection() as conn:
+        if project_name is None:
+            return conn.execute("""
+                SELECT session_id, project_name, last_message_time, title, message_count
+                FROM sessions
+                ORDER BY last_message_time DESC
+            """).fetchall()
+        return conn.execute("""
+            SELECT session_id, project_name, last_message_time, title, message_count
+            FROM sessions
+            WHERE project_name = ?
+            ORDER BY last_message_time DESC
+        """, (project_name,)).fetchall()
+
+
+def delete_session_messages(full_session_id: str) -> int:
+    """刪除 session 的所有訊息，回傳刪除筆數"""
+    with transaction() as conn:
+        cursor = conn.execute("DELETE FROM messages WHERE session_id = ?", (full_session_id,))
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (full_session_id,))
+        conn.execute("DELETE FROM session_summaries WHERE session_id = ?", (full_session_id,))
+        return cursor.rowcount
+
+
+def fetch_project_names() -> List[str]:
+    """取得所有有聊天記錄的專案名稱"""
+    with connection() as conn:
+        rows = conn.execute("""
+            SELECT DISTINCT project_name
+            FROM messages
+            WHERE project_name IS NOT NULL AND project_name != ''
+            ORDER BY project_name
+        """).fetchall()
+    return [row[0] for row in rows if row[0]]
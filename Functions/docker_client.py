@@ -0,0 +1,113 @@
+"""
+共用的 Docker client
+
+所有 Docker 操作都透過 get_client() 取得同一個 DockerClient：第一次使用時才建立，
+之後共用同一個連線池，不再每次呼叫都重新讀取環境變數並建立新的連線。
+距離上次確認超過 DOCKER_HEALTH_CHECK_INTERVAL 秒時先 ping daemon，失敗則重新建立 client。
+
+get_container() 以短 TTL 快取 containers.get() 的結果，省去每次操作前查詢容器的往返。
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+import docker
+
+DOCKER_MAX_POOL_SIZE = int(os.getenv("DOCKER_MAX_POOL_SIZE", "20"))
+DOCKER_TIMEOUT = int(os.getenv("DOCKER_TIMEOUT", "60"))
+DOCKER_HEALTH_CHECK_INTERVAL = float(os.getenv("DOCKER_HEALTH_CHECK_INTERVAL", "30"))
+# containers.get() 結果的快取秒數；0 表示不快取
+CONTAINER_CACHE_TTL = float(os.getenv("DOCKER_CONTAINER_CACHE_TTL", "5"))
+
+T = TypeVar("T")
+
+_client: Optional[docker.DockerClient] = None
+_client_checked_at = 0.0
+_client_lock = threading.Lock()
+
+_containers: Dict[str, Tuple[object, float]] = {}
+_containers_lock = threading.Lock()
+
+
+def get_client() -> docker.DockerClient:
+    """取得共用的 DockerClient，第一次使用時才建立；DockerClient 可安全地跨執行緒使用"""
+    global _client, _client_checked_at
+    with _client_lock:
+        now = time.monotonic()
+        if _client is not None and now - _client_checked_at >= DOCKER_HEALTH_CHECK_INTERVAL:
+            try:
+                _client.ping()
+            except Exception:
+                # daemon 重啟或連線中斷，重新建立 client 與連線池
+                _close(_client)
+                _client = None
+                invalidate_container()
+            _client_checked_at = now
+
+        if _client is None:
+            _client = docker.from_env(max_pool_size=DOCKER_MAX_POOL_SIZE, timeout=DOCKER_TIMEOUT)
+            _client_checked_at = now
+        return _client
+
+
+def get_container(name: str):
+    """
+    取得容器物件；CONTAINER_CACHE_TTL 秒內重複查詢同一個容器時直接使用快取
+    容器不存在時拋出 docker.errors.NotFound（不會被快取）
+    """
+    now = time.monotonic()
+    with _containers_lock:
+        cached = _containers.get(name)
+    if cached is not None and now < cached[1]:
+        return cached[0]
+
+    container = get_client().containers.get(name)
+    if CONTAINER_CACHE_TTL > 0:
+        with _containers_lock:
+            _containers[name] = (container, now + CONTAINER_CACHE_TTL)
+    return container
+
+
+def with_container(name: str, action: Callable[[Any], T]) -> T:
+    """
+    以快取的容器物件執行 action；容器已被重建（快取的 id 失效）時重新查詢後再試一次
+    容器仍是同一個時，NotFound 來自 action 本身（例如要找的檔案不存在），直接拋出而不重跑 action
+    """
+    container = get_container(name)
+    try:
+        return action(container)
+    except docker.errors.NotFound:
+        invalidate_container(name)
+        # 容器已被刪除時這裡會拋出 NotFound
+        current = get_container(name)
+        if current.id == container.id:
+            raise
+        return action(current)
+
+
+def invalidate_container(name: Optional[str] = None) -> None:
+    """移除單一容器（或全部）的查詢快取；建立、刪除容器後呼叫"""
+    with _containers_lock:
+        if name is None:
+            _containers.clear()
+        else:
+            _containers.pop(name, None)
+
+
+def reset_client() -> None:
+    """關閉共用的 client，下次使用時重新建立（測試或切換 daemon 時使用）"""
+    global _client
+    with _client_lock:
+        _close(_client)
+        _client = None
+    invalidate_container()
+
+
+def _close(client: Optional[docker.DockerClient]) -> None:
+    if client is None:
+        return
+    try:
+        client.close()
+    except Exception:
+        pass
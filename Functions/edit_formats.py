@@ -0,0 +1,366 @@
+"""
+LLM 修改原始碼時使用的輸出格式
+
+- udiff：unified diff，適合大檔案的局部修改，但 hunk header 的行號與行數最容易出錯
+- search_replace：以原始碼片段定位的 SEARCH/REPLACE 區塊，不需要行號
+- whole_file：直接輸出整份新檔案，只用於小檔案
+
+每種格式都把 LLM 的輸出套用到原始內容、得到新的檔案內容，再統一轉成 unified diff，
+因此之後的驗證與套用（sub_agent.apply_diff）都相同。select_format() 依檔案大小與
+各格式過去的成功率挑選格式。
+"""
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from . import source_context
+from . import unified_diff
+from .unified_diff import PatchError
+
+# 不超過這個行數、且 prompt 中送出完整內容（見 source_context.select_context）的檔案才會使用 whole_file
+WHOLE_FILE_MAX_LINES = int(os.getenv("EDIT_WHOLE_FILE_MAX_LINES", "150"))
+
+# 成功率的先驗值與權重：還沒有足夠紀錄時，依這個順序偏好格式
+PRIOR_SUCCESS_RATES = {"whole_file": 0.9, "search_replace": 0.8, "udiff": 0.6}
+PRIOR_WEIGHT = 3
+
+UDIFF_RULES = """
+### 🎯 Requirements
+
+Your output must strictly follow the **unified diff format**, and be directly usable with Unix's `patch` tool.
+
+---
+
+#### 🔒 1. **HUNK HEADER IS LAW**
+
+* Format: `@@ -old_start,old_lines +new_start,new_lines @@`
+* This line defines the exact starting point and number of lines affected in both the original and modified files.
+
+  * `old_lines`: the number of lines in the original file affected (including deletions and context)
+  * `new_lines`: the number of lines in the new file (including additions and context)
+* **These numbers must be 100% accurate.**
+
+---
+
+#### 📌 2. **CONTEXT IS MANDATORY**
+
+* Include unchanged context lines before and after the changed lines.
+* Context lines are prefixed with a space (` `).
+* A diff with only additions (`+`) or only deletions (`-`) and no context will **fail**.
+
+---
+
+#### 🔄 3. **LINE MODIFICATIONS**
+
+* Use `-` to remove a line:
+  `- <p>Old text</p>`
+* Use `+` to add a line:
+  `+ <p>New text</p>`
+* To replace a line, show both versions:
+
+  ```
+  - <p>Old text</p>
+  + <p>New text</p>
+  ```
+
+---
+
+#### ⚠️ 4. **EVERY LINE MUST END WITH A NEWLINE**
+
+* Every line in the diff must be newline-terminated (`\n`).
+* If your output ends in the middle of a line, the `patch` command will throw an error like:
+  `patch unexpectedly ends in middle of line`
+
+---
+
+#### 📭 5. **IF NO MODIFICATION IS NEEDED**
+
+* If the TODO instructions require no actual change to the source code, output:
+
+  ```
+  SKIP
+  ```
+
+---
+
+### 🧪 Example
+
+#### ✅ Goal: Change the `<title>` content
+
+Original code:
+
+```
+4: <meta charset="UTF-8">
+5: <title>Welcome My Website!</title>
+6: </head>
+```
+
+Desired change:
+
+* Replace line 5 with:
+  `<title>Hello World!</title>`
+
+Analysis:
+
+* Context lines: lines 4 and 6
+* Affected lines: 3 total
+* Hunk header: `@@ -4,3 +4,3 @@`
+
+✅ Final diff:
+
+```
+--- index.html
++++ index.html
+@@ -4,3 +4,3 @@
+    <meta charset="UTF-8">
+-   <title>Welcome My Website!</title>
++   <title>Hello World!</title>
+    </head>
+```
+"""
+
+SEARCH_REPLACE_RULES = """
+### 🎯 Requirements
+
+Describe every change as one or more **SEARCH/REPLACE blocks**:
+
+```
+<<<<<<< SEARCH
+exact lines copied from the original source
+=======
+the lines that replace them
+>>>>>>> REPLACE
+```
+
+* The SEARCH part must be copied **exactly** from the original source, including indentation, and must match only one place in the file.
+* Include just enough lines to make the SEARCH part unique; do not copy the whole file.
+* Do not include line numbers.
+* To insert new code, SEARCH for the neighbouring lines and repeat them in REPLACE together with the new code.
+* To delete code, leave the REPLACE part empty.
+* Use several blocks for changes in different places, in the order they appear in the file.
+* If the TODO instructions require no actual change to the source code, output only `SKIP`.
+
+### 🧪 Example
+
+```
+<<<<<<< SEARCH
+    <title>Welcome My Website!</title>
+=======
+    <title>Hello World!</title>
+>>>>>>> REPLACE
+```
+"""
+
+WHOLE_FILE_RULES = """
+### 🎯 Requirements
+
+Output the **complete new content** of the file inside a single fenced code block.
+
+* Include every line of the file, changed or not. Never abbreviate with comments such as `... rest of the code ...`.
+* Do not include line numbers.
+* Keep unchanged code exactly as it is.
+* If the TODO instructions require no actual change to the source code, output only `SKIP`.
+"""
+
+
+class EditFormat(NamedTuple):
+    name: str
+    # 提示 LLM 要輸出什麼
+    task: str
+    rules: str
+    # prompt 中的原始碼是否加上行號（只有 udiff 需要）
+    numbered_source: bool
+    # (原始內容, LLM 輸出, 檔名) -> (新內容, 本地修正項目)；無法套用時拋出 PatchError
+    apply: Callable[[str, str, str], Tuple[str, List[str]]]
+
+
+def _apply_udiff(original: str, output: str, filename: str) -> Tuple[str, List[str]]:
+    try:
+        return unified_diff.apply_patch(original, output, filename), []
+    except PatchError as e:
+        error = str(e)
+    try:
+        repaired, repairs = unified_diff.repair_diff(original, output, filename)
+        return unified_diff.apply_patch(original, repaired, filename), repairs
+    except PatchError as e:
+        raise PatchError(f"{error}\n本地修正失敗：{str(e)}")
+
+
+SEARCH_REPLACE_PATTERN = re.compile(
+    r"^<{5,9} SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+def parse_search_replace(output: str) -> List[Tuple[str, str]]:
+    """解析 SEARCH/REPLACE 區塊，回傳 [(search, replace)]"""
+    blocks = SEARCH_REPLACE_PATTERN.findall(output)
+    if not blocks:
+        raise PatchError("找不到 SEARCH/REPLACE 區塊；每個修改都必須是 <<<<<<< SEARCH / ======= / >>>>>>> REPLACE 的格式")
+    return blocks
+
+
+def _apply_search_replace(original: str, output: str, filename: str) -> Tuple[str, List[str]]:
+    content = original
+    notes: List[str] = []
+    for number, (search, replace) in enumerate(parse_search_replace(output), 1):
+        if not search.strip():
+            if content.strip():
+                raise PatchError(f"區塊 #{number} 的 SEARCH 是空的；只有空檔案可以不指定 SEARCH")
+            content = replace
+            continue
+
+        # 只接受從行首開始的比對，避免 SEARCH 對到某一行的中間
+        positions = _find_at_line_starts(content, search)
+        if len(positions) == 1:
+            content = content[:positions[0]] + replace + content[positions[0] + len(search):]
+            continue
+        if len(positions) > 1:
+            raise PatchError(
+                f"區塊 #{number} 的 SEARCH 在 {filename} 中出現 {len(positions)} 次，請加入更多前後文讓它只對應一個位置：\n{search}"
+            )
+
+        # 找不到完全相同的內容時，以忽略每行前後空白的方式比對
+        start, end = _find_lines_ignoring_whitespace(content, search)
+        if start is None:
+            raise PatchError(
+                f"區塊 #{number} 的 SEARCH 內容在 {filename} 中找不到，請從原始碼中原樣複製：\n{search}"
+            )
+        content = content[:start] + replace + content[end:]
+        notes.append(f"區塊 #{number}: 以忽略空白差異的方式比對 SEARCH")
+    return content, notes
+
+
+def _find_at_line_starts(content: str, search: str) -> List[int]:
+    positions = []
+    index = content.find(search)
+    while index != -1:
+        if index == 0 or content[index - 1] == "\n":
+            positions.append(index)
+        index = content.find(search, index + 1)
+    return positions
+
+
+def _find_lines_ignoring_whitespace(content: str, search: str):
+    """回傳唯一一段逐行（忽略前後空白）與 search 相同的內容的字元範圍；找不到或不唯一時回傳 (None, None)"""
+    lines = content.splitlines(keepends=True)
+    wanted = [line.strip() for line in search.splitlines()]
+    matches = [
+        i for i in range(len(lines) - len(wanted) + 1)
+        if all(lines[i + j].strip() == wanted[j] for j in range(len(wanted)))
+    ]
+    if len(matches) != 1:
+        return None, None
+    start = sum(len(line) for line in lines[:matches[0]])
+    end = start + sum(len(line) for line in lines[matches[0]:matches[0] + len(wanted)])
+    # search 不以換行結尾時，比對範圍不包含最後一行的換行
+    if not search.endswith("\n") and lines[matches[0] + len(wanted) - 1].endswith("\n"):
+        end -= 1
+    return start, end
+
+
+FENCED_BLOCK_PATTERN = re.compile(r"^```[^\n]*\n(.*?)^```", re.DOTALL | re.MULTILINE)
+ELISION_PATTERN = re.compile(r"(\.\.\.|…)\s*(rest of|existing|unchanged|省略|其餘|其他)", re.IGNORECASE)
+
+
+def _apply_whole_file(original: str, output: str, filename: str) -> Tuple[str, List[str]]:
+    match = FENCED_BLOCK_PATTERN.search(output)
+    content = match.group(1) if match else output.strip("\n") + "\n"
+    if not content.strip() and original.strip():
+        raise PatchError(f"輸出的 {filename} 是空的；請輸出完整的新檔案內容")
+    elided = [line.strip() for line in content.splitlines() if ELISION_PATTERN.search(line)]
+    if elided and not ELISION_PATTERN.search(original):
+        raise PatchError(f"輸出的 {filename} 省略了部分內容（{elided[0]}）；請輸出完整檔案，不要省略任何程式碼")
+    # 單獨的 `...` 也可能代表省略：檔案變短且多出原本沒有的 `...` 時視為截斷
+    if len(content.splitlines()) < len(original.splitlines()) and _ellipses(content) > _ellipses(original):
+        elided = next(line.strip() for line in content.splitlines() if "..." in line or "…" in line)
+        raise PatchError(f"輸出的 {filename} 比原檔短且含有 `...`（{elided}），疑似省略了部分內容；請輸出完整檔案")
+    return content, []
+
+
+def _ellipses(text: str) -> int:
+    return text.count("...") + text.count("…")
+
+
+FORMATS: Dict[str, EditFormat] = {
+    "udiff": EditFormat(
+        "udiff",
+        "Your task is to write a **valid and precise unified diff** (`diff -u` format) that applies the required changes to the following source code:",
+        UDIFF_RULES,
+        True,
+        _apply_udiff,
+    ),
+    "search_replace": EditFormat(
+        "search_replace",
+        "Your task is to write **SEARCH/REPLACE blocks** that apply the required changes to the following source code:",
+        SEARCH_REPLACE_RULES,
+        False,
+        _apply_search_replace,
+    ),
+    "whole_file": EditFormat(
+        "whole_file",
+        "Your task is to output the **complete updated file** after applying the required changes to the following source code:",
+        WHOLE_FILE_RULES,
+        False,
+        _apply_whole_file,
+    ),
+}
+
+
+# ---------- 格式選擇與成功率 ---------- #
+
+_format_stats = {name: {"attempts": 0, "successes": 0, "tokens": 0} for name in FORMATS}
+_format_stats_lock = threading.Lock()
+
+
+def eligible_formats(source: str) -> List[str]:
+    """
+    依檔案大小列出可用的格式
+    whole_file 要求輸出整份檔案，只有在 prompt 中送出完整內容時才可用；
+    否則模型看到的是省略了部分行的片段，重寫整份檔案會遺失內容
+    """
+    names = ["search_replace", "udiff"]
+    if len(source.splitlines()) <= WHOLE_FILE_MAX_LINES and source_context.shows_full_source(source):
+        names.insert(0, "whole_file")
+    return names
+
+
+def success_rate(name: str) -> float:
+    """以先驗值平滑後的成功率"""
+    with _format_stats_lock:
+        stats = _format_stats[name]
+        return (stats["successes"] + PRIOR_SUCCESS_RATES[name] * PRIOR_WEIGHT) / (stats["attempts"] + PRIOR_WEIGHT)
+
+
+def select_format(source: str, exclude: Iterable[str] = ()) -> EditFormat:
+    """
+    挑選修改 source 時要使用的格式：在依檔案大小可用的格式中選成功率最高者
+    exclude 為這次已經失敗過的格式；全部都排除時仍從可用格式中挑選
+    """
+    names = eligible_formats(source)
+    candidates = [name for name in names if name not in set(exclude)] or names
+    # 成功率相同時依 eligible_formats 的順序
+    return FORMATS[max(candidates, key=lambda name: (success_rate(name), -names.index(name)))]
+
+
+def record_result(name: str, success: bool, tokens: int = 0) -> None:
+    """記錄一次格式使用結果與所花費的 tokens"""
+    with _format_stats_lock:
+        stats = _format_stats[name]
+        stats["attempts"] += 1
+        stats["successes"] += int(success)
+        stats["tokens"] += tokens
+
+
+def format_metrics() -> Dict[str, Dict[str, float]]:
+    """各格式的嘗試次數、成功率與每次成功套用平均花費的 tokens"""
+    with _format_stats_lock:
+        return {
+            name: {
+                "attempts": stats["attempts"],
+                "success_rate": stats["successes"] / stats["attempts"] if stats["attempts"] else 0.0,
+                "tokens_per_applied_edit": stats["tokens"] / stats["successes"] if stats["successes"] else 0.0,
+            }
+            for name, stats in _format_stats.items()
+        }
@@ -0,0 +1,140 @@
+"""
+串流事件通道
+
+聊天執行緒以 publish() 推送事件，SSE generator 以 subscribe()（或 asyncio 版本的 asubscribe()）
+等待新事件：有事件時立即送出，沒有事件時每隔 heartbeat_interval 秒產生一次 HEARTBEAT 維持連線，
+直到生產端呼叫 close()（完成）或 fail()（錯誤）為止。
+"""
+import asyncio
+import json
+import os
+import threading
+from typing import AsyncIterator, Iterator, List, NamedTuple, Tuple
+
+HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+
+class Event(NamedTuple):
+    id: int
+    type: str
+    message: str
+
+
+# 沒有新事件時由 subscribe() 產生，不會存入事件紀錄
+HEARTBEAT = Event(0, "heartbeat", "")
+
+
+class EventChannel:
+    """
+    執行緒安全的事件通道
+
+    事件依序編號並保留在通道內，訂閱者可從任意編號之後開始讀取；
+    close() 與 fail() 是結束訊號，之後不能再 publish。
+    """
+
+    def __init__(self):
+        self._events: List[Event] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        # asubscribe() 的等待者；狀態改變時透過 call_soon_threadsafe 喚醒
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def _notify(self) -> None:
+        """喚醒所有等待者，呼叫時必須持有 self._cond"""
+        self._cond.notify_all()
+        for loop, waiter in self._async_waiters:
+            loop.call_soon_threadsafe(waiter.set)
+        self._async_waiters.clear()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def publish(self, event_type: str, message: str = "") -> Event:
+        """推送一個事件並喚醒所有等待中的訂閱者"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("事件通道已關閉，無法再推送事件")
+            event = Event(len(self._events) + 1, event_type, message)
+            self._events.append(event)
+            self._notify()
+        return event
+
+    def close(self) -> None:
+        """完成訊號：訂閱者讀完剩餘事件後結束"""
+        with self._cond:
+            self._closed = True
+            self._notify()
+
+    def fail(self, message: str) -> None:
+        """錯誤訊號：推送一個 error 事件並關閉通道"""
+        with self._cond:
+            if not self._closed:
+                self._events.append(Event(len(self._events) + 1, "error", message))
+            self._closed = True
+            self._notify()
+
+    def subscribe(self, after: int = 0, heartbeat_interval: float = HEARTBEAT_INTERVAL) -> Iterator[Event]:
+        """
+        依序產生編號大於 after 的事件；等待超過 heartbeat_interval 秒時產生 HEARTBEAT
+        通道關閉且事件都讀完後結束
+        """
+        cursor = after
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: cursor < len(self._events) or self._closed,
+                    timeout=heartbeat_interval,
+                )
+                pending = self._events[cursor:]
+                closed = self._closed
+
+            if pending:
+                for event in pending:
+                    cursor = event.id
+                    yield event
+            elif closed:
+                return
+            else:
+                yield HEARTBEAT
+
+    async def asubscribe(self, after: int = 0, heartbeat_interval: float = HEARTBEAT_INTERVAL) -> AsyncIterator[Event]:
+        """subscribe() 的 asyncio 版本：等待時不佔用執行緒"""
+        loop = asyncio.get_running_loop()
+        cursor = after
+        while True:
+            waiter = asyncio.Event()
+            with self._cond:
+                pending = self._events[cursor:]
+                closed = self._closed
+                if not pending and not closed:
+                    self._async_waiters.append((loop, waiter))
+
+            if pending:
+                for event in pending:
+                    cursor = event.id
+                    yield event
+                continue
+            if closed:
+                return
+
+            try:
+                await asyncio.wait_for(waiter.wait(), timeout=heartbeat_interval)
+            except asyncio.TimeoutError:
+                with self._cond:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+                yield HEARTBEAT
+
+
+def format_sse(event: Event) -> str:
+    """
+    將事件轉成 Server-Sent Events 格式；HEARTBEAT 轉成註解行
+    有編號的事件會帶上 id 欄位，瀏覽器重連時會以 Last-Event-ID 回傳最後收到的編號
+    """
+    if event is HEARTBEAT:
+        return ": keep-alive\n\n"
+    data = json.dumps({"type": event.type, "message": event.message}, ensure_ascii=False)
+    if event.id:
+        return f"id: {event.id}\ndata: {data}\n\n"
+    return f"data: {data}\n\n"
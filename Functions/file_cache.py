@@ -0,0 +1,165 @@
+"""
+專案檔案的行程內快取
+
+以 (容器, 路徑) 為 key 保存檔案內容、內容雜湊與版本號。快取只在兩種情況下失效：
+- 我們自己寫入檔案（record_write 直接更新內容並遞增版本號）
+- 偵測到外部修改：距離上次確認超過 FILE_CACHE_REVALIDATE_SECONDS 秒時，
+  以 stat 取得檔案指紋（例如內容雜湊），指紋改變才重新讀取整個檔案
+
+指紋能由內容算出時（fingerprint_of），未命中只需要一次讀取，不必先 stat。
+
+FILE_CACHE_ENABLED=0 可停用快取，每次都直接讀取。
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+FILE_CACHE_ENABLED = os.getenv("FILE_CACHE_ENABLED", "1") != "0"
+# 在這段時間內直接信任快取，不向容器確認檔案是否被外部修改
+FILE_CACHE_REVALIDATE_SECONDS = float(os.getenv("FILE_CACHE_REVALIDATE_SECONDS", "10"))
+
+
+class CachedFile(NamedTuple):
+    content: str
+    digest: str
+    # 內容每改變一次加一（不論是我們寫入或外部修改）
+    version: int
+    # stat 指紋；None 表示寫入時指紋未知，下次確認時直接採用當時的指紋
+    fingerprint: Optional[str]
+    checked_at: float
+
+
+def content_digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class FileCache:
+    """執行緒安全的檔案快取；讀取與 stat 由呼叫端提供，不直接依賴 Docker"""
+
+    def __init__(self, revalidate_seconds: float = FILE_CACHE_REVALIDATE_SECONDS, enabled: bool = FILE_CACHE_ENABLED):
+        self.revalidate_seconds = revalidate_seconds
+        self.enabled = enabled
+        self._entries: Dict[Tuple[str, str], CachedFile] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "revalidations": 0, "external_changes": 0, "writes": 0}
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def get(
+        self,
+        container: str,
+        path: str,
+        load: Callable[[], str],
+        stat: Optional[Callable[[], str]] = None,
+        max_age: Optional[float] = None,
+        fingerprint_of: Optional[Callable[[str], str]] = None,
+    ) -> CachedFile:
+        """
+        取得檔案內容；快取過期時以 stat 確認檔案是否被外部修改
+
+        Args:
+            load: 讀取整個檔案內容
+            stat: 取得檔案指紋；未提供時快取過期就重新讀取
+            max_age: 覆寫 revalidate_seconds，例如本機檔案的 stat 很便宜，可設為 0 每次都確認
+            fingerprint_of: 由讀到的內容算出與 stat 相同的指紋（例如內容雜湊），未命中時不必另外 stat
+        """
+        key = (container, path)
+        with self._lock:
+            entry = self._entries.get(key) if self.enabled else None
+
+        now = time.monotonic()
+        if entry is not None:
+            if now - entry.checked_at < (self.revalidate_seconds if max_age is None else max_age):
+                self._count("hits")
+                return entry
+
+            if stat is not None:
+                fingerprint = stat()
+                self._count("revalidations")
+                if entry.fingerprint is None or fingerprint == entry.fingerprint:
+                    entry = entry._replace(fingerprint=fingerprint, checked_at=now)
+                    self._store(key, entry)
+                    self._count("hits")
+                    return entry
+                self._count("external_changes")
+
+        if fingerprint_of is not None:
+            content = load()
+            fingerprint = fingerprint_of(content)
+        else:
+            # 先取得指紋再讀取：讀取期間若又被修改，下次確認時指紋會不同而重新讀取
+            fingerprint = stat() if stat is not None and self.enabled else None
+            content = load()
+        self._count("misses")
+        return self._update(key, content, fingerprint, now)
+
+    def peek(self, container: str, path: str) -> Optional[CachedFile]:
+        """回傳仍在確認期限內的快取，不讀取也不計入統計；需要確認或尚未快取時回傳 None"""
+        with self._lock:
+            entry = self._entries.get((container, path)) if self.enabled else None
+        if entry is None or time.monotonic() - entry.checked_at >= self.revalidate_seconds:
+            return None
+        return entry
+
+    def record_read(self, container: str, path: str, content: str, fingerprint: Optional[str]) -> CachedFile:
+        """以其他方式（例如一次讀取整個目錄）取得的檔案內容填入快取"""
+        self._count("misses")
+        return self._update((container, path), content, fingerprint, time.monotonic())
+
+    def record_write(self, container: str, path: str, content: str, fingerprint: Optional[str] = None) -> CachedFile:
+        """我們寫入檔案後呼叫，直接以寫入的內容更新快取；fingerprint 為寫入時已知的指紋"""
+        self._count("writes")
+        return self._update((container, path), content, fingerprint, time.monotonic())
+
+    def invalidate(self, container: str, path: Optional[str] = None) -> None:
+        """移除單一檔案或整個容器的快取"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == container and path in (None, key[1])]:
+                del self._entries[key]
+
+    def version(self, container: str, path: str) -> int:
+        """目前快取中的版本號；尚未快取時為 0"""
+        with self._lock:
+            entry = self._entries.get((container, path))
+        return entry.version if entry else 0
+
+    def stats(self) -> Dict[str, float]:
+        """命中、未命中、確認與外部修改次數，以及命中率"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _store(self, key: Tuple[str, str], entry: CachedFile) -> None:
+        if self.enabled:
+            with self._lock:
+                self._entries[key] = entry
+
+    def _update(self, key: Tuple[str, str], content: str, fingerprint: Optional[str], now: float) -> CachedFile:
+        digest = content_digest(content)
+        with self._lock:
+            previous = self._entries.get(key)
+            version = 1 if previous is None else previous.version + (previous.digest != digest)
+            entry = CachedFile(content, digest, version, fingerprint, now)
+            if self.enabled:
+                self._entries[key] = entry
+        return entry
+
+
+# 整個行程共用的快取
+_cache = FileCache()
+
+
+def get_cache() -> FileCache:
+    return _cache
+
+
+def cache_stats() -> Dict[str, float]:
+    """共用快取的命中統計"""
+    return _cache.stats()
@@ -0,0 +1,258 @@
+"""
+送進 agent 的聊天歷史挑選
+
+長對話若整段塞進 prompt，成本與延遲會無上限地成長，最後超出 context window。
+這裡以 tiktoken 計算 token 數，從最新的回合往回挑，直到用完預算為止。
+
+較舊、已落在視窗外的回合則在背景折疊成一份滾動摘要（存於 session_summaries），
+只要有訊息落出視窗就會併入既有摘要（不會從頭重算），prompt 永遠是「摘要 + 最近回合」。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import tiktoken
+from langchain.prompts import ChatPromptTemplate
+
+from . import chat_store
+from . import llm_client
+from .log_config import get_logger
+
+logger = get_logger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))
+HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", "20"))
+
+# 每次摘要至少折疊幾則訊息（落出視窗的不足時，連同視窗最前面的整回合一起折疊以減少摘要次數），
+# 以及單次最多折疊幾則
+SUMMARY_TRIGGER_MESSAGES = int(os.getenv("CHAT_SUMMARY_TRIGGER_MESSAGES", "20"))
+SUMMARY_MAX_FOLD_MESSAGES = int(os.getenv("CHAT_SUMMARY_MAX_FOLD_MESSAGES", "200"))
+SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4o-mini")
+
+# OpenAI chat 格式中每則訊息除了內容之外的固定開銷
+TOKENS_PER_MESSAGE = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str) -> Optional["tiktoken.Encoding"]:
+    """
+    取得模型的 tokenizer；第一次使用時 tiktoken 需要下載編碼檔，
+    離線或被 proxy 擋下時回傳 None（結果會被快取，不會每次都重試下載）
+    """
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"無法載入 tiktoken 編碼（{model}），改以字元數估算 token：{str(e)}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """計算文字在指定模型下的 token 數；tokenizer 無法載入時以每 4 個字元約 1 個 token 估算"""
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(content: str, model: str = "gpt-4o") -> int:
+    """計算單則聊天訊息（含格式開銷）的 token 數"""
+    return count_tokens(content, model) + TOKENS_PER_MESSAGE
+
+
+def select_recent_turns(
+    rows_newest_first: Sequence[Tuple[str, str]],
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    max_turns: int = HISTORY_MAX_TURNS,
+) -> List[Tuple[str, str]]:
+    """
+    從最新往回挑選完整的對話回合（以一則 user 訊息開頭），直到超出 token 預算或回合數上限
+
+    Args:
+        rows_newest_first: 由新到舊排列的 (role, content)
+        token_budget: 可使用的 token 上限
+        max_turns: 最多保留的回合數
+
+    Returns:
+        依時間順序（舊到新）排列的 (role, content)
+    """
+    selected: List[Tuple[str, str]] = []
+    turn: List[Tuple[str, str]] = []
+    turn_tokens = 0
+    used_tokens = 0
+    turns = 0
+
+    for role, content in rows_newest_first:
+        turn.append((role, content))
+        turn_tokens += count_message_tokens(content)
+
+        # 往回走到 user 訊息代表一個回合已完整
+        if role != "user":
+            continue
+        if turns >= max_turns or used_tokens + turn_tokens > token_budget:
+            break
+        selected.extend(turn)
+        used_tokens += turn_tokens
+        turns += 1
+        turn = []
+        turn_tokens = 0
+
+    selected.reverse()
+    return selected
+
+
+# ---------- Rolling Summary ---------- #
+
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+# 正在摘要的 session → 摘要期間是否又有新的請求（需要再檢查一次）
+_pending_sessions: Dict[str, bool] = {}
+_pending_lock = threading.Lock()
+
+SUMMARY_SYSTEM_MESSAGE = """You maintain a running summary of a conversation between a user and an AI web-development assistant.
+
+Merge the new conversation excerpt into the existing summary and output only the updated summary, written in Traditional Chinese.
+
+Keep:
+- The user's goals, requirements and stated preferences
+- Changes already made to the project (HTML elements, CSS classes, JavaScript functions, ids)
+- Open questions and unresolved problems
+
+Drop greetings, repeated content and tool output details. Keep the summary under 400 words.
+"""
+
+
+def summary_message_text(content: str, covered_count: int) -> str:
+    """滾動摘要放進 prompt 時的文字"""
+    return f"先前對話摘要（共 {covered_count} 則訊息）：\n{content}"
+
+
+def select_window(
+    full_session_id: str,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    max_turns: int = HISTORY_MAX_TURNS,
+) -> Tuple[Optional[Tuple[str, int, int, int]], List[Tuple[int, str, str]]]:
+    """
+    挑選送進 agent 的視窗：滾動摘要（若有）加上摘要之後、在剩餘 token 預算內的最近回合
+    只從資料庫倒序讀取最近 max_turns 個回合（一個回合通常是一則 user + 一則 ai 訊息）
+
+    Returns:
+        (摘要 (content, first_message_id, last_message_id, message_count) 或 None,
+         依時間順序排列的 (id, role, content))
+    """
+    summary = chat_store.fetch_summary(full_session_id)
+    covered_until = 0
+    if summary:
+        content, _, covered_until, covered_count = summary
+        token_budget -= count_message_tokens(summary_message_text(content, covered_count))
+
+    rows = chat_store.fetch_recent_message_rows(full_session_id, max_turns * 2, covered_until)
+    selected = select_recent_turns([(role, content) for _, role, content in rows], max(token_budget, 0), max_turns)
+    # select_recent_turns 從最新往回挑，保留的一定是 rows 的前 len(selected) 則
+    return summary, rows[:len(selected)][::-1]
+
+
+def schedule_summary(
+    full_session_id: str,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    max_turns: int = HISTORY_MAX_TURNS,
+) -> bool:
+    """
+    在背景更新 session 的滾動摘要；同一 session 同時只會有一個摘要工作
+    token_budget 與 max_turns 需與載入歷史時相同，摘要才會剛好銜接視窗
+    已有摘要工作在執行時不另外排入，而是讓該工作結束前再檢查一次，期間落出視窗的訊息不會被遺漏
+
+    回傳是否有排入新的工作
+    """
+    with _pending_lock:
+        if full_session_id in _pending_sessions:
+            _pending_sessions[full_session_id] = True
+            return False
+        _pending_sessions[full_session_id] = False
+
+    _summary_executor.submit(_run_summary, full_session_id, token_budget, max_turns)
+    return True
+
+
+def _run_summary(full_session_id: str, token_budget: int, max_turns: int) -> None:
+    """重複摘要，直到沒有新的請求、且視窗外已沒有尚未摘要的訊息"""
+    try:
+        while True:
+            folded = _update_summary(full_session_id, token_budget, max_turns)
+            with _pending_lock:
+                if not folded and not _pending_sessions[full_session_id]:
+                    del _pending_sessions[full_session_id]
+                    return
+                _pending_sessions[full_session_id] = False
+    except BaseException:
+        with _pending_lock:
+            _pending_sessions.pop(full_session_id, None)
+        raise
+
+
+def _update_summary(
+    full_session_id: str,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    max_turns: int = HISTORY_MAX_TURNS,
+) -> bool:
+    """把落出視窗的訊息併入滾動摘要，回傳是否寫入了新的摘要"""
+    try:
+        summary, window = select_window(full_session_id, token_budget, max_turns)
+        previous_content, first_id, last_id, covered_count = summary or ("", 0, 0, 0)
+
+        # 視窗保留的最舊訊息之前、尚未摘要的訊息都已不在 prompt 中，一則都不能等，需要立刻併入摘要；
+        # 視窗是空的（單一回合就超出預算）時，摘要之後的所有訊息都需要併入
+        boundary = window[0][0] if window else None
+        pending = chat_store.count_messages_after(full_session_id, last_id, boundary)
+        if pending == 0:
+            return False
+
+        # 落出視窗的訊息不足一批時，順便折疊視窗最前面的整回合（至少保留最新一回合），
+        # 讓視窗多出空間，不會每個新回合都觸發一次摘要
+        extend = 0
+        if pending < SUMMARY_TRIGGER_MESSAGES:
+            turn_starts = [index for index, (_, role, _) in enumerate(window) if role == "user" and index > 0]
+            for index in turn_starts:
+                if pending + index > SUMMARY_MAX_FOLD_MESSAGES:
+                    break
+                extend = index
+                if pending + index >= SUMMARY_TRIGGER_MESSAGES:
+                    break
+            if extend:
+                boundary = window[extend][0]
+        fold_count = min(pending + extend, SUMMARY_MAX_FOLD_MESSAGES)
+
+        rows = chat_store.fetch_messages_after(full_session_id, last_id, fold_count, boundary)
+        transcript = "\n".join(
+            f"{'使用者' if role == 'user' else 'AI'}：{content}" for _, role, content in rows
+        )
+        human_message = (
+            f"Existing summary:\n{previous_content or '(none)'}\n\n"
+            f"New conversation excerpt:\n{transcript}"
+        )
+
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", SUMMARY_SYSTEM_MESSAGE),
+            ("human", "{excerpt}"),
+        ])
+        llm = llm_client.get_chat_model(SUMMARY_MODEL, temperature=0)
+        response = llm.invoke(prompt.format_messages(excerpt=human_message))
+
+        saved = chat_store.save_summary(
+            full_session_id,
+            response.content.strip(),
+            first_message_id=first_id or rows[0][0],
+            last_message_id=rows[-1][0],
+            message_count=covered_count + len(rows),
+        )
+        logger.info(
+            f"更新滾動摘要 {full_session_id}：併入 {len(rows)} 則訊息"
+            f"（涵蓋至 id {rows[-1][0]}），{'已寫入' if saved else '已有較新版本，略過'}"
+        )
+        return saved
+    except Exception as e:
+        logger.error(f"更新滾動摘要失敗 {full_session_id}: {str(e)}", exc_info=True)
+        return False
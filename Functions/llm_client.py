@@ -0,0 +1,108 @@
+"""
+共用的 OpenAI 連線與 chat model
+
+所有 ChatOpenAI 都透過 get_chat_model() 取得：相同設定的 model 只建立一次，
+並共用同一個 httpx 連線池，避免每個請求都重新建立 client 與 TLS 連線。
+"""
+import asyncio
+import os
+import threading
+import weakref
+from functools import lru_cache
+from typing import Callable, Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_TIMEOUT = float(os.getenv("OPENAI_HTTP_TIMEOUT", "120"))
+
+_http_client: Optional[httpx.Client] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_http_client_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """取得共用的 httpx 連線池，第一次使用時才建立"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    limits=_limits(),
+                    timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+                )
+    return _http_client
+
+
+class _PerLoopTransport(httpx.AsyncBaseTransport):
+    """
+    每個 event loop 各自一個連線池
+    httpx 的 async 連線綁定建立它的 event loop，跨 loop 重複使用會出現 "attached to a different loop"；
+    ChatOpenAI 由多個 loop 共用（ASGI 的 loop、測試或其他地方的 asyncio.run），因此連線池依 loop 分開
+    """
+
+    def __init__(self, factory: Callable[[], httpx.AsyncBaseTransport]):
+        self._factory = factory
+        self._transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncBaseTransport]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def _current(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                transport = self._transports[loop] = self._factory()
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self) -> None:
+        """只能關閉目前 event loop 的連線池；其他 loop 結束後其連線池會隨之被回收"""
+        with self._lock:
+            transport = self._transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    取得共用的 async httpx client（供 ASGI 服務的 ainvoke 使用）
+    底下的連線池依 event loop 分開，可安全地在不同的 event loop 中使用
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        with _http_client_lock:
+            if _async_http_client is None:
+                _async_http_client = httpx.AsyncClient(
+                    transport=_PerLoopTransport(lambda: httpx.AsyncHTTPTransport(limits=_limits())),
+                    timeout=httpx.Timeout(HTTP_TIMEOUT, connect=10.0),
+                )
+    return _async_http_client
+
+
+@lru_cache(maxsize=16)
+def get_chat_model(model: str = "gpt-4o", temperature: float = 0, streaming: bool = False) -> ChatOpenAI:
+    """
+    取得共用的 ChatOpenAI；ChatOpenAI 可安全地跨執行緒重複使用
+    streaming=True 時 invoke 也會以串流方式呼叫 API，逐 token 觸發 on_llm_new_token 回調
+    """
+    return ChatOpenAI(
+        model=model,
+        temperature=temperature,
+        streaming=streaming,
+        api_key=os.getenv("OPENAI_API_KEY"),
+        http_client=get_http_client(),
+        http_async_client=get_async_http_client(),
+    )
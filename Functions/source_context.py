@@ -0,0 +1,444 @@
+"""
+依 TODO 挑選送進 prompt 的原始碼範圍
+
+小檔案直接送出完整內容；大檔案只送出與 TODO 相關的區段（保留真實行號），
+其餘部分以精簡的大綱（元素、選擇器、函式所在的行）表示，讓 prompt 大小不再隨頁面線性成長。
+相關區段以 TODO 與 note 中提到的 id、class、選擇器、函式名稱、標籤與引號內的文字定位：
+符號索引（symbol_index）已記錄位置的名稱直接取用其行號範圍，其餘才逐行搜尋。
+
+render_view() 是讀取工具（get_html_code 等）共用的輸出：指定行範圍、位元組上限，
+或只列出結構大綱（outline_spans）與其行號範圍，讓 agent 不必一次讀入整個大檔案。
+"""
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# 不超過這個行數的檔案直接送出完整內容
+CONTEXT_FULL_MAX_LINES = int(os.getenv("SOURCE_CONTEXT_FULL_MAX_LINES", "200"))
+# 每個命中行前後保留的行數
+CONTEXT_RADIUS = int(os.getenv("SOURCE_CONTEXT_RADIUS", "8"))
+# 相關區段合計最多送出的行數
+CONTEXT_MAX_LINES = int(os.getenv("SOURCE_CONTEXT_MAX_LINES", "400"))
+# 找不到相關區段時，檔案開頭與結尾各送出的行數（新增內容通常放在這些位置）
+CONTEXT_EDGE_LINES = 20
+
+_BACKTICK_PATTERN = re.compile(r"`([^`\n]+)`")
+_QUOTED_PATTERN = re.compile(r"['\"“「]([^'\"”」\n]{2,60})['\"”」]")
+_SELECTOR_PATTERN = re.compile(r"(?<![\w])[#.]([A-Za-z_][\w-]+)")
+_ATTRIBUTE_PATTERN = re.compile(r"\b(?:id|class)\s*=\s*['\"]([^'\"]+)['\"]")
+_TAG_PATTERN = re.compile(r"<\s*([A-Za-z][\w-]*)")
+_CALL_PATTERN = re.compile(r"\b([A-Za-z_$][\w$]*)\s*\(")
+# camelCase、snake_case、kebab-case 等看起來像程式識別字的詞
+_IDENTIFIER_PATTERN = re.compile(r"\b[A-Za-z_$][\w$]*(?:[A-Z_$-][\w$]*)+\b")
+_NOTE_PATTERN = re.compile(r"^\s*[\w-]+\s*:\s*([^\s-][^\s]*)\s+-")
+
+# 太常見、會命中大量行的詞
+_COMMON_WORDS = {
+    "div", "span", "html", "head", "body", "script", "style", "link", "meta", "title",
+    "class", "id", "function", "const", "let", "var", "return", "true", "false", "null",
+}
+
+_OUTLINE_PATTERNS = {
+    "HTML": re.compile(
+        r"^\s*<(?:(?:head|body|header|nav|main|section|article|aside|footer|form|script|link|template|dialog)\b"
+        r"|[\w-]+[^>]*\b(?:id|class)\s*=)",
+        re.IGNORECASE,
+    ),
+    "CSS": re.compile(r"^\s*(?:@media|@keyframes|@import|[^\s{}/][^{}]*\{)"),
+    "JavaScript": re.compile(
+        r"^\s*(?:export\s+)?(?:async\s+)?(?:function\b|class\b|(?:const|let|var)\s+[\w$]+\s*=\s*(?:async\s*)?(?:function\b|\(|[\w$]+\s*=>))"
+        r"|addEventListener\s*\("
+    ),
+}
+
+
+def extract_identifiers(texts: Iterable[str]) -> Set[str]:
+    """從 TODO 與 note 中找出可用來定位原始碼的詞"""
+    found: Set[str] = set()
+    for text in texts:
+        note = _NOTE_PATTERN.match(text)
+        if note:
+            found.add(note.group(1))
+        for match in _BACKTICK_PATTERN.findall(text):
+            found.update(_SELECTOR_PATTERN.findall(match) or [match.strip("<>/ ")])
+        for match in _ATTRIBUTE_PATTERN.findall(text):
+            found.update(match.split())
+        found.update(_QUOTED_PATTERN.findall(text))
+        found.update(_SELECTOR_PATTERN.findall(text))
+        found.update(_CALL_PATTERN.findall(text))
+        found.update(_IDENTIFIER_PATTERN.findall(text))
+        found.update(f"<{tag.lower()}" for tag in _TAG_PATTERN.findall(text))
+
+    return {word for word in found if len(word.strip("<")) >= 3 and word.strip("<").lower() not in _COMMON_WORDS}
+
+
+def relevant_ranges(
+    lines: List[str],
+    identifiers: Iterable[str],
+    radius: int = CONTEXT_RADIUS,
+    locations: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+) -> List[Tuple[int, int]]:
+    """
+    回傳包含任一識別字的行（前後各延伸 radius 行）合併後的範圍，0-based、左閉右開
+
+    locations 為符號索引記錄的 {名稱: [(起始行, 結束行), ...]}（1-based、包含兩端）；
+    索引中有的名稱直接使用記錄的範圍，沒有的才逐行搜尋
+    """
+    locations = locations or {}
+    hits: List[Tuple[int, int]] = []
+    words = []
+    for word in identifiers:
+        if word in locations:
+            hits.extend((first - 1, last) for first, last in locations[word])
+        else:
+            words.append(word)
+    if words:
+        hits.extend((index, index + 1) for index, line in enumerate(lines) if any(word in line for word in words))
+
+    ranges: List[Tuple[int, int]] = []
+    for first, last in sorted(hits):
+        start, end = max(first - radius, 0), min(last + radius, len(lines))
+        if start >= end:
+            continue
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def outline(lines: List[str], lang: str, skip: List[Tuple[int, int]] = ()) -> List[Tuple[int, str]]:
+    """列出 skip 範圍以外的結構行（HTML 元素、CSS 選擇器、JS 函式），回傳 (1-based 行號, 內容)"""
+    pattern = _OUTLINE_PATTERNS.get(lang)
+    if pattern is None:
+        return []
+    return [
+        (index + 1, line.strip()[:120])
+        for index, line in enumerate(lines)
+        if pattern.search(line) and not any(start <= index < end for start, end in skip)
+    ]
+
+
+def shows_full_source(source: str) -> bool:
+    """select_context 是否會送出完整內容（而非相關區段與大綱）"""
+    return len(source.splitlines()) <= CONTEXT_FULL_MAX_LINES
+
+
+def select_context(
+    source: str,
+    texts: Iterable[str],
+    lang: str,
+    numbered: bool = True,
+    locations: Optional[Dict[str, List[Tuple[int, int]]]] = None,
+) -> str:
+    """
+    挑選要送進 prompt 的原始碼
+
+    Args:
+        source: 檔案原始內容
+        texts: TODO 與 note，用來找出相關區段
+        lang: HTML、CSS 或 JavaScript
+        numbered: 是否加上行號（unified diff 需要真實行號）
+        locations: 符號索引中這份內容的符號位置（SymbolIndex.locations）
+
+    Returns:
+        str: 完整原始碼，或「相關區段 + 其餘部分的大綱」
+    """
+    lines = source.splitlines()
+    if shows_full_source(source):
+        return _render(lines, [(0, len(lines))], numbered) if lines else ("1: " if numbered else "")
+
+    ranges = _limit(relevant_ranges(lines, extract_identifiers(texts), locations=locations), CONTEXT_MAX_LINES)
+    if not ranges:
+        ranges = [(0, CONTEXT_EDGE_LINES), (len(lines) - CONTEXT_EDGE_LINES, len(lines))]
+
+    shown = sum(end - start for start, end in ranges)
+    sections = [
+        f"[The file has {len(lines)} lines. Only the {shown} lines relevant to the TODO are shown"
+        f"{' with their real line numbers' if numbered else ''}; `...` marks omitted lines.]",
+        _render(lines, ranges, numbered),
+    ]
+    entries = outline(lines, lang, skip=ranges)
+    if entries:
+        sections.append("[Outline of the omitted parts of the file]")
+        sections.append(_render_outline(entries))
+    return "\n".join(sections)
+
+
+def _render_outline(entries: List[Tuple[int, str]]) -> str:
+    """連續且只有數字不同的大綱行（例如重複的卡片）合併成一行"""
+    output: List[str] = []
+    index = 0
+    while index < len(entries):
+        number, text = entries[index]
+        shape = re.sub(r"\d+", "#", text)
+        run = index + 1
+        while run < len(entries) and re.sub(r"\d+", "#", entries[run][1]) == shape:
+            run += 1
+        output.append(f"{number:2d}: {text}")
+        if run - index > 1:
+            output.append(f"    (+{run - index - 1} similar lines through line {entries[run - 1][0]})")
+        index = run
+    return "\n".join(output)
+
+
+def _limit(ranges: List[Tuple[int, int]], max_lines: int) -> List[Tuple[int, int]]:
+    limited, total = [], 0
+    for start, end in ranges:
+        if total + (end - start) > max_lines:
+            if total < max_lines:
+                limited.append((start, start + max_lines - total))
+            break
+        limited.append((start, end))
+        total += end - start
+    return limited
+
+
+def _render(lines: List[str], ranges: List[Tuple[int, int]], numbered: bool) -> str:
+    output: List[str] = []
+    for start, end in ranges:
+        if start > 0:
+            output.append("...")
+        for index in range(start, end):
+            output.append(f"{index + 1:2d}: {lines[index]}" if numbered else lines[index])
+    if ranges and ranges[-1][1] < len(lines):
+        output.append("...")
+    return "\n".join(output)
+
+
+# ---------- 結構大綱（含行號範圍） ---------- #
+
+# 沒有 id 或 class 時也列入大綱的 HTML 元素
+_STRUCTURAL_TAGS = {
+    "html", "head", "body", "header", "nav", "main", "section", "article", "aside", "footer",
+    "form", "script", "style", "template", "dialog", "table", "ul", "ol",
+}
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+_JS_DEFINITION_PATTERN = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:async\s+)?"
+    r"(?:function\s*\*?\s*([\w$]+)"
+    r"|class\s+([\w$]+)"
+    r"|(?:const|let|var)\s+([\w$]+)\s*=\s*(?:async\s*)?(?:function\b|\([^)]*\)\s*=>|[\w$]+\s*=>)"
+    r"|([\w$]+)\s*\([^)]*\)\s*\{)",
+    re.MULTILINE,
+)
+_JS_KEYWORDS = {"if", "for", "while", "switch", "catch", "function", "return", "with"}
+
+
+def outline_spans(source: str, lang: str) -> List[Tuple[int, int, str]]:
+    """
+    列出檔案的結構與其行號範圍 (起始行, 結束行, 名稱)，行號從 1 開始
+
+    - HTML：元素路徑，例如 body > main#content > section.card
+    - CSS：選擇器與 @media 等 at-rule
+    - JavaScript：函式、類別與方法名稱
+    """
+    if lang == "HTML":
+        return _html_spans(source)
+    if lang == "CSS":
+        return _css_spans(source)
+    if lang == "JavaScript":
+        return _js_spans(source)
+    return []
+
+
+def _html_spans(source: str) -> List[Tuple[int, int, str]]:
+    from html.parser import HTMLParser
+
+    spans: List[Tuple[int, int, str]] = []
+    # 開啟中的元素：(標籤, 顯示名稱, 起始行, 是否列入大綱)
+    stack: List[Tuple[str, str, int, bool]] = []
+
+    def path(label):
+        return " > ".join([entry[1] for entry in stack if entry[3]] + [label])
+
+    class Parser(HTMLParser):
+        def handle_starttag(self, tag, attrs):
+            attributes = dict(attrs)
+            label = tag
+            if attributes.get("id"):
+                label += f"#{attributes['id']}"
+            if attributes.get("class"):
+                label += "".join(f".{name}" for name in attributes["class"].split()[:2])
+            listed = tag in _STRUCTURAL_TAGS or label != tag
+            line = self.getpos()[0]
+            if tag in _VOID_TAGS:
+                if listed:
+                    spans.append((line, line, path(label)))
+                return
+            stack.append((tag, label, line, listed))
+
+        def handle_endtag(self, tag):
+            # 找到對應的開啟標籤，途中未關閉的元素一併結束
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == tag:
+                    line = self.getpos()[0]
+                    while len(stack) > depth:
+                        open_tag, label, start, listed = stack.pop()
+                        if listed:
+                            spans.append((start, line, path(label)))
+                    return
+
+    parser = Parser(convert_charrefs=True)
+    parser.feed(source)
+    parser.close()
+    end = max(len(source.splitlines()), 1)
+    while stack:
+        _, label, start, listed = stack.pop()
+        if listed:
+            spans.append((start, end, path(label)))
+    return sorted(spans)
+
+
+def _css_spans(source: str) -> List[Tuple[int, int, str]]:
+    # 註解換成等長的空白（保留換行），位置與行號不變
+    source = re.sub(r"/\*.*?\*/", lambda match: re.sub(r"[^\n]", " ", match.group()), source, flags=re.DOTALL)
+    spans: List[Tuple[int, int, str]] = []
+    # 開啟中的區塊：(選擇器, 起始行)
+    stack: List[Tuple[str, int]] = []
+    selector_start = 0
+    index = 0
+    while index < len(source):
+        char = source[index]
+        if char in "\"'":
+            index = _skip_string(source, index)
+            continue
+        if char == "{":
+            text = source[selector_start:index]
+            start = source.count("\n", 0, selector_start + len(text) - len(text.lstrip())) + 1
+            stack.append((" ".join(text.split()), start))
+            selector_start = index + 1
+        elif char == "}":
+            if stack:
+                selector, start = stack.pop()
+                if selector:
+                    spans.append((start, source.count("\n", 0, index) + 1, selector[:120]))
+            selector_start = index + 1
+        elif char == ";":
+            selector_start = index + 1
+        index += 1
+    return sorted(spans)
+
+
+def _js_spans(source: str) -> List[Tuple[int, int, str]]:
+    spans: List[Tuple[int, int, str]] = []
+    for match in _JS_DEFINITION_PATTERN.finditer(source):
+        name = next(group for group in match.groups() if group)
+        if name in _JS_KEYWORDS:
+            continue
+        text = match.group()
+        start = source.count("\n", 0, match.start() + len(text) - len(text.lstrip())) + 1
+        if text.rstrip().endswith("=>") and not source[match.end():].lstrip().startswith("{"):
+            # 沒有區塊的箭頭函式只佔一行
+            spans.append((start, start, name))
+            continue
+        brace = source.find("{", match.start())
+        end = source.count("\n", 0, _match_brace(source, brace)) + 1 if brace != -1 else start
+        spans.append((start, end, name))
+    return spans
+
+
+def _skip_string(source: str, index: int) -> int:
+    """回傳從 index 開始的字串常值結束後的位置"""
+    quote = source[index]
+    index += 1
+    while index < len(source) and source[index] != quote:
+        if source[index] == "\\":
+            index += 1
+        elif source[index] == "\n" and quote != "`":
+            break
+        index += 1
+    return index + 1
+
+
+def _match_brace(source: str, open_index: int) -> int:
+    """回傳與 open_index 的 { 對應的 } 的位置，略過字串與註解；找不到時回傳檔案結尾"""
+    depth = 0
+    index = open_index
+    while index < len(source):
+        char = source[index]
+        if source.startswith("//", index):
+            newline = source.find("\n", index)
+            index = len(source) if newline == -1 else newline
+            continue
+        if source.startswith("/*", index):
+            close = source.find("*/", index + 2)
+            index = len(source) if close == -1 else close + 2
+            continue
+        if char in "\"'`":
+            index = _skip_string(source, index)
+            continue
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+        index += 1
+    return len(source) - 1
+
+
+# ---------- 讀取工具的輸出 ---------- #
+
+# 讀取工具單次回傳的最大位元組數；超過時截斷並提示改用行範圍或大綱
+VIEW_MAX_BYTES = int(os.getenv("CODE_VIEW_MAX_BYTES", "24000"))
+
+
+def render_view(
+    source: str,
+    lang: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    max_bytes: int = VIEW_MAX_BYTES,
+    outline_only: bool = False,
+) -> str:
+    """
+    讀取工具共用的輸出：加上行號的指定行範圍，或結構大綱
+
+    Args:
+        start, end: 要顯示的行範圍（從 1 開始、包含兩端），未指定時從頭或到尾
+        max_bytes: 輸出的位元組上限，超過時在行的邊界截斷並附上提示
+        outline_only: 只列出結構（HTML 元素路徑、CSS 選擇器、JS 函式）與其行號範圍
+    """
+    lines = source.splitlines()
+    total = len(lines)
+    if outline_only:
+        entries = [f"{first}-{last}: {name}" if last != first else f"{first}: {name}"
+                   for first, last, name in outline_spans(source, lang)]
+        if not entries:
+            return f"[共 {total} 行，找不到可列出的結構]"
+        return _cap([f"[共 {total} 行的結構大綱：行號範圍: 名稱]"] + entries, max_bytes,
+                    "[大綱已截斷，請以 start/end 讀取指定範圍]")
+
+    if not lines:
+        return "1: "
+    first = max(start or 1, 1)
+    last = min(end or total, total)
+    if first > last:
+        return f"[指定的範圍 {start or 1}-{end or total} 超出檔案範圍（共 {total} 行）]"
+
+    numbered = [f"{number:2d}: {lines[number - 1]}" for number in range(first, last + 1)]
+    shown = _cap_lines(numbered, max_bytes)
+    if shown < len(numbered):
+        numbered = numbered[:shown] + [
+            f"[已截斷：只顯示第 {first}-{first + shown - 1} 行（共 {total} 行）。"
+            "請以 start/end 讀取其餘部分，或以 outline=True 查看結構]"
+        ]
+    elif first > 1 or last < total:
+        numbered.append(f"[顯示第 {first}-{last} 行，共 {total} 行]")
+    return "\n".join(numbered)
+
+
+def _cap_lines(lines: List[str], max_bytes: int) -> int:
+    """回傳在 max_bytes 內可完整顯示的行數（至少一行）"""
+    size = 0
+    for count, line in enumerate(lines):
+        size += len(line.encode("utf-8")) + 1
+        if size > max_bytes:
+            return max(count, 1)
+    return len(lines)
+
+
+def _cap(lines: List[str], max_bytes: int, notice: str) -> str:
+    shown = _cap_lines(lines, max_bytes)
+    return "\n".join(lines[:shown] + ([notice] if shown < len(lines) else []))
@@ -0,0 +1,100 @@
+"""
+並行推測執行：送出多個候選，採用第一個通過驗證的結果
+
+用於 diff 生成：逐次重試時，每次失敗都要多等一次完整的 LLM 往返；
+改為以不同溫度或不同輸出格式生成 K 個候選，依完成順序驗證，第一個通過的候選勝出。
+
+候選可以錯開啟動（stagger）：前面的候選夠快時，後面的候選根本不會送出；
+前面的候選全部失敗時立即啟動下一個，不必等到預定時間。
+勝出後尚未啟動的候選不再執行，執行中的候選會收到取消事件，應盡早中止請求（例如關閉串流）。
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, List, NamedTuple, Optional, Sequence
+
+
+class SpeculativeResult(NamedTuple):
+    # 勝出候選的索引；全部失敗時為 None
+    winner: Optional[int]
+    value: Any
+    # 各失敗候選的 (索引, 錯誤訊息)，依完成順序排列
+    errors: List[tuple]
+    # 已完成（含失敗）的候選數；其餘候選在勝出後被取消或丟棄
+    completed: int
+    elapsed: float
+    # 實際啟動的候選數；錯開啟動時可能少於候選總數
+    started: int
+
+
+def first_valid(
+    candidates: Sequence[Callable[[threading.Event], Any]],
+    accept: Callable[[int, Any], Any],
+    timeout: Optional[float] = None,
+    stagger: float = 0.0,
+) -> SpeculativeResult:
+    """
+    執行候選，回傳第一個通過 accept 的結果
+
+    Args:
+        candidates: 候選函式，接收取消事件；事件被設定時應盡早放棄（例如不再送出請求或關閉串流）
+        accept: 驗證函式，接收 (索引, 候選回傳值)，回傳採用的結果；不通過時拋出例外
+        timeout: 等待所有候選的總秒數上限，None 表示不限
+        stagger: 第 i 個候選在開始後 i * stagger 秒才啟動；0 表示同時啟動。
+                 執行中的候選全部失敗時立即啟動下一個
+
+    Returns:
+        SpeculativeResult: 勝出的候選與其結果；全部失敗或逾時時 winner 為 None
+    """
+    start = time.perf_counter()
+    cancelled = threading.Event()
+    errors: List[tuple] = []
+    completed = 0
+    deadline = None if timeout is None else start + timeout
+
+    executor = ThreadPoolExecutor(max_workers=max(len(candidates), 1), thread_name_prefix="speculative")
+    futures = {}
+    pending = set()
+
+    def launch_due(force: bool = False) -> None:
+        """啟動已到預定時間的候選；force 時至少啟動一個"""
+        while len(futures) < len(candidates):
+            due = start + len(futures) * stagger
+            if not force and time.perf_counter() < due:
+                return
+            force = False
+            index = len(futures)
+            future = executor.submit(candidates[index], cancelled)
+            futures[future] = index
+            pending.add(future)
+
+    try:
+        launch_due(force=True)
+        while pending:
+            now = time.perf_counter()
+            wakeups = [] if deadline is None else [deadline]
+            if len(futures) < len(candidates):
+                wakeups.append(start + len(futures) * stagger)
+            remaining = max(min(wakeups) - now, 0) if wakeups else None
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+            if not done and deadline is not None and time.perf_counter() >= deadline:
+                errors.extend((futures[future], "逾時") for future in pending)
+                break
+            # 同時完成的候選依索引順序驗證，讓結果可重現
+            for future in sorted(done, key=futures.get):
+                index = futures[future]
+                completed += 1
+                try:
+                    value = accept(index, future.result())
+                except Exception as e:
+                    errors.append((index, str(e)))
+                    continue
+                return SpeculativeResult(index, value, errors, completed, time.perf_counter() - start, len(futures))
+            # 執行中的候選都失敗了，不必等到預定時間
+            launch_due(force=not pending)
+        return SpeculativeResult(None, None, errors, completed, time.perf_counter() - start, len(futures))
+    finally:
+        # 不等待仍在執行的候選，讓勝出的結果立即回傳
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,9 +1,14 @@
-from langchain.schema import HumanMessage, SystemMessage
+from langchain.schema import AIMessage, HumanMessage, SystemMessage
+import docker
 import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
-from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.runnables import Runnable
+from pydantic import BaseModel, Field
 import os
 import sys
 from dotenv import load_dotenv
@@ -11,13 +16,118 @@ from dotenv import load_dotenv
 # 處理相對導入問題
 try:
     from . import ai_tool
+    from . import edit_formats
+    from . import file_cache
+    from . import history
+    from . import llm_client
+    from . import source_context
+    from . import symbol_index
+    from . import speculative
+    from . import unified_diff
+    from .log_config import get_logger
 except ImportError:
     # 如果相對導入失敗，嘗試絕對導入
     sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
     from Functions import ai_tool
+    from Functions import edit_formats
+    from Functions import file_cache
+    from Functions import history
+    from Functions import llm_client
+    from Functions import source_context
+    from Functions import symbol_index
+    from Functions import speculative
+    from Functions import unified_diff
+    from Functions.log_config import get_logger
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
+# HTML、CSS、JavaScript 三個規劃請求同時送出的上限
+TODO_PLANNER_CONCURRENCY = int(os.getenv("TODO_PLANNER_CONCURRENCY", "3"))
+
+# 同一檔案的多個 TODO 以一次請求生成 diff；設為 0 則每個 TODO 各自生成
+BATCH_DIFF_ENABLED = os.getenv("SUB_AGENT_BATCH_DIFF", "1") != "0"
+
+# 推測模式：第一次嘗試生成的候選數（不同格式與溫度），採用第一個能套用的結果；0 或 1 表示停用
+SPECULATIVE_CANDIDATES = int(os.getenv("SUB_AGENT_SPECULATIVE_CANDIDATES", "0"))
+# 相鄰候選的啟動間隔秒數：前面的候選在這段時間內成功時，後面的候選不會送出；0 表示同時送出
+SPECULATIVE_STAGGER_SECONDS = float(os.getenv("SUB_AGENT_SPECULATIVE_STAGGER_SECONDS", "1.0"))
+# 推測模式的成本上限：所有候選 prompt 與估計輸出的 tokens 合計不超過此值，超過時減少候選數。
+# 以每個候選都完整執行估計，是實際花費的上限（錯開啟動與中途取消只會更少）
+SPECULATIVE_MAX_TOKENS = int(os.getenv(
+    "SUB_AGENT_SPECULATIVE_MAX_TOKENS", os.getenv("SUB_AGENT_SPECULATIVE_MAX_PROMPT_TOKENS", "40000")
+))
+# 估計 search_replace 與 udiff 單次輸出的 tokens；whole_file 以整份檔案估計
+SPECULATIVE_EDIT_OUTPUT_TOKENS = int(os.getenv("SUB_AGENT_SPECULATIVE_EDIT_OUTPUT_TOKENS", "800"))
+# 同一格式有多個候選時依序使用的溫度
+SPECULATIVE_TEMPERATURES = (0, 0.4, 0.8)
+
+# 各語言在容器內對應的檔案
+TARGET_FILES = {"HTML": "index.html", "CSS": "index.css", "JavaScript": "index.js"}
+LANGUAGE_NAMES = {"html": "HTML", "css": "CSS", "js": "JavaScript", "javascript": "JavaScript"}
+
+# 各檔案類型的規劃說明與範例，structured 規劃與分檔案規劃共用
+TODO_FILE_TYPES = [
+    {
+        "name": "HTML",
+        "description": (
+            "Break down only HTML source edits: add, modify or move HTML elements. "
+            "Exclude file operations, testing or unrelated styling specifics.\n"
+            "Note: Tailwind CSS is already imported via CDN. Feel free to apply styles using Tailwind utility classes directly in HTML. "
+            "If specific styles are required across multiple elements or for reusability, consider naming a custom class and document it in the `note:` section."
+        ),
+        "examples": (
+            "1. Add an empty <nav> element above the main heading\n"
+            "2. Inside the <nav>, insert two anchor tags: 'Home' and 'About Us'\n"
+            "3. Below the <nav>, add the HTML structure for a card component\n"
+            "4. Move the existing main heading element into the card component\n"
+            "❌ Locate the HTML file\n"
+            "❌ Open the editor and find the <body> tag\n"
+            "❌ Save the changes and refresh the browser"
+        )
+    },
+    {
+        "name": "CSS",
+        "description": (
+            "Break down only CSS source edits: add or adjust styles, selectors, properties. "
+            "Exclude HTML structure or JS logic.\n"
+            "Note: Tailwind CSS has already been imported via CDN in HTML. Only add custom CSS if Tailwind utility classes are not sufficient. "
+            "If you define a new CSS class, clearly state the class name and its purpose under the `note:` section using the format: `css-class: className - description`."
+        ),
+        "examples": (
+            "1. Add background-color and padding styles to the <nav> element using Tailwind utility classes\n"
+            "2. Create a .card class using Tailwind-compatible styles only if custom behavior is required\n"
+            "❌ Add a new <div> with class 'card'\n"
+            "❌ Attach click event logic to trigger animation"
+        )
+    },
+    {
+        "name": "JavaScript",
+        "description": (
+            "Break down only JavaScript source edits: add or modify script logic, functions, event handlers. "
+            "Exclude markup or styling details.\n"
+            "Note: If you define any function or constant that will be reused across TODO items, please include the name and its purpose in the `note:` section using the format: `function: functionName - description`."
+        ),
+        "examples": (
+            "1. Add a click event listener to the 'About Us' link\n"
+            "2. Define a function to toggle the navigation menu\n"
+            "3. Attach the toggle function to a button element\n"
+            "❌ Modify <nav> layout\n"
+            "❌ Change text alignment using CSS"
+        )
+    }
+]
+
+
+class TodoPlan(BaseModel):
+    """Code-edit TODO lists for each web source file, plus notes on names shared across files."""
+
+    html: List[str] = Field(description="Ordered HTML source edits, each as `{action} + {target} + {location or purpose}`; empty if no HTML change is needed")
+    css: List[str] = Field(description="Ordered CSS source edits in the same format; empty if no CSS change is needed")
+    javascript: List[str] = Field(description="Ordered JavaScript source edits in the same format; empty if no JavaScript change is needed")
+    notes: List[str] = Field(description="Shared names used across TODOs, each as `type: name - explanation`, e.g. `css-class: card - used for card layout`")
+
 
 def list_todo(latest_input):
     """
@@ -28,62 +138,66 @@ def list_todo(latest_input):
       例如：css-class: card - used for general card layout
             function: showModal - displays modal on button click
 
+    以單次 structured output 呼叫取得經 schema 驗證的 TodoPlan，不需再以正規表達式解析自由文字；
+    呼叫失敗時才退回分檔案並行規劃。
+
     回傳格式為字典，鍵為檔案類型與 note，值為對應 TODO 列表。
     """
-    llm = ChatOpenAI(model="gpt-4o", temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
-    file_types = [
-        {
-            "name": "HTML",
-            "description": (
-                "Break down only HTML source edits: add, modify or move HTML elements. "
-                "Exclude file operations, testing or unrelated styling specifics.\n"
-                "Note: Tailwind CSS is already imported via CDN. Feel free to apply styles using Tailwind utility classes directly in HTML. "
-                "If specific styles are required across multiple elements or for reusability, consider naming a custom class and document it in the `note:` section."
-            ),
-            "examples": (
-                "1. Add an empty <nav> element above the main heading\n"
-                "2. Inside the <nav>, insert two anchor tags: 'Home' and 'About Us'\n"
-                "3. Below the <nav>, add the HTML structure for a card component\n"
-                "4. Move the existing main heading element into the card component\n"
-                "❌ Locate the HTML file\n"
-                "❌ Open the editor and find the <body> tag\n"
-                "❌ Save the changes and refresh the browser"
-            )
-        },
-        {
-            "name": "CSS",
-            "description": (
-                "Break down only CSS source edits: add or adjust styles, selectors, properties. "
-                "Exclude HTML structure or JS logic.\n"
-                "Note: Tailwind CSS has already been imported via CDN in HTML. Only add custom CSS if Tailwind utility classes are not sufficient. "
-                "If you define a new CSS class, clearly state the class name and its purpose under the `note:` section using the format: `css-class: className - description`."
-            ),
-            "examples": (
-                "1. Add background-color and padding styles to the <nav> element using Tailwind utility classes\n"
-                "2. Create a .card class using Tailwind-compatible styles only if custom behavior is required\n"
-                "❌ Add a new <div> with class 'card'\n"
-                "❌ Attach click event logic to trigger animation"
-            )
-        },
-        {
-            "name": "JavaScript",
-            "description": (
-                "Break down only JavaScript source edits: add or modify script logic, functions, event handlers. "
-                "Exclude markup or styling details.\n"
-                "Note: If you define any function or constant that will be reused across TODO items, please include the name and its purpose in the `note:` section using the format: `function: functionName - description`."
-            ),
-            "examples": (
-                "1. Add a click event listener to the 'About Us' link\n"
-                "2. Define a function to toggle the navigation menu\n"
-                "3. Attach the toggle function to a button element\n"
-                "❌ Modify <nav> layout\n"
-                "❌ Change text alignment using CSS"
-            )
-        }
-    ]
+    start = time.perf_counter()
+    try:
+        plan = _plan_todo_structured(latest_input)
+    except Exception as e:
+        logger.warning(f"structured TODO 規劃失敗，改用分檔案規劃: {str(e)}")
+        return _list_todo_per_file(latest_input)
+
+    logger.info(f"TODO 規劃完成：1 次 structured output 呼叫，耗時 {time.perf_counter() - start:.2f} 秒")
+    return {
+        "note": _clean_items(plan.notes),
+        "HTML": _clean_items(plan.html),
+        "CSS": _clean_items(plan.css),
+        "JavaScript": _clean_items(plan.javascript),
+    }
 
-    results = {"note": []}
-    for file in file_types:
+
+def _plan_todo_structured(latest_input):
+    """以一次 structured output 呼叫同時規劃三種檔案的 TODO 與 note"""
+    sections = "\n\n".join(
+        f"### {file['name']}\n{file['description']}\n\n✅ Example TODOs:\n{file['examples']}"
+        for file in TODO_FILE_TYPES
+    )
+    system_message = (
+        "**You are a senior process analyst specializing in web development and task breakdown.**\n\n"
+        "You will receive a user request for webpage modifications. Your job is to break it down into clear, sequential "
+        "TODO items for each source file: HTML, CSS and JavaScript. These items will later be used to generate step-by-step diff files.\n\n"
+        "Please follow these rules:\n\n"
+        "* **Do NOT include any tasks related to locating files, opening files, saving, testing, or viewing results.**\n"
+        "* Focus strictly on describing the **specific code edits** that need to be made.\n"
+        "* Each TODO should follow the format: `{{action}} + {{target}} + {{location or purpose}}`\n"
+        "* Arrange the TODO items of each file in a logical and dependency-aware execution order.\n"
+        "* If no change is required for a file type, leave its list empty.\n"
+        "* Put every function name, CSS class name, or shared concept used across TODOs into `notes`, "
+        "using the format `type: name - explanation`.\n\n"
+        f"{sections}\n"
+    )
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_message),
+        ("human", "{request}")
+    ])
+
+    llm = llm_client.get_chat_model("gpt-4o", temperature=0)
+    return llm.with_structured_output(TodoPlan).invoke(prompt.format_messages(request=latest_input))
+
+
+def _clean_items(items):
+    return [item.strip().replace('\n', ' ') for item in items if item.strip()]
+
+
+def _list_todo_per_file(latest_input):
+    """分別為三種檔案送出規劃請求並以正規表達式解析回應（structured output 失敗時的備援）"""
+    llm = llm_client.get_chat_model("gpt-4o", temperature=0)
+
+    prompts = []
+    for file in TODO_FILE_TYPES:
         system_message = (
             f"**You are a senior process analyst specializing in web development and task breakdown.**\n\n"
             "You will receive a user request for webpage modifications. Your job is to **break down only the parts involving "
@@ -102,35 +216,53 @@ def list_todo(latest_input):
 
         prompt = ChatPromptTemplate.from_messages([
             ("system", system_message),
-            ("human", latest_input)
+            ("human", "{request}")
         ])
+        prompts.append(prompt.format_messages(request=latest_input))
 
-        response = llm.invoke(prompt.format_messages())
-        content = response.content.strip()
+    # 三個檔案類型的規劃彼此獨立，同時送出，總延遲約等於最慢的一次呼叫
+    start = time.perf_counter()
+    responses = llm.batch(prompts, config={"max_concurrency": TODO_PLANNER_CONCURRENCY})
+    logger.info(
+        f"TODO 規劃完成：{len(prompts)} 個請求並行（上限 {TODO_PLANNER_CONCURRENCY}），"
+        f"耗時 {time.perf_counter() - start:.2f} 秒"
+    )
 
-        # 解析 TODO 清單與 note
-        todo_pattern = r"^\s*\d+[\.\)]\s+(.*?)(?=\n\s*\d+[\.\)]|\Z)"
-        note_pattern = r"(?i)^note\s*:\s*(.+)"
+    # 依固定順序合併，結果與逐一呼叫時相同
+    results = {"note": []}
+    for file, response in zip(TODO_FILE_TYPES, responses):
+        todos, notes = _parse_todo_response(response.content.strip())
+        results[file['name']] = todos
+        results["note"].extend(notes)
 
-        todos = re.findall(todo_pattern, content, re.DOTALL | re.MULTILINE)
-        notes = re.findall(note_pattern, content, re.DOTALL | re.MULTILINE)
+    return results
 
-        cleaned_todos = [item.strip().replace('\n', ' ') for item in todos if item.strip()]
-        formatted_notes = [note.strip().replace('\n', ' ') for note in notes if note.strip()]
 
-        results[file['name']] = cleaned_todos
-        results["note"].extend(formatted_notes)
+def _parse_todo_response(content):
+    """解析規劃回應中的編號 TODO 清單與 note 行"""
+    # TODO 可能跨多行，遇到下一個編號或 note 行為止
+    todo_pattern = r"^\s*\d+[\.\)]\s+(.*?)(?=\n\s*\d+[\.\)]|\n\s*(?i:note)\s*:|\Z)"
+    note_pattern = r"(?i)^note\s*:\s*(.+)"
 
-    return results
+    todos = re.findall(todo_pattern, content, re.DOTALL | re.MULTILINE)
+    notes = re.findall(note_pattern, content, re.DOTALL | re.MULTILINE)
+
+    return _clean_items(todos), _clean_items(notes)
 
 
-def llm_diff(container_name, todo, lang, note_ls):
+def llm_diff(container_name, todo, lang, note_ls, stats=None):
     """
     生成 diff 並進行虛擬測試，如果測試失敗則回傳錯誤訊息給 AI 重新生成
     每次都重新抓取最新源碼，避免被上一輪套用後的程式變更所影響
-    """
-    llm = ChatOpenAI(model="gpt-4o", temperature=0, api_key=os.getenv("OPENAI_API_KEY"))
+    stats 若有提供，會累加 LLM 呼叫次數
 
+    每次嘗試由 edit_formats.select_format() 依檔案大小與成功率挑選輸出格式
+    （udiff、search_replace 或 whole_file），失敗時改用其他格式重試；
+    不論哪種格式都在記憶體中套用後轉成 unified diff 回傳，交由 apply_diff 套用
+
+    啟用推測模式（SUB_AGENT_SPECULATIVE_CANDIDATES）時，第一次嘗試改為錯開啟動多個候選
+    （不同格式與溫度），採用第一個能套用的結果；全部失敗才進入逐次重試
+    """
     # 根據語言類型選擇對應的源碼抓取函式
     lang_mapping = {
         "HTML": "HTML",
@@ -142,241 +274,392 @@ def llm_diff(container_name, todo, lang, note_ls):
     target_lang = lang_mapping.get(lang, lang)
     if target_lang not in ["HTML", "CSS", "JavaScript"]:
         return f"錯誤：不支援的語言類型 {lang}"
+    target_file = TARGET_FILES[target_lang]
 
     # 最多嘗試 3 次生成 diff
     max_retries = 3
-    for attempt in range(max_retries):
+    failed_formats = set()
+    previous_error = None
+    first_attempt = 0
+    # 其他檔案中的 id、class 與函式名稱，讓修改與它們保持一致
+    symbols = symbol_index.summarize_for(container_name, target_file)
 
-        # 🔄 重要：每次嘗試都重新抓取最新的源碼
-        current_source = ""  # 初始化變數
+    if SPECULATIVE_CANDIDATES > 1:
         try:
-            if target_lang == "HTML":
-                current_source = ai_tool.get_html_code(container_name)
-            elif target_lang == "CSS":
-                current_source = ai_tool.get_css_code(container_name)
-            elif target_lang == "JavaScript":
-                current_source = ai_tool.get_js_code(container_name)
+            original = ai_tool.read_source_file(container_name, target_file)
         except Exception as e:
             return f"錯誤：無法抓取 {target_lang} 源碼 - {str(e)}"
+        locations = _symbol_locations(container_name, target_file, original)
+        outcome = _speculative_diff(original, todo, note_ls, target_file, target_lang, stats, symbols, locations)
+        if outcome is not None:
+            status, value, tried_formats = outcome
+            if status != "error":
+                return value
+            # 推測的候選全部失敗，視為第一次嘗試，帶著錯誤訊息逐次重試
+            failed_formats.update(tried_formats)
+            previous_error = value
+            first_attempt = 1
+            _record_diff_outcome(stats, "llm_retry")
+
+    for attempt in range(first_attempt, max_retries):
 
-        system_message = f"""
-You are given a set of TODO instructions describing modifications that need to be made to a source code file.
+        # 🔄 重要：每次嘗試都重新抓取最新的源碼
+        try:
+            original = ai_tool.read_source_file(container_name, target_file)
+        except Exception as e:
+            return f"錯誤：無法抓取 {target_lang} 源碼 - {str(e)}"
 
-Your task is to write a **valid and precise unified diff** (`diff -u` format) that applies the required changes to the following source code:
+        edit_format = edit_formats.select_format(original, exclude=failed_formats)
+        if stats is not None:
+            stats["llm_calls"] += 1
+        status, value = _attempt_edit(
+            llm_client.get_chat_model("gpt-4o", temperature=0),
+            original, todo, note_ls, target_file, target_lang, edit_format, previous_error, symbols,
+            _symbol_locations(container_name, target_file, original),
+        )
+        if status != "error":
+            if status == "diff":
+                _record_diff_outcome(stats, value[1])
+                logger.info(f"{target_file} 以 {edit_format.name} 格式完成修改（第 {attempt + 1} 次嘗試）")
+                return value[0]
+            return value
+
+        # 本地修正也失敗，記錄錯誤並請 LLM 重新生成
+        failed_formats.add(edit_format.name)
+        previous_error = value
+        if attempt == max_retries - 1:
+            # 最後一次嘗試失敗，返回錯誤
+            return f"生成 diff 失敗，已嘗試 {max_retries} 次。最後錯誤：{previous_error}"
+        _record_diff_outcome(stats, "llm_retry")
 
-```
-{current_source}
-```
+    return "生成 diff 失敗：未知錯誤"
 
----
 
-### 🎯 Requirements
+def _symbol_locations(container_name, target_file, original):
+    """以符號索引取得目前內容中各符號的行號範圍；內容沒變時索引不會重新解析"""
+    index = symbol_index.get_index()
+    index.update(container_name, target_file, original)
+    return index.locations(container_name, target_file)
 
-Your output must strictly follow the **unified diff format**, and be directly usable with Unix's `patch` tool.
 
----
+def _edit_messages(
+    original, todo, note_ls, target_file, target_lang, edit_format, previous_error=None, symbols="", locations=None
+):
+    """組合單次修改請求的 prompt"""
+    # 大檔案只送出與 TODO 相關的區段與其餘部分的大綱
+    current_source = source_context.select_context(
+        original, [todo, *note_ls], target_lang, numbered=edit_format.numbered_source, locations=locations
+    )
 
-#### 🔒 1. **HUNK HEADER IS LAW**
+    system_message = f"""
+You are given a set of TODO instructions describing modifications that need to be made to the source code file `{target_file}`.
 
-* Format: `@@ -old_start,old_lines +new_start,new_lines @@`
-* This line defines the exact starting point and number of lines affected in both the original and modified files.
+{edit_format.task}
 
-  * `old_lines`: the number of lines in the original file affected (including deletions and context)
-  * `new_lines`: the number of lines in the new file (including additions and context)
-* **These numbers must be 100% accurate.**
+```
+{current_source}
+```
 
 ---
 
-#### 📌 2. **CONTEXT IS MANDATORY**
+{edit_format.rules}
+"""
 
-* Include unchanged context lines before and after the changed lines.
-* Context lines are prefixed with a space (` `).
-* A diff with only additions (`+`) or only deletions (`-`) and no context will **fail**.
+    # 如果是重試，添加錯誤資訊到 prompt
+    if previous_error:
+        system_message += f"\n\n⚠️ Previous attempt failed with error:\n{previous_error}\n\nPlease fix the issue and generate a corrected edit."
 
----
+    human_message = todo
+    if symbols:
+        human_message += f"\n\nNames defined in the other project files:\n{symbols}"
 
-#### 🔄 3. **LINE MODIFICATIONS**
+    # 源碼與錯誤訊息可能含有 { }，直接組成訊息，不經過 prompt template 的變數替換
+    return [SystemMessage(content=system_message), HumanMessage(content=human_message)]
 
-* Use `-` to remove a line:
-  `- <p>Old text</p>`
-* Use `+` to add a line:
-  `+ <p>New text</p>`
-* To replace a line, show both versions:
 
-  ```
-  - <p>Old text</p>
-  + <p>New text</p>
-  ```
+def _attempt_edit(
+    llm, original, todo, note_ls, target_file, target_lang, edit_format, previous_error=None, symbols="", locations=None
+):
+    """
+    以指定格式請 LLM 修改一次，並在記憶體中套用驗證
 
----
+    Returns:
+        tuple: ("skip", "SKIP")、("diff", (unified diff 或 "SKIP", "valid" | "repaired"))
+               或 ("error", 給下一次重試的錯誤訊息)
+    """
+    messages = _edit_messages(
+        original, todo, note_ls, target_file, target_lang, edit_format, previous_error, symbols, locations
+    )
+    response = llm.invoke(messages)
+    return _check_edit(response, original, target_file, edit_format)
 
-#### ⚠️ 4. **EVERY LINE MUST END WITH A NEWLINE**
 
-* Every line in the diff must be newline-terminated (`\n`).
-* If your output ends in the middle of a line, the `patch` command will throw an error like:
-  `patch unexpectedly ends in middle of line`
+def _check_edit(response, original, target_file, edit_format):
+    """驗證 LLM 的回應並記錄該格式的成功與否，回傳值同 _attempt_edit"""
+    output = response.content.strip()
+    tokens = (getattr(response, "usage_metadata", None) or {}).get("total_tokens", 0)
 
----
+    # 如果 AI 回應 SKIP，直接返回
+    if output == "SKIP":
+        return "skip", "SKIP"
 
-#### 📭 5. **IF NO MODIFICATION IS NEEDED**
+    # 在記憶體中套用（udiff 行數或行號的小錯誤會先在本地修正）
+    try:
+        updated, repairs = edit_format.apply(original, output, target_file)
+    except unified_diff.PatchError as e:
+        edit_formats.record_result(edit_format.name, False, tokens)
+        return "error", f"{edit_format.name} 格式的修改無法套用：{str(e)}"
 
-* If the TODO instructions require no actual change to the source code, output:
+    edit_formats.record_result(edit_format.name, True, tokens)
+    generated_diff = unified_diff.make_diff(original, updated, target_file)
+    return "diff", (generated_diff or "SKIP", "repaired" if repairs else "valid")
 
-  ```
-  SKIP
-  ```
 
----
+def _estimated_output_tokens(edit_format, source_tokens):
+    """候選輸出 tokens 的估計：whole_file 重寫整份檔案，其他格式只輸出修改的部分"""
+    if edit_format.name == "whole_file":
+        return source_tokens
+    return min(source_tokens, SPECULATIVE_EDIT_OUTPUT_TOKENS)
 
-### 🧪 Example
 
-#### ✅ Goal: Change the `<title>` content
+def _speculative_plan(original, todo, note_ls, target_file, target_lang, symbols="", locations=None):
+    """
+    決定推測模式的候選 (格式, 溫度)：格式依成功率輪替，溫度依序遞增
+    所有候選 prompt 與估計輸出的 tokens 合計不超過 SPECULATIVE_MAX_TOKENS，超過時減少候選數
+    """
+    formats = []
+    exclude = set()
+    for _ in edit_formats.eligible_formats(original):
+        edit_format = edit_formats.select_format(original, exclude=exclude)
+        formats.append(edit_format)
+        exclude.add(edit_format.name)
+
+    plan = []
+    budget = SPECULATIVE_MAX_TOKENS
+    source_tokens = history.count_tokens(original)
+    for index in range(SPECULATIVE_CANDIDATES):
+        edit_format = formats[index % len(formats)]
+        temperature = SPECULATIVE_TEMPERATURES[(index // len(formats)) % len(SPECULATIVE_TEMPERATURES)]
+        messages = _edit_messages(
+            original, todo, note_ls, target_file, target_lang, edit_format, symbols=symbols, locations=locations
+        )
+        cost = sum(history.count_tokens(message.content) for message in messages)
+        cost += _estimated_output_tokens(edit_format, source_tokens)
+        if cost > budget:
+            break
+        budget -= cost
+        plan.append((edit_format, temperature, messages))
+    return plan
 
-Original code:
 
-```
-4: <meta charset="UTF-8">
-5: <title>Welcome My Website!</title>
-6: </head>
-```
+def _speculative_diff(original, todo, note_ls, target_file, target_lang, stats, symbols="", locations=None):
+    """
+    錯開啟動多個候選並採用第一個能套用的結果
 
-Desired change:
+    Returns:
+        tuple | None: (status, value, 使用過的格式名稱)，status 與 value 同 _attempt_edit；
+                      成本上限只允許一個候選時回傳 None，交由逐次重試處理
+    """
+    plan = _speculative_plan(original, todo, note_ls, target_file, target_lang, symbols, locations)
+    if len(plan) < 2:
+        logger.info(f"{target_file} 的 prompt 超過推測模式的成本上限，改為逐次生成")
+        return None
+
+    def make_candidate(edit_format, temperature, messages):
+        def candidate(cancelled):
+            # 已有候選勝出時不再送出請求
+            if cancelled.is_set():
+                raise RuntimeError("已取消")
+            # 以串流接收：其他候選勝出時中途關閉連線，不再為剩下的輸出付費
+            stream = llm_client.get_chat_model("gpt-4o", temperature=temperature).stream(messages, stream_usage=True)
+            response = None
+            try:
+                for chunk in stream:
+                    if cancelled.is_set():
+                        raise RuntimeError("已取消")
+                    response = chunk if response is None else response + chunk
+            finally:
+                stream.close()
+            return response if response is not None else AIMessage(content="")
+        return candidate
+
+    def accept(index, response):
+        status, value = _check_edit(response, original, target_file, plan[index][0])
+        if status == "error":
+            raise unified_diff.PatchError(value)
+        return status, value
+
+    result = speculative.first_valid(
+        [make_candidate(*entry) for entry in plan], accept, stagger=SPECULATIVE_STAGGER_SECONDS
+    )
+    if stats is not None:
+        stats["llm_calls"] += result.started
+        stats["speculative_candidates"] = stats.get("speculative_candidates", 0) + result.started
+
+    tried = {plan[index][0].name for index in range(result.started)}
+    if result.winner is None:
+        errors = "\n".join(f"- {message}" for _, message in result.errors)
+        return "error", f"{result.started} 個候選都無法套用：\n{errors}", tried
+
+    edit_format, temperature, _ = plan[result.winner]
+    status, value = result.value
+    logger.info(
+        f"{target_file} 推測生成：啟動 {result.started}/{len(plan)} 個候選，第 {result.winner + 1} 個"
+        f"（{edit_format.name}，溫度 {temperature}）於 {result.elapsed:.2f} 秒勝出，"
+        f"{len(result.errors)} 個候選未通過驗證"
+    )
+    if status == "diff":
+        _record_diff_outcome(stats, value[1])
+        return status, value[0], set()
+    return status, value, set()
 
-* Replace line 5 with:
-  `<title>Hello World!</title>`
 
-Analysis:
+def _virtual_test_diff(container_name, diff_code, language):
+    """
+    虛擬測試 diff 是否能成功套用，不實際修改檔案
+    在記憶體中以 unified_diff 對照目前的檔案內容驗證；不吻合時先嘗試在本地修正
+    （重算 hunk 行數、在附近搜尋 context 重新定位），修正失敗的錯誤訊息會指出不吻合的 hunk 與行號
 
-* Context lines: lines 4 and 6
-* Affected lines: 3 total
-* Hunk header: `@@ -4,3 +4,3 @@`
+    Returns:
+        dict: {"success": bool, "error": str, "diff": 可直接套用的 diff, "repairs": 本地修正項目}
+    """
+    target_file = TARGET_FILES.get(LANGUAGE_NAMES.get(language.lower(), ""))
+    if not target_file:
+        return {"success": False, "error": f"不支援的語言類型: {language}", "diff": diff_code, "repairs": []}
 
-✅ Final diff:
+    try:
+        original = ai_tool.read_source_file(container_name, target_file)
+    except docker.errors.NotFound:
+        return {"success": False, "error": f"找不到容器: {container_name}", "diff": diff_code, "repairs": []}
+    except Exception as e:
+        return {"success": False, "error": f"虛擬測試過程發生錯誤: {str(e)}", "diff": diff_code, "repairs": []}
 
-```
---- index.html
-+++ index.html
-@@ -4,3 +4,3 @@
-    <meta charset="UTF-8">
--   <title>Welcome My Website!</title>
-+   <title>Hello World!</title>
-    </head>
-```
+    try:
+        unified_diff.apply_patch(original, diff_code, target_file)
+        return {"success": True, "error": "", "diff": diff_code, "repairs": []}
+    except unified_diff.PatchError as e:
+        error = f"Patch 驗證失敗：{str(e)}"
 
-{"Previous attempt failed" if attempt > 0 else ""}
-{f"Error from previous attempt: {previous_error}" if attempt > 0 and 'previous_error' in locals() else ""}
-"""
+    try:
+        repaired_diff, repairs = unified_diff.repair_diff(original, diff_code, target_file)
+        unified_diff.apply_patch(original, repaired_diff, target_file)
+    except unified_diff.PatchError as e:
+        return {"success": False, "error": f"{error}\n本地修正失敗：{str(e)}", "diff": diff_code, "repairs": []}
 
-        # 如果是重試，添加錯誤資訊到 prompt
-        if attempt > 0 and 'previous_error' in locals():
-            system_message += f"\n\n⚠️ Previous attempt failed with error:\n{previous_error}\n\nPlease fix the issue and generate a corrected diff."
+    logger.info(f"本地修正 {target_file} 的 diff：{'；'.join(repairs)}")
+    return {"success": True, "error": "", "diff": repaired_diff, "repairs": repairs}
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_message),
-            ("human", todo)
-        ])
 
-        response = llm.invoke(prompt.format_messages())
-        generated_diff = response.content.strip()
+# 累計的 diff 驗證結果：valid（直接通過）、repaired（本地修正後通過）、llm_retry（請 LLM 重新生成）
+DIFF_METRICS = {"valid": 0, "repaired": 0, "llm_retry": 0}
+_diff_metrics_lock = threading.Lock()
 
-        # 如果 AI 回應 SKIP，直接返回
-        if generated_diff.strip() == "SKIP":
-            return "SKIP"
 
-        # 虛擬測試生成的 diff
-        test_result = _virtual_test_diff(container_name, generated_diff, lang)
+def _record_diff_outcome(stats, outcome):
+    with _diff_metrics_lock:
+        DIFF_METRICS[outcome] += 1
+    if stats is not None:
+        stats[f"diff_{outcome}"] = stats.get(f"diff_{outcome}", 0) + 1
 
-        if test_result["success"]:
-            # 測試成功，返回生成的 diff
-            return generated_diff
-        else:
-            # 測試失敗，記錄錯誤並重試
-            previous_error = test_result["error"]
-            if attempt == max_retries - 1:
-                # 最後一次嘗試失敗，返回錯誤
-                return f"生成 diff 失敗，已嘗試 {max_retries} 次。最後錯誤：{previous_error}"
 
-    return "生成 diff 失敗：未知錯誤"
+def get_diff_metrics():
+    """回傳目前為止 diff 直接通過、本地修正與 LLM 重試的次數"""
+    with _diff_metrics_lock:
+        return dict(DIFF_METRICS)
 
 
-def _virtual_test_diff(container_name, diff_code, language):
+def create_diff(container_name, todo_list, stats=None):
     """
-    虛擬測試 diff 是否能成功套用，不實際修改檔案
+    為每個 TODO 項目生成 diff 並自動套用到容器
+    注意：每個 diff 生成前都會重新抓取最新源碼，確保基於當前狀態生成
 
-    Returns:
-        dict: {"success": bool, "error": str}
+    index.html、index.css、index.js 彼此獨立，三個語言的 pipeline 並行執行；
+    同一檔案以 _file_lock 保護，結果依 HTML、CSS、JavaScript 的固定順序組合。
+
+    同一檔案有多個 TODO 時先以一次請求批次生成（見 _batch_diff），
+    只有批次中失敗的項目才退回逐項生成；stats 會記錄 LLM 呼叫次數與估計節省的 tokens
     """
-    try:
-        import docker
-        import tempfile
+    if stats is None:
+        stats = {}
+    for key in ("llm_calls", "baseline_calls", "tokens_saved"):
+        stats.setdefault(key, 0)
 
-        # 初始化 Docker 客戶端
-        client = docker.from_env()
-        container = client.containers.get(container_name)
+    langs = [lang for lang in ["HTML", "CSS", "JavaScript"] if todo_list[lang]]
+    lang_stats = {lang: {"llm_calls": 0, "baseline_calls": 0, "tokens_saved": 0} for lang in langs}
 
-        # 檢查容器狀態
-        container.reload()
-        if container.status != 'running':
-            return {"success": False, "error": f"容器 {container_name} 狀態為 {container.status}，需要運行中狀態"}
+    start = time.perf_counter()
+    # 以一次 get_archive 預先讀取全部檔案，之後各 pipeline 的讀取都從快取取得；
+    # 同時更新符號索引，讓每個檔案的 prompt 都能列出其他檔案的 id、class 與函式
+    try:
+        symbol_index.get_index().update_files(container_name, ai_tool.read_project_files(container_name))
+    except Exception as e:
+        logger.warning(f"預先讀取專案檔案失敗，改為各自讀取: {str(e)}")
 
-        # 創建臨時檔案
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix=".diff", encoding='utf-8') as tmp:
-            tmp.write(diff_code)
-            diff_path = tmp.name
+    with ThreadPoolExecutor(max_workers=max(len(langs), 1), thread_name_prefix="edit-pipeline") as executor:
+        futures = {
+            lang: executor.submit(_run_pipeline, container_name, lang, todo_list[lang], todo_list["note"], lang_stats[lang])
+            for lang in langs
+        }
 
+    results = []
+    for lang in langs:
         try:
-            # 上傳 patch 檔案到容器
-            tar_data = ai_tool.create_tar_from_file(diff_path, "test_patch.diff")
-            container.put_archive(path="/tmp", data=tar_data)
-
-            # 根據語言類型確定目標文件路徑
-            target_dir = "/usr/share/nginx/html"
-            file_mapping = {
-                'html': 'index.html',
-                'css': 'index.css',
-                'js': 'index.js',
-                'javascript': 'index.js'
-            }
+            results.extend(futures[lang].result())
+        except Exception as e:
+            logger.error(f"{lang} 編輯流程發生錯誤: {str(e)}", exc_info=True)
+            results.append(f"[{lang}] ❌ 編輯流程發生錯誤：{str(e)}")
+        for key, value in lang_stats[lang].items():
+            stats[key] = stats.get(key, 0) + value
 
-            target_file = file_mapping.get(language.lower())
-            if not target_file:
-                return {"success": False, "error": f"不支援的語言類型: {language}"}
+    logger.info(f"套用 {len(langs)} 個檔案的 TODO（並行），耗時 {time.perf_counter() - start:.2f} 秒")
+    return results
 
-            # 執行 dry-run 測試
-            dry_run_cmd = f"sh -c 'cd {target_dir} && patch --dry-run --batch --forward -p0 < /tmp/test_patch.diff'"
-            dry_run_result = container.exec_run(dry_run_cmd)
 
-            if dry_run_result.exit_code == 0:
-                return {"success": True, "error": ""}
-            else:
-                error_output = dry_run_result.output.decode('utf-8').strip()
-                return {"success": False, "error": f"Patch dry-run 失敗：{error_output}"}
+class _FileLock:
+    """可被弱參照的鎖（threading.Lock 本身不行）"""
 
-        finally:
-            # 清理臨時檔案
-            if os.path.exists(diff_path):
-                os.remove(diff_path)
+    def __init__(self):
+        self._lock = threading.Lock()
 
-    except docker.errors.NotFound:
-        return {"success": False, "error": f"找不到容器: {container_name}"}
-    except Exception as e:
-        return {"success": False, "error": f"虛擬測試過程發生錯誤: {str(e)}"}
+    def __enter__(self):
+        self._lock.acquire()
+        return self
 
+    def __exit__(self, *exc_info):
+        self._lock.release()
 
-def create_diff(container_name, todo_list):
-    """
-    為每個 TODO 項目生成 diff 並自動套用到容器
-    注意：每個 diff 生成前都會重新抓取最新源碼，確保基於當前狀態生成
-    """
+
+# 只以弱參照保存：沒有 pipeline 持有或等待某個檔案的鎖時，該項目會自動移除，長時間執行也不會累積
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_guard = threading.Lock()
+
+
+def _file_lock(container_name, lang):
+    """取得容器內單一檔案的鎖，確保同一檔案同時只有一個 pipeline 在 patch"""
+    key = (container_name, TARGET_FILES[lang])
+    with _file_locks_guard:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = _FileLock()
+        return lock
+
+
+def _run_pipeline(container_name, lang, todos, note_ls, stats):
+    """單一檔案的生成與套用流程，回傳該檔案的結果訊息"""
     results = []
 
-    for lang in ["HTML", "CSS", "JavaScript"]:
-        if todo_list[lang] == []:
-            continue
+    # 逐項模式下每個 TODO 至少需要一次 LLM 呼叫
+    stats["baseline_calls"] += len(todos)
+
+    with _file_lock(container_name, lang):
+        pending = todos
+        if BATCH_DIFF_ENABLED and len(pending) > 1:
+            batch_results, pending = _batch_diff(container_name, pending, lang, note_ls, stats)
+            results.extend(batch_results)
 
-        for todo in todo_list[lang]:
+        for todo in pending:
             # 生成 diff（內部會重新抓取最新源碼）
-            diff_result = llm_diff(container_name, todo, lang, todo_list["note"])
+            diff_result = llm_diff(container_name, todo, lang, note_ls, stats)
 
             if diff_result == "SKIP":
                 results.append(f"[{lang}] {todo} - 已跳過，無需修改")
@@ -388,14 +671,170 @@ def create_diff(container_name, todo_list):
 
                 if apply_result["success"]:
                     results.append(f"[{lang}] {todo} - ✅ 成功套用")
-                    if apply_result["latest_code"]:
-                        results.append(f"[{lang}] 最新代碼已更新")
+                    if apply_result["version"]:
+                        results.append(f"[{lang}] 最新代碼已更新（版本 {apply_result['version']}）")
                 else:
                     results.append(f"[{lang}] {todo} - ❌ 套用失敗：{apply_result['message']}")
 
     return results
 
 
+# ---------- 批次生成 diff ---------- #
+
+class TodoDiff(BaseModel):
+    """The unified diff for a single TODO item."""
+
+    index: int = Field(description="1-based number of the TODO item this diff implements")
+    diff: str = Field(description="Unified diff for this TODO only, relative to the original source, or SKIP if no change is needed")
+
+
+class BatchDiff(BaseModel):
+    """One unified diff per TODO item, all computed against the same original source."""
+
+    items: List[TodoDiff]
+
+
+def _merge_diffs(item_diffs, target_file):
+    """
+    將多個針對同一份原始碼的 diff 合併成一個多 hunk 的 patch
+
+    只比較實際修改的行（刪除的行與插入位置），與已接受的修改衝突或無法解析的 diff 會被排除，
+    交由逐項生成處理；只共用 context 行的 hunk 會合併成同一個 hunk，並重新計算 new_start。
+
+    Returns:
+        tuple: (合併後的 diff, 已合併的 key 列表, 被排除的 key 列表)
+    """
+    accepted_hunks = []
+    accepted_spans = []
+    merged_keys, rejected_keys = [], []
+
+    for key, diff_code in item_diffs:
+        try:
+            patches = unified_diff.parse(diff_code)
+        except unified_diff.PatchError:
+            rejected_keys.append(key)
+            continue
+        hunks = [hunk for patch in patches for hunk in patch.hunks]
+        spans = [unified_diff.changed_span(hunk) for hunk in hunks]
+        conflicts = any(
+            unified_diff.spans_conflict(span, other)
+            for i, span in enumerate(spans)
+            for other in accepted_spans + spans[:i]
+        )
+        if len(patches) > 1 or conflicts:
+            rejected_keys.append(key)
+            continue
+        accepted_hunks.extend(hunks)
+        accepted_spans.extend(spans)
+        merged_keys.append(key)
+
+    if not accepted_hunks:
+        return "", merged_keys, rejected_keys
+
+    return unified_diff.format_patch(target_file, unified_diff.combine_hunks(accepted_hunks)), merged_keys, rejected_keys
+
+
+def _batch_diff(container_name, todos, lang, note_ls, stats):
+    """
+    以一次 structured output 呼叫為同一檔案的所有 TODO 生成 diff，合併成一個 patch 後一次套用
+
+    Returns:
+        tuple: (結果訊息列表, 需要退回逐項生成的 TODO 列表)
+    """
+    target_file = TARGET_FILES[lang]
+    try:
+        original = ai_tool.read_source_file(container_name, target_file)
+    except Exception as e:
+        logger.warning(f"批次生成 {lang} diff 前抓取源碼失敗，改為逐項生成: {str(e)}")
+        return [], list(todos)
+    current_source = source_context.select_context(
+        original, [*todos, *note_ls], lang, locations=_symbol_locations(container_name, target_file, original)
+    )
+
+    system_message = f"""
+You are given a numbered list of TODO instructions describing modifications that need to be made to the source code file `{target_file}`.
+
+For **each** TODO item, write a separate **valid and precise unified diff** (`diff -u` format) that applies only that item's changes.
+Every diff must be computed against the original source code below, not against the output of other items, and the hunks of different items must not touch the same lines.
+
+```
+{current_source}
+```
+
+---
+
+{edit_formats.UDIFF_RULES}
+"""
+    numbered = "\n".join(f"{i}. {todo}" for i, todo in enumerate(todos, 1))
+    human_message = f"TODO items:\n{numbered}"
+    if note_ls:
+        human_message += "\n\nShared names across files:\n" + "\n".join(f"- {note}" for note in note_ls)
+    symbols = symbol_index.summarize_for(container_name, target_file)
+    if symbols:
+        human_message += f"\n\nNames defined in the other project files:\n{symbols}"
+
+    llm = llm_client.get_chat_model("gpt-4o", temperature=0)
+    stats["llm_calls"] += 1
+    try:
+        batch = llm.with_structured_output(BatchDiff).invoke(
+            [SystemMessage(content=system_message), HumanMessage(content=human_message)]
+        )
+    except Exception as e:
+        logger.warning(f"批次生成 {lang} diff 失敗，改為逐項生成: {str(e)}")
+        return [], list(todos)
+
+    diffs = {item.index: item.diff.strip() for item in batch.items if 1 <= item.index <= len(todos)}
+    results = []
+    candidates = []
+    for i, todo in enumerate(todos, 1):
+        if diffs.get(i) == "SKIP":
+            results.append(f"[{lang}] {todo} - 已跳過，無需修改")
+        elif diffs.get(i):
+            candidates.append((i, diffs[i]))
+
+    merged_diff, merged, _ = _merge_diffs(candidates, target_file)
+    test_result = _virtual_test_diff(container_name, merged_diff, lang) if merged else None
+    if test_result and not test_result["success"]:
+        # 合併後無法套用時逐一檢查（含本地修正），只保留各自可套用的項目
+        valid = []
+        for i, diff in candidates:
+            if i in merged:
+                item_result = _virtual_test_diff(container_name, diff, lang)
+                if item_result["success"]:
+                    valid.append((i, item_result["diff"]))
+        merged_diff, merged, _ = _merge_diffs(valid, target_file)
+        test_result = _virtual_test_diff(container_name, merged_diff, lang) if merged else None
+        if test_result and not test_result["success"]:
+            merged = []
+    if merged:
+        _record_diff_outcome(stats, "repaired" if test_result["repairs"] else "valid")
+        merged_diff = test_result["diff"]
+
+    if merged:
+        apply_result = apply_diff(container_name, merged_diff, lang)
+        if apply_result["success"]:
+            for i in merged:
+                results.append(f"[{lang}] {todos[i - 1]} - ✅ 成功套用（批次）")
+            if apply_result["version"]:
+                results.append(f"[{lang}] 最新代碼已更新（版本 {apply_result['version']}）")
+        else:
+            merged = []
+
+    skipped = {i for i in range(1, len(todos) + 1) if diffs.get(i) == "SKIP"}
+    fallback = [todo for i, todo in enumerate(todos, 1) if i not in merged and i not in skipped]
+
+    # 以單一 patch 套用的項目在逐項模式下各需一次呼叫，每次都會重送一份源碼與格式規則；
+    # 跳過的項目沒有產生任何修改，不計入節省
+    if len(merged) > 1:
+        stats["tokens_saved"] += (len(merged) - 1) * history.count_tokens(system_message)
+
+    logger.info(
+        f"批次生成 {lang} diff：{len(todos)} 個 TODO，{len(merged)} 個以單一 patch 套用，"
+        f"{len(skipped)} 個跳過，{len(fallback)} 個改為逐項生成"
+    )
+    return results, fallback
+
+
 def run_sub_agent_edit_task(container_name, latest_input):
     """
     執行完整的子代理編輯任務流程
@@ -411,7 +850,10 @@ def run_sub_agent_edit_task(container_name, latest_input):
             return "❌ 無法生成有效的 TODO 清單，請檢查輸入內容"
 
         # 第二步：執行 diff 生成和套用
-        results = create_diff(container_name, todo_list)
+        stats = {}
+        cache_before = file_cache.cache_stats()
+        results = create_diff(container_name, todo_list, stats)
+        cache_after = file_cache.cache_stats()
 
         # 格式化回傳結果
         summary = []
@@ -436,6 +878,30 @@ def run_sub_agent_edit_task(container_name, latest_input):
         for result in results:
             summary.append(f"  {result}")
 
+        summary.append("")
+        summary.append(
+            f"📊 LLM 呼叫 {stats['llm_calls']} 次（逐項生成至少需 {stats['baseline_calls']} 次），"
+            f"約節省 {stats['tokens_saved']:,} 個 prompt tokens"
+        )
+        summary.append(
+            f"🔧 diff 直接通過 {stats.get('diff_valid', 0)} 次、本地修正 {stats.get('diff_repaired', 0)} 次、"
+            f"請 LLM 重新生成 {stats.get('diff_llm_retry', 0)} 次"
+        )
+        summary.append(
+            f"🗂️ 原始碼快取命中 {cache_after['hits'] - cache_before['hits']} 次、"
+            f"從容器讀取 {cache_after['misses'] - cache_before['misses']} 次"
+        )
+
+        # 以符號索引在本地檢查跨檔案的參照，不需要額外的 LLM 呼叫
+        problems = symbol_index.get_index().check(container_name, todo_list["note"])
+        if problems:
+            summary.append("")
+            summary.append("🔗 一致性檢查發現懸空的參照:")
+            for problem in problems:
+                summary.append(f"    • {problem.message}")
+        elif symbol_index.get_index().indexed_files(container_name):
+            summary.append("🔗 一致性檢查：沒有發現懸空的參照")
+
         return "\n".join(summary)
 
     except Exception as e:
@@ -445,6 +911,7 @@ def run_sub_agent_edit_task(container_name, latest_input):
 def apply_diff(container_name, diff_code, language):
     """
     實際套用 diff patch 到 Docker 容器中的檔案（無 log_print 版本）
+    diff 在記憶體中套用到目前的檔案內容，驗證通過後才以一次 put_archive 寫回新內容
 
     Args:
         container_name: Docker 容器名稱
@@ -452,151 +919,67 @@ def apply_diff(container_name, diff_code, language):
         language: 語言類型 (html, css, js)
 
     Returns:
-        dict: {"success": bool, "message": str, "latest_code": str}
+        dict: {"success": bool, "message": str, "version": 寫入後的檔案快取版本號，失敗時為 0}
     """
-    try:
-        import docker
-        import tempfile
-
-        # 初始化 Docker 客戶端
-        client = docker.from_env()
-        container = client.containers.get(container_name)
-
-        # 檢查容器狀態
-        container.reload()
-        if container.status != 'running':
-            return {
-                "success": False,
-                "message": f"容器 {container_name} 狀態為 {container.status}，需要運行中狀態",
-                "latest_code": ""
-            }
-
-    except docker.errors.NotFound:
-        return {
-            "success": False,
-            "message": f"找不到容器: {container_name}",
-            "latest_code": ""
-        }
-    except Exception as e:
+    target_file = TARGET_FILES.get(LANGUAGE_NAMES.get(language.lower(), ""))
+    if not target_file:
         return {
             "success": False,
-            "message": f"Docker 連接錯誤: {str(e)}",
-            "latest_code": ""
+            "message": f"不支援的語言類型: {language}",
+            "version": 0
         }
 
-    # 創建臨時檔案
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix=".diff", encoding='utf-8') as tmp:
-            tmp.write(diff_code)
-            diff_path = tmp.name
-    except Exception as e:
-        return {
-            "success": False,
-            "message": f"無法創建臨時檔案: {str(e)}",
-            "latest_code": ""
-        }
-
-    try:
-        # 上傳 patch 檔案到容器
-        tar_data = ai_tool.create_tar_from_file(diff_path, "patch.diff")
-        container.put_archive(path="/tmp", data=tar_data)
-
-        # 驗證檔案上傳
-        verify_result = container.exec_run("ls -la /tmp/patch.diff")
-        if verify_result.exit_code != 0:
-            return {
-                "success": False,
-                "message": "檔案上傳驗證失敗",
-                "latest_code": ""
-            }
-
-        # 根據語言類型確定目標文件路徑
-        target_dir = "/usr/share/nginx/html"
-        file_mapping = {
-            'html': 'index.html',
-            'css': 'index.css',
-            'js': 'index.js',
-            'javascript': 'index.js'
-        }
-
-        target_file = file_mapping.get(language.lower())
-        if not target_file:
+    # 讀取-修改-寫入：先以快取的內容套用，寫入時在同一次往返中確認檔案內容沒有被外部修改
+    # （例如終端機或 bind mount）；被修改過時以最新內容重新套用一次，不會覆蓋外部修改
+    for max_age in (None, 0):
+        try:
+            original = ai_tool.read_source_file(container_name, target_file, max_age=max_age)
+            patched = unified_diff.apply_patch(original, diff_code, target_file)
+        except unified_diff.PatchError as e:
             return {
                 "success": False,
-                "message": f"不支援的語言類型: {language}",
-                "latest_code": ""
+                "message": f"Patch 驗證失敗: {str(e)}",
+                "version": 0
             }
-
-        target_file_path = f"{target_dir}/{target_file}"
-
-        # 檢查目標文件是否存在
-        file_result = container.exec_run(f"ls -la {target_file_path}")
-        if file_result.exit_code != 0:
+        except docker.errors.NotFound:
             return {
                 "success": False,
-                "message": f"目標文件不存在: {target_file_path}",
-                "latest_code": ""
+                "message": f"找不到容器: {container_name}",
+                "version": 0
             }
-
-        # Dry-run 測試
-        dry_run_cmd = f"sh -c 'cd {target_dir} && patch --dry-run --batch --forward -p0 < /tmp/patch.diff'"
-        dry_run_result = container.exec_run(dry_run_cmd)
-
-        if dry_run_result.exit_code != 0:
+        except Exception as e:
             return {
                 "success": False,
-                "message": f"Patch dry-run 失敗: {dry_run_result.output.decode('utf-8').strip()}",
-                "latest_code": ""
+                "message": f"讀取 {target_file} 失敗: {str(e)}",
+                "version": 0
             }
 
-        # 實際套用 patch
-        apply_cmd = f"sh -c 'cd {target_dir} && patch --batch --forward -p0 < /tmp/patch.diff'"
-        apply_result = container.exec_run(apply_cmd)
-
-        if apply_result.exit_code == 0:
-            # 套用成功，獲取最新代碼
-            try:
-                language_lower = language.lower()
-                if language_lower == 'html':
-                    latest_code = ai_tool.get_html_code(container_name)
-                elif language_lower == 'css':
-                    latest_code = ai_tool.get_css_code(container_name)
-                elif language_lower in ['js', 'javascript']:
-                    latest_code = ai_tool.get_js_code(container_name)
-                else:
-                    latest_code = "無法識別的語言類型"
-
-                return {
-                    "success": True,
-                    "message": f"Patch 套用成功: {apply_result.output.decode('utf-8').strip()}",
-                    "latest_code": latest_code
-                }
-            except Exception as e:
+        try:
+            version = ai_tool.write_source_file(
+                container_name, target_file, patched, expected_digest=file_cache.content_digest(original)
+            )
+            symbol_index.get_index().update(container_name, target_file, patched)
+            break
+        except ai_tool.FileChangedError as e:
+            if max_age == 0:
                 return {
-                    "success": True,
-                    "message": f"Patch 套用成功，但獲取最新代碼失敗: {str(e)}",
-                    "latest_code": ""
+                    "success": False,
+                    "message": f"套用過程發生錯誤: {str(e)}",
+                    "version": 0
                 }
-        else:
+            logger.info(f"{target_file} 在讀取後被外部修改，以最新內容重新套用")
+        except Exception as e:
             return {
                 "success": False,
-                "message": f"Patch 套用失敗: {apply_result.output.decode('utf-8').strip()}",
-                "latest_code": ""
+                "message": f"套用過程發生錯誤: {str(e)}",
+                "version": 0
             }
 
-    except Exception as e:
-        return {
-            "success": False,
-            "message": f"套用過程發生錯誤: {str(e)}",
-            "latest_code": ""
-        }
-    finally:
-        # 清理臨時檔案
-        try:
-            if os.path.exists(diff_path):
-                os.remove(diff_path)
-        except:
-            pass
+    return {
+        "success": True,
+        "message": f"Patch 套用成功: {target_file}",
+        "version": version
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,319 @@
+"""
+專案符號索引
+
+記錄三個檔案中的符號與其位置：HTML 的 id、class 與事件屬性，CSS 選擇器中的 class 與 id，
+JavaScript 的函式、事件綁定與對 DOM 的參照（getElementById、querySelector、classList）。
+索引以檔案為單位增量更新：內容雜湊沒變的檔案不會重新解析。
+locations() 依名稱回傳符號所在的行號範圍，diff prompt 以此直接挑出相關區段。
+
+check() 以索引在本地找出懸空的參照（例如 JS 取用不存在的 id、onclick 呼叫未定義的函式、
+note 中宣告但沒有出現在任何檔案的名稱），不需要額外的 LLM 呼叫。
+"""
+import hashlib
+import re
+import threading
+from html.parser import HTMLParser
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from . import source_context
+
+HTML_FILE, CSS_FILE, JS_FILE = "index.html", "index.css", "index.js"
+
+# onclick 等屬性中不需要在 index.js 定義的名稱
+_BUILTIN_CALLS = {
+    "alert", "confirm", "prompt", "setTimeout", "setInterval", "clearTimeout", "clearInterval",
+    "fetch", "parseInt", "parseFloat", "String", "Number", "Boolean", "encodeURIComponent", "history",
+}
+_CALL_PATTERN = re.compile(r"(?<![\w$.])([A-Za-z_$][\w$]*)\s*\(")
+_SELECTOR_ID_PATTERN = re.compile(r"#(-?[A-Za-z_][\w-]*)")
+_SELECTOR_CLASS_PATTERN = re.compile(r"\.(-?[A-Za-z_][\w-]*)")
+_GET_BY_ID_PATTERN = re.compile(r"getElementById\(\s*['\"`]([^'\"`]+)['\"`]\s*\)")
+_QUERY_PATTERN = re.compile(r"querySelector(?:All)?\(\s*['\"`]([^'\"`]+)['\"`]\s*\)")
+_CLASS_LIST_PATTERN = re.compile(r"classList\.(?:add|remove|toggle|contains|replace)\(([^)]*)\)")
+_STRING_PATTERN = re.compile(r"['\"`]([\w-]+)['\"`]")
+_LISTENER_PATTERN = re.compile(r"addEventListener\(\s*['\"`]([\w:-]+)['\"`]")
+# JS 動態產生的元素：字串中的 id="..." 與 class="..."，或 el.id = '...'
+_JS_ID_DEFINITION_PATTERN = re.compile(r"""(?:\bid\s*=\s*\\?["']|\.id\s*=\s*['"`])([\w-]+)""")
+_JS_CLASS_DEFINITION_PATTERN = re.compile(r"""(?:\bclass\s*=\s*\\?["']|\.className\s*=\s*['"`])([\w\s-]+)""")
+_NOTE_PATTERN = re.compile(r"^\s*([\w-]+)\s*:\s*([^\s]+)\s*-")
+
+# Tailwind 工具類別：頁面載入 Tailwind 時，這些 class 不需要在 index.css 定義
+_TAILWIND_UTILITIES = {
+    "container", "flex", "inline-flex", "grid", "inline-grid", "block", "inline-block", "inline", "hidden",
+    "contents", "table", "flow-root", "static", "fixed", "absolute", "relative", "sticky", "visible", "invisible",
+    "collapse", "isolate", "grow", "shrink", "truncate", "italic", "not-italic", "underline", "overline",
+    "line-through", "no-underline", "uppercase", "lowercase", "capitalize", "normal-case", "antialiased",
+    "subpixel-antialiased", "border", "rounded", "shadow", "ring", "outline", "transition", "transform", "filter",
+    "blur", "sr-only", "not-sr-only", "resize", "prose", "group", "peer", "invert", "grayscale", "sepia",
+}
+_TAILWIND_PREFIXES = (
+    "text-", "bg-", "from-", "via-", "to-", "font-", "leading-", "tracking-", "decoration-", "underline-offset-",
+    "indent-", "align-", "whitespace-", "break-", "line-clamp-", "list-", "placeholder-", "caret-", "accent-",
+    "p-", "px-", "py-", "pt-", "pr-", "pb-", "pl-", "ps-", "pe-", "m-", "mx-", "my-", "mt-", "mr-", "mb-", "ml-",
+    "ms-", "me-", "space-x-", "space-y-", "gap-", "gap-x-", "gap-y-", "w-", "h-", "min-w-", "min-h-", "max-w-",
+    "max-h-", "size-", "flex-", "basis-", "grow-", "shrink-", "order-", "grid-", "col-", "row-", "auto-cols-",
+    "auto-rows-", "justify-", "items-", "content-", "self-", "place-", "top-", "right-", "bottom-", "left-",
+    "inset-", "start-", "end-", "z-", "overflow-", "overscroll-", "object-", "aspect-", "columns-", "float-",
+    "clear-", "box-", "border-", "rounded-", "divide-", "outline-", "ring-", "shadow-", "opacity-", "mix-blend-",
+    "bg-blend-", "blur-", "brightness-", "contrast-", "drop-shadow-", "hue-rotate-", "saturate-", "backdrop-",
+    "transition-", "duration-", "ease-", "delay-", "animate-", "scale-", "rotate-", "translate-", "skew-",
+    "origin-", "cursor-", "pointer-events-", "select-", "scroll-", "snap-", "touch-", "will-change-", "fill-",
+    "stroke-", "table-", "caption-", "visible-", "group-", "peer-",
+)
+# 狀態與 RWD 前綴（hover:、md:、dark:、[&>*]: 等）、! 與負值的 -
+_TAILWIND_VARIANT_PATTERN = re.compile(r"^(?:(?:[\w-]+|\[[^\]]*\]):)*!?-?")
+
+
+def is_tailwind_utility(name: str) -> bool:
+    """判斷 class 名稱是否為 Tailwind 工具類別（含變體前綴、任意值與透明度，例如 md:w-[300px]、bg-black/50）"""
+    base = _TAILWIND_VARIANT_PATTERN.sub("", name, count=1)
+    base = base.split("/", 1)[0]
+    return base in _TAILWIND_UTILITIES or (base.startswith(_TAILWIND_PREFIXES) and not base.endswith("-"))
+
+
+class Symbol(NamedTuple):
+    # id、class、css-id、css-class、function、event、call、js-id、js-class、framework
+    kind: str
+    name: str
+    file: str
+    line: int
+    # 定義的最後一行（CSS 規則、JS 函式的結尾）；0 表示只有 line 這一行
+    end: int = 0
+
+
+class Problem(NamedTuple):
+    kind: str
+    name: str
+    file: str
+    line: int
+    message: str
+
+
+def _line_at(text: str, offset: int) -> int:
+    return text.count("\n", 0, offset) + 1
+
+
+def extract_symbols(filename: str, content: str) -> List[Symbol]:
+    """解析單一檔案的符號"""
+    if filename.endswith(".html"):
+        return _html_symbols(filename, content)
+    if filename.endswith(".css"):
+        return _css_symbols(filename, content)
+    if filename.endswith(".js"):
+        return _js_symbols(filename, content)
+    return []
+
+
+def _html_symbols(filename: str, content: str) -> List[Symbol]:
+    symbols: List[Symbol] = []
+
+    class Parser(HTMLParser):
+        def handle_starttag(self, tag, attrs):
+            line = self.getpos()[0]
+            for name, value in attrs:
+                value = value or ""
+                if name == "id" and value:
+                    symbols.append(Symbol("id", value, filename, line))
+                elif name == "class":
+                    symbols.extend(Symbol("class", item, filename, line) for item in value.split())
+                elif name.startswith("on"):
+                    symbols.append(Symbol("event", name[2:], filename, line))
+                    symbols.extend(Symbol("call", call, filename, line) for call in _CALL_PATTERN.findall(value))
+                elif name == "src" and "tailwind" in value:
+                    symbols.append(Symbol("framework", "tailwind", filename, line))
+
+    parser = Parser(convert_charrefs=True)
+    parser.feed(content)
+    parser.close()
+    return symbols
+
+
+def _css_symbols(filename: str, content: str) -> List[Symbol]:
+    symbols: List[Symbol] = []
+    for start, end, selector in source_context.outline_spans(content, "CSS"):
+        if selector.startswith("@"):
+            continue
+        # 屬性選擇器與虛擬類別的參數中可能出現 . 或 #，先移除
+        cleaned = re.sub(r"\[[^\]]*\]|\([^)]*\)", "", selector)
+        symbols.extend(Symbol("css-id", name, filename, start, end) for name in _SELECTOR_ID_PATTERN.findall(cleaned))
+        symbols.extend(Symbol("css-class", name, filename, start, end) for name in _SELECTOR_CLASS_PATTERN.findall(cleaned))
+    return symbols
+
+
+def _js_symbols(filename: str, content: str) -> List[Symbol]:
+    symbols = [Symbol("function", name, filename, start, end)
+               for start, end, name in source_context.outline_spans(content, "JavaScript")]
+
+    for match in _GET_BY_ID_PATTERN.finditer(content):
+        symbols.append(Symbol("js-id", match.group(1), filename, _line_at(content, match.start())))
+    for match in _QUERY_PATTERN.finditer(content):
+        line = _line_at(content, match.start())
+        selector = re.sub(r"\[[^\]]*\]", "", match.group(1))
+        symbols.extend(Symbol("js-id", name, filename, line) for name in _SELECTOR_ID_PATTERN.findall(selector))
+        symbols.extend(Symbol("js-class", name, filename, line) for name in _SELECTOR_CLASS_PATTERN.findall(selector))
+    for match in _CLASS_LIST_PATTERN.finditer(content):
+        line = _line_at(content, match.start())
+        symbols.extend(Symbol("js-class", name, filename, line) for name in _STRING_PATTERN.findall(match.group(1)))
+    for match in _LISTENER_PATTERN.finditer(content):
+        symbols.append(Symbol("event", match.group(1), filename, _line_at(content, match.start())))
+    for match in _JS_ID_DEFINITION_PATTERN.finditer(content):
+        symbols.append(Symbol("id", match.group(1), filename, _line_at(content, match.start())))
+    for match in _JS_CLASS_DEFINITION_PATTERN.finditer(content):
+        line = _line_at(content, match.start())
+        symbols.extend(Symbol("class", name, filename, line) for name in match.group(1).split())
+    return symbols
+
+
+class SymbolIndex:
+    """以容器為單位保存各檔案的符號；只有內容改變的檔案會重新解析"""
+
+    def __init__(self):
+        self._files: Dict[Tuple[str, str], Tuple[str, List[Symbol]]] = {}
+        self._lock = threading.Lock()
+
+    def update(self, container: str, filename: str, content: str) -> bool:
+        """以檔案最新內容更新索引，回傳是否重新解析"""
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        key = (container, filename)
+        with self._lock:
+            cached = self._files.get(key)
+        if cached is not None and cached[0] == digest:
+            return False
+        symbols = extract_symbols(filename, content)
+        with self._lock:
+            self._files[key] = (digest, symbols)
+        return True
+
+    def update_files(self, container: str, files: Dict[str, str]) -> None:
+        for filename, content in files.items():
+            self.update(container, filename, content)
+
+    def invalidate(self, container: str) -> None:
+        with self._lock:
+            for key in [key for key in self._files if key[0] == container]:
+                del self._files[key]
+
+    def symbols(self, container: str, kinds: Optional[Iterable[str]] = None, file: Optional[str] = None) -> List[Symbol]:
+        """列出符號，可依種類與檔案篩選"""
+        kinds = set(kinds) if kinds is not None else None
+        with self._lock:
+            entries = [symbols for (owner, filename), (_, symbols) in self._files.items()
+                       if owner == container and file in (None, filename)]
+        return [symbol for symbols in entries for symbol in symbols if kinds is None or symbol.kind in kinds]
+
+    def lookup(self, container: str, name: str) -> List[Symbol]:
+        """找出所有名稱相同的符號（跨檔案）"""
+        return [symbol for symbol in self.symbols(container) if symbol.name == name]
+
+    def locations(self, container: str, file: str) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        檔案中每個符號名稱出現的行號範圍 {名稱: [(起始行, 結束行), ...]}，行號從 1 開始
+        供 source_context.select_context 直接定位相關區段，不必逐行搜尋
+        """
+        found: Dict[str, List[Tuple[int, int]]] = {}
+        for symbol in self.symbols(container, file=file):
+            found.setdefault(symbol.name, []).append((symbol.line, max(symbol.end, symbol.line)))
+        return {name: sorted(set(spans)) for name, spans in found.items()}
+
+    def indexed_files(self, container: str) -> List[str]:
+        with self._lock:
+            return sorted(filename for owner, filename in self._files if owner == container)
+
+    def check(self, container: str, notes: Iterable[str] = ()) -> List[Problem]:
+        """
+        找出懸空的參照：
+        - JS 取用的 id 沒有出現在 HTML（或 JS 動態產生的元素）中
+        - HTML 事件屬性呼叫的函式沒有在 index.js 定義
+        - 使用中的 class 沒有任何 CSS 定義（頁面使用 Tailwind 時略過工具類別、note 中宣告與 JS 加入的 class）
+        - note 中宣告的名稱沒有出現在任何檔案
+        只檢查已建立索引的檔案，缺少的檔案不會產生誤報
+        """
+        files = set(self.indexed_files(container))
+        symbols = self.symbols(container)
+        names: Dict[str, set] = {}
+        for symbol in symbols:
+            names.setdefault(symbol.kind, set()).add(symbol.name)
+
+        def defined(*kinds):
+            return set().union(*(names.get(kind, set()) for kind in kinds))
+
+        problems: List[Problem] = []
+        seen = set()
+
+        def report(symbol, message):
+            if (symbol.kind, symbol.name) not in seen:
+                seen.add((symbol.kind, symbol.name))
+                problems.append(Problem(symbol.kind, symbol.name, symbol.file, symbol.line, message))
+
+        if HTML_FILE in files:
+            for symbol in symbols:
+                if symbol.kind == "js-id" and symbol.name not in defined("id"):
+                    report(symbol, f"{symbol.file}:{symbol.line} 取用的 id `{symbol.name}` 不存在於 HTML")
+
+        if JS_FILE in files:
+            functions = defined("function")
+            for symbol in symbols:
+                if symbol.kind == "call" and symbol.name not in functions and symbol.name not in _BUILTIN_CALLS:
+                    report(symbol, f"{symbol.file}:{symbol.line} 呼叫的函式 `{symbol.name}` 沒有在 {JS_FILE} 定義")
+
+        declared = []
+        for note in notes:
+            match = _NOTE_PATTERN.match(note)
+            if match:
+                declared.append((match.group(1).lower(), match.group(2).lstrip(".#").rstrip("()")))
+
+        if CSS_FILE in files:
+            css_classes = defined("css-class")
+            tailwind = "tailwind" in names.get("framework", set())
+            # 使用 Tailwind 的頁面略過工具類別、note 中宣告的 class 與 JS 加入的 class，其餘自訂 class 仍需 CSS 定義
+            exempt = {name for kind, name in declared if kind in ("css-class", "class")} if tailwind else set()
+            for symbol in symbols:
+                if symbol.kind not in ("class", "js-class") or symbol.name in css_classes:
+                    continue
+                if tailwind and (is_tailwind_utility(symbol.name) or symbol.name in exempt
+                                 or symbol.kind == "js-class" or symbol.file == JS_FILE):
+                    continue
+                report(symbol, f"{symbol.file}:{symbol.line} 使用的 class `{symbol.name}` 沒有任何 CSS 定義")
+
+        expected = {
+            "css-class": defined("class", "css-class", "js-class"),
+            "class": defined("class", "css-class", "js-class"),
+            "id": defined("id", "css-id", "js-id"),
+            "function": defined("function"),
+        }
+        for kind, name in declared:
+            if kind in expected and name not in expected[kind]:
+                report(Symbol(f"note-{kind}", name, "note", 0), f"note 中的 {kind} `{name}` 沒有出現在任何檔案")
+
+        return problems
+
+
+# 整個行程共用的索引
+_index = SymbolIndex()
+
+
+def get_index() -> SymbolIndex:
+    return _index
+
+
+def summarize_for(container: str, filename: str, limit: int = 40) -> str:
+    """
+    列出其他檔案中與 filename 相關的符號，供 diff prompt 維持跨檔案一致：
+    編輯 HTML 時列出 CSS class 與 JS 函式，編輯 CSS 或 JS 時列出 HTML 的 id 與 class
+    """
+    if filename == HTML_FILE:
+        groups = [("CSS classes", ["css-class"]), ("JS functions", ["function"]), ("ids used by JS", ["js-id"])]
+    else:
+        groups = [("HTML ids", ["id"]), ("HTML classes", ["class"])]
+        if filename == CSS_FILE:
+            groups.append(("classes toggled by JS", ["js-class"]))
+        else:
+            groups.append(("CSS classes", ["css-class"]))
+
+    lines = []
+    for label, kinds in groups:
+        found = sorted({symbol.name for symbol in _index.symbols(container, kinds) if symbol.file != filename})
+        if found:
+            more = f" (+{len(found) - limit} more)" if len(found) > limit else ""
+            lines.append(f"- {label}: {', '.join(found[:limit])}{more}")
+    return "\n".join(lines)
@@ -3,11 +3,17 @@ import docker
 import shutil
 import socket
 
-client = docker.from_env()
+from . import docker_client
+from . import file_cache
+from . import symbol_index
+from . import workspace
+
+# 工作目錄模式直接使用的 nginx image（檔案由 bind mount 提供）
+WORKSPACE_IMAGE = os.getenv("PROJECT_WORKSPACE_IMAGE", "nginx:alpine")
 
 
 def get_containers():
-    containers = client.containers.list(all=True)
+    containers = docker_client.get_client().containers.list(all=True)
     container_list = []
     for container in containers:
         if container.name.startswith("ai-web-ide_"):
@@ -29,8 +35,10 @@ def get_containers():
 def start_container(container_name: str):
     """根據容器名稱啟動指定的容器"""
     try:
-        container = client.containers.get(container_name)
+        container = docker_client.get_container(container_name)
         container.start()
+        # 快取的容器物件帶著啟動前的狀態，之後的查詢需要重新取得
+        docker_client.invalidate_container(container_name)
         print(f"✅ Container {container_name} started.")
     except docker.errors.NotFound:
         print(f"❌ Container {container_name} not found.")
@@ -43,8 +51,9 @@ def start_container(container_name: str):
 def stop_container(container_name: str):
     """根據容器名稱停止指定的容器"""
     try:
-        container = client.containers.get(container_name)
+        container = docker_client.get_container(container_name)
         container.stop()
+        docker_client.invalidate_container(container_name)
         print(f"✅ Container {container_name} stopped.")
     except docker.errors.NotFound:
         print(f"❌ Container {container_name} not found.")
@@ -56,15 +65,19 @@ def stop_container(container_name: str):
 
 def delete_container(container_name: str):
     """根據容器名稱刪除指定的容器，採用多段重試式刪除"""
+    file_cache.get_cache().invalidate(container_name)
+    symbol_index.get_index().invalidate(container_name)
     try:
-        container = client.containers.get(container_name)
+        container = docker_client.get_container(container_name)
 
         # 第一階段：嘗試一般刪除
         try:
-            # 先停止容器（如果正在運行）
+            # 先停止容器（如果正在運行）；快取的物件可能帶著舊的狀態，先重新讀取
+            container.reload()
             if container.status == 'running':
                 container.stop()
             container.remove()
+            _remove_workspace(container_name)
             print(f"✅ Container {container_name} deleted successfully.")
             return True
         except Exception as e:
@@ -73,6 +86,7 @@ def delete_container(container_name: str):
             # 第二階段：強制刪除（不顯示錯誤視窗）
             try:
                 container.remove(force=True)
+                _remove_workspace(container_name)
                 print(f"✅ Container {container_name} force deleted successfully.")
                 return True
             except Exception as force_e:
@@ -85,6 +99,19 @@ def delete_container(container_name: str):
     except Exception as e:
         print(f"❌ Error deleting container {container_name}: {e}")
         raise
+    finally:
+        docker_client.invalidate_container(container_name)
+
+
+def _remove_workspace(container_name: str) -> None:
+    """
+    專案檔案與容器一起刪除（與檔案只存在容器內時的行為相同）
+    容器已經刪除，工作目錄刪除失敗只顯示警告，不影響刪除容器的結果
+    """
+    try:
+        workspace.remove_workspace(container_name)
+    except Exception as e:
+        print(f"⚠️ Failed to remove workspace for {container_name}: {e}")
 
 
 def find_available_port(start_port=8080):
@@ -99,43 +126,51 @@ def find_available_port(start_port=8080):
 
 
 def create_container(container_name: str, port: int = 8080):
-    client = docker.from_env()
+    """
+    建立專案容器
+    設定 PROJECT_WORKSPACE_ROOT 時，專案檔案放在主機的工作目錄並以唯讀方式 bind mount 到 nginx，
+    不需要為每個專案建立 image；否則把檔案複製進專屬 image（檔案只存在容器內）
+    """
+    client = docker_client.get_client()
 
     # 找可用的 port
     port = find_available_port(port)
 
-    # 建立專案資料夾
     template_dir = "./docker_template"
-    project_dir = f"./ai-web-ide_{container_name}"
-    os.makedirs(project_dir, exist_ok=True)
-
-    # 複製模板檔案
-    for filename in ["index.html", "index.css", "index.js"]:
-        shutil.copy(os.path.join(template_dir, filename), os.path.join(project_dir, filename))
-
-    # 建立 Dockerfile - 包含 patch 工具安裝
-    dockerfile_path = os.path.join(project_dir, "Dockerfile")
-    with open(dockerfile_path, "w") as f:
-        f.write("""
+    template_files = ["index.html", "index.css", "index.js"]
+    container_id = f"ai-web-ide_{container_name.lower()}_container"
+    project_dir = None
+
+    if workspace.enabled():
+        image_tag = WORKSPACE_IMAGE
+    else:
+        # 建立專案資料夾
+        project_dir = f"./ai-web-ide_{container_name}"
+        os.makedirs(project_dir, exist_ok=True)
+
+        # 複製模板檔案
+        for filename in template_files:
+            shutil.copy(os.path.join(template_dir, filename), os.path.join(project_dir, filename))
+
+        # 建立 Dockerfile；修改檔案時在主機端套用 diff 後以 put_archive 寫入，容器內不需要 patch 工具
+        dockerfile_path = os.path.join(project_dir, "Dockerfile")
+        with open(dockerfile_path, "w") as f:
+            f.write("""
 FROM nginx:alpine
 
-# 安裝 patch 工具和其他必要工具
-RUN apk add --no-cache patch
-
 # 複製網站檔案
 COPY . /usr/share/nginx/html
 
 # 確保 nginx 可以正常運行
 EXPOSE 80
-        """.strip())
+            """.strip())
 
-    # 建立 image
-    image_tag = f"ai-web-ide/{container_name.lower()}_image"
-    print(f"📦 Building image {image_tag}...")
-    client.images.build(path=project_dir, tag=image_tag)
+        # 建立 image
+        image_tag = f"ai-web-ide/{container_name.lower()}_image"
+        print(f"📦 Building image {image_tag}...")
+        client.images.build(path=project_dir, tag=image_tag)
 
     # 停用並移除舊容器（若已存在）
-    container_id = f"ai-web-ide_{container_name.lower()}_container"
     try:
         existing_container = client.containers.get(container_id)
         print(f"⚠️ Stopping and removing existing container {container_id}...")
@@ -144,15 +179,29 @@ EXPOSE 80
     except docker.errors.NotFound:
         pass
 
+    # 新容器的檔案與舊容器無關，清除舊的快取
+    docker_client.invalidate_container(container_id)
+    file_cache.get_cache().invalidate(container_id)
+    symbol_index.get_index().invalidate(container_id)
+
+    run_options = {}
+    if workspace.enabled():
+        host_dir = workspace.create_workspace(container_id, template_dir, template_files)
+        # 唯讀掛載整個目錄（而非個別檔案），主機端以改名取代檔案時容器內也能看到新內容
+        run_options["volumes"] = {host_dir: {"bind": workspace.CONTAINER_DIR, "mode": "ro"}}
+        print(f"📁 Project files live in {host_dir}")
+
     # 啟動容器
     print(f"🚀 Starting container {container_id} on port {port}...")
     container = client.containers.run(
         image_tag,
         name=container_id,
         ports={"80/tcp": port},
-        detach=True
+        detach=True,
+        **run_options
     )
 
     print(f"✅ {container_id} is running at http://localhost:{port}")
-    shutil.rmtree(project_dir)
+    if project_dir:
+        shutil.rmtree(project_dir)
     return container
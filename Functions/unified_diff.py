@@ -0,0 +1,468 @@
+"""
+Unified diff 的解析與套用（純 Python）
+
+LLM 產生的 diff 直接在記憶體中對照檔案內容驗證與套用，不需要在容器內執行 `patch`，
+也不需要上傳暫存的 patch 檔；驗證通過後只需把最終的檔案內容寫回容器一次。
+
+錯誤以 PatchError 回報，訊息會指出是哪一個 hunk、哪一行、預期與實際內容為何，
+可以直接放進重試的 prompt 讓 LLM 修正。
+
+LLM 最常見的錯誤是 hunk header 行數算錯或起始行差幾行；repair_diff() 會先在本地修正
+（依內容重算行數、在附近搜尋 context 重新定位），修不好時才需要請 LLM 重新產生。
+"""
+import difflib
+import os
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+# repair_diff() 以宣告的起始行為中心，往前後搜尋 context 的行數範圍
+FUZZY_WINDOW = int(os.getenv("DIFF_FUZZY_WINDOW", "20"))
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+NO_NEWLINE_MARKER = "\\ No newline at end of file"
+
+
+class PatchError(Exception):
+    """diff 格式錯誤或無法套用到目前的檔案內容"""
+
+
+class Hunk(NamedTuple):
+    old_start: int
+    old_count: int
+    new_start: int
+    new_count: int
+    # 含前綴（' '、'-'、'+'）的 hunk 內容
+    lines: List[str]
+
+    @property
+    def header(self) -> str:
+        return f"@@ -{self.old_start},{self.old_count} +{self.new_start},{self.new_count} @@"
+
+    @property
+    def old_lines(self) -> List[str]:
+        """hunk 預期在原始檔案中看到的內容（context 與刪除的行）"""
+        return [line[1:] for line in self.lines if line[0] in " -"]
+
+    @property
+    def new_lines(self) -> List[str]:
+        """套用後的內容（context 與新增的行）"""
+        return [line[1:] for line in self.lines if line[0] in " +"]
+
+
+class FilePatch(NamedTuple):
+    old_path: Optional[str]
+    new_path: Optional[str]
+    hunks: List[Hunk]
+
+    @property
+    def path(self) -> Optional[str]:
+        return self.new_path or self.old_path
+
+
+def parse(diff_text: str, strict: bool = True) -> List[FilePatch]:
+    """
+    解析 unified diff
+
+    會略過 markdown 程式碼圍欄與 hunk 以外的說明文字；hunk 中的空行視為空白的 context 行。
+    strict 時 hunk header 宣告的行數必須與內容相符，否則拋出 PatchError；
+    非 strict 時保留宣告的行數不做檢查，交由 repair_diff() 依內容修正。
+    """
+    patches: List[FilePatch] = []
+    old_path: Optional[str] = None
+    hunk_header = None
+    hunk_lines: List[str] = []
+
+    def finish_hunk():
+        if hunk_header is None:
+            return
+        # 結尾的空行多半是 LLM 輸出的多餘換行，不是空白的 context 行
+        while hunk_lines and hunk_lines[-1] == "" and (
+            not strict or _count(hunk_lines, " -") > hunk_header[1]
+        ):
+            hunk_lines.pop()
+        lines = [line or " " for line in hunk_lines]
+        hunk = Hunk(*hunk_header, lines)
+        if strict:
+            _check_counts(hunk, len(patches[-1].hunks) + 1)
+        patches[-1].hunks.append(hunk)
+
+    for raw_line in diff_text.splitlines():
+        line = raw_line.rstrip("\r")
+
+        if line.startswith("```"):
+            continue
+        if line.startswith("--- ") and (hunk_header is None or _hunk_complete(hunk_header, hunk_lines)):
+            finish_hunk()
+            hunk_header = None
+            old_path = _parse_path(line[4:])
+            continue
+        if line.startswith("+++ ") and hunk_header is None:
+            patches.append(FilePatch(old_path, _parse_path(line[4:]), []))
+            old_path = None
+            continue
+
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            finish_hunk()
+            if not patches:
+                patches.append(FilePatch(None, None, []))
+            old_start, old_count, new_start, new_count = match.groups()
+            hunk_header = (
+                int(old_start),
+                1 if old_count is None else int(old_count),
+                int(new_start),
+                1 if new_count is None else int(new_count),
+            )
+            hunk_lines = []
+            continue
+
+        if hunk_header is None:
+            continue
+        if line == NO_NEWLINE_MARKER:
+            continue
+        if line == "" or line[0] in " -+":
+            hunk_lines.append(line)
+        else:
+            raise PatchError(
+                f"hunk #{len(patches[-1].hunks) + 1} ({_format_header(hunk_header)}) 含有無效的行：{line!r}；"
+                "hunk 內的每一行都必須以空白（context）、'-'（刪除）或 '+'（新增）開頭"
+            )
+
+    finish_hunk()
+
+    patches = [patch for patch in patches if patch.hunks]
+    if not patches:
+        raise PatchError("diff 中找不到任何 hunk（缺少 @@ -a,b +c,d @@ 標頭）")
+    return patches
+
+
+def apply(original: str, hunks: List[Hunk]) -> str:
+    """
+    將 hunk 依序套用到原始內容，回傳新的內容；任何一個 hunk 不吻合都會拋出 PatchError，
+    原始內容不會被部分修改
+    """
+    lines = original.splitlines()
+    ends_with_newline = original.endswith("\n") or not original
+    result: List[str] = []
+    cursor = 0  # 原始內容中尚未複製到 result 的第一行（0-based）
+
+    for number, hunk in enumerate(hunks, 1):
+        # old_count 為 0 的純新增 hunk，old_start 指的是插入位置的前一行
+        start = hunk.old_start if hunk.old_count == 0 else hunk.old_start - 1
+        if start < cursor:
+            raise PatchError(
+                f"hunk #{number} ({hunk.header}) 與前一個 hunk 重疊或順序錯誤；hunk 必須依行號由小到大排列"
+            )
+
+        mismatch = _find_mismatch(lines, start, hunk.old_lines)
+        if not hunk.old_lines and start > len(lines):
+            mismatch = 0
+        if mismatch is not None:
+            raise PatchError(_describe_mismatch(lines, hunk, number, start, mismatch))
+
+        result.extend(lines[cursor:start])
+        result.extend(hunk.new_lines)
+        cursor = start + len(hunk.old_lines)
+
+    result.extend(lines[cursor:])
+    if not result:
+        return ""
+    return "\n".join(result) + ("\n" if ends_with_newline else "")
+
+
+def apply_patch(original: str, diff_text: str, filename: Optional[str] = None) -> str:
+    """
+    解析 diff 並套用到單一檔案的內容
+
+    Args:
+        original: 檔案目前的內容
+        diff_text: LLM 產生的 unified diff
+        filename: 目標檔名；若 diff 檔頭指向其他檔案則拋出 PatchError
+
+    Returns:
+        str: 套用後的檔案內容
+    """
+    patches = parse(diff_text)
+    if len(patches) > 1:
+        raise PatchError(f"diff 包含 {len(patches)} 個檔案，一次只能修改一個檔案")
+
+    patch = patches[0]
+    if filename and patch.path and os.path.basename(patch.path) != os.path.basename(filename):
+        raise PatchError(f"diff 的目標檔案是 {patch.path}，但應該修改 {filename}")
+    return apply(original, patch.hunks)
+
+
+def format_patch(path: str, hunks: List[Hunk]) -> str:
+    """將 hunk 輸出成 unified diff 文字"""
+    output = [f"--- {path}", f"+++ {path}"]
+    for hunk in hunks:
+        output.append(hunk.header)
+        output.extend(hunk.lines)
+    return "\n".join(output) + "\n"
+
+
+def new_start(old_start: int, old_count: int, new_count: int, offset: int) -> int:
+    """
+    依前面 hunk 累計的行數增減 offset 計算 hunk 的 new_start
+    沒有原始內容的一側，起始行依 unified diff 的慣例指向插入 / 刪除位置的前一行
+    """
+    if old_count == 0:
+        return old_start + offset + 1
+    if new_count == 0:
+        return old_start + offset - 1
+    return old_start + offset
+
+
+def changed_span(hunk: Hunk) -> Tuple[int, int]:
+    """
+    hunk 實際修改的原始行範圍（0-based、左閉右開），不含 context 行
+    只新增內容時為插入位置的空範圍 (p, p)
+    """
+    position = _old_range(hunk)[0]
+    low = high = None
+    for line in hunk.lines:
+        if line[0] == " ":
+            position += 1
+            continue
+        end = position + 1 if line[0] == "-" else position
+        low = position if low is None else min(low, position)
+        high = end if high is None else max(high, end)
+        if line[0] == "-":
+            position += 1
+    if low is None:
+        return _old_range(hunk)[0], _old_range(hunk)[0]
+    return low, high
+
+
+def spans_conflict(first: Tuple[int, int], second: Tuple[int, int]) -> bool:
+    """
+    兩個 changed_span 是否修改到相同的行；插入位置落在另一段修改的範圍內（含兩端）
+    或兩者插入同一個位置時，合併後的先後順序無法決定，也視為衝突
+    """
+    if first[0] == first[1] or second[0] == second[1]:
+        return first[0] <= second[1] and second[0] <= first[1]
+    return first[0] < second[1] and second[0] < first[1]
+
+
+def combine_hunks(hunks: List[Hunk]) -> List[Hunk]:
+    """
+    將針對同一份原始內容、修改範圍互不衝突的 hunk 合併成可依序套用的 hunk 列表
+    只有 context 行重疊的 hunk 會合併成同一個 hunk，並依前面 hunk 的行數增減重新計算 new_start
+    """
+    groups: List[List[Hunk]] = []
+    group_end = 0
+    for hunk in sorted(hunks, key=lambda hunk: _old_range(hunk)):
+        start, end = _old_range(hunk)
+        if groups and start < group_end:
+            groups[-1].append(hunk)
+        else:
+            groups.append([hunk])
+            group_end = end
+        group_end = max(group_end, end)
+
+    combined: List[Hunk] = []
+    offset = 0
+    for group in groups:
+        start = min(_old_range(hunk)[0] for hunk in group)
+        end = max(_old_range(hunk)[1] for hunk in group)
+        old_text = {}
+        deleted = set()
+        inserted = {}
+        for hunk in group:
+            position = _old_range(hunk)[0]
+            for line in hunk.lines:
+                if line[0] == "+":
+                    inserted.setdefault(position, []).append(line)
+                    continue
+                old_text.setdefault(position, line[1:])
+                if line[0] == "-":
+                    deleted.add(position)
+                position += 1
+
+        body: List[str] = []
+        for position in range(start, end + 1):
+            body.extend(inserted.get(position, []))
+            if position < end:
+                body.append(("-" if position in deleted else " ") + old_text[position])
+
+        old_count = end - start
+        new_count = sum(1 for line in body if line[0] in " +")
+        old_start = start + 1 if old_count else start
+        combined.append(Hunk(old_start, old_count, new_start(old_start, old_count, new_count, offset), new_count, body))
+        offset += new_count - old_count
+    return combined
+
+
+def make_diff(original: str, updated: str, filename: str, context: int = 3) -> str:
+    """產生把 original 改成 updated 的 unified diff；內容相同時回傳空字串"""
+    lines = difflib.unified_diff(
+        original.splitlines(), updated.splitlines(), filename, filename, n=context, lineterm=""
+    )
+    return "\n".join(lines) + "\n" if original.splitlines() != updated.splitlines() else ""
+
+
+def repair_diff(
+    original: str,
+    diff_text: str,
+    filename: Optional[str] = None,
+    window: int = FUZZY_WINDOW,
+) -> Tuple[str, List[str]]:
+    """
+    在本地修正 LLM 產生的 diff，不需要再呼叫 LLM
+
+    1. 依 hunk 內容重新計算 @@ -a,b +c,d @@ 的行數
+    2. 宣告的起始行不吻合時，在前後 window 行內搜尋 context：先找完全相同的位置，
+       再找忽略空白差異的位置（此時 context 與刪除的行改用檔案中的實際內容）
+    3. 依前面 hunk 的行數增減重新計算 new_start
+
+    Returns:
+        tuple: (修正後可直接套用的 diff, 修正項目說明)；無法修正時拋出 PatchError
+    """
+    patches = parse(diff_text, strict=False)
+    if len(patches) > 1:
+        raise PatchError(f"diff 包含 {len(patches)} 個檔案，一次只能修改一個檔案")
+    patch = patches[0]
+    if filename and patch.path and os.path.basename(patch.path) != os.path.basename(filename):
+        raise PatchError(f"diff 的目標檔案是 {patch.path}，但應該修改 {filename}")
+
+    lines = original.splitlines()
+    fixes: List[str] = []
+    repaired: List[Hunk] = []
+    cursor = 0
+    offset = 0
+
+    for number, hunk in enumerate(sorted(patch.hunks, key=lambda hunk: hunk.old_start), 1):
+        expected = hunk.old_lines
+        if (len(expected), len(hunk.new_lines)) != (hunk.old_count, hunk.new_count):
+            fixes.append(
+                f"hunk #{number}: 行數 -{hunk.old_count},+{hunk.new_count} → -{len(expected)},+{len(hunk.new_lines)}"
+            )
+
+        # 沒有原始內容的純新增 hunk，old_start 指的是插入位置的前一行
+        declared_start = hunk.old_start if not expected else hunk.old_start - 1
+        position, fuzzy = _locate(lines, expected, declared_start, cursor, window)
+        if position is None:
+            start = max(declared_start, 0)
+            mismatch = _find_mismatch(lines, start, expected) or 0
+            raise PatchError(
+                _describe_mismatch(lines, hunk, number, start, mismatch)
+                + f"（已在前後 {window} 行內搜尋，仍找不到相符的 context）"
+            )
+
+        body = hunk.lines
+        if fuzzy:
+            # context 與刪除的行改用檔案中的實際內容，新增的行維持 LLM 的輸出
+            actual = iter(lines[position:position + len(expected)])
+            body = [line if line[0] == "+" else line[0] + next(actual) for line in hunk.lines]
+            fixes.append(f"hunk #{number}: 以忽略空白差異的方式比對 context")
+
+        old_start = position + 1 if expected else position
+        if old_start != hunk.old_start:
+            fixes.append(f"hunk #{number}: 起始行 {hunk.old_start} → {old_start}")
+
+        fixed = Hunk(
+            old_start, len(expected), new_start(old_start, len(expected), len(hunk.new_lines), offset),
+            len(hunk.new_lines), body,
+        )
+        repaired.append(fixed)
+        cursor = position + len(expected)
+        offset += fixed.new_count - fixed.old_count
+
+    return format_patch(patch.path or filename or "file", repaired), fixes
+
+
+def _locate(lines: List[str], expected: List[str], start: int, cursor: int, window: int):
+    """
+    在 start 前後 window 行內尋找 expected，回傳 (位置, 是否為忽略空白的比對)
+    找不到時回傳 (None, False)；結果不會早於 cursor（前一個 hunk 的結尾）
+    """
+    if not expected:
+        return (start if cursor <= start <= len(lines) else None), False
+
+    candidates = [start]
+    for distance in range(1, window + 1):
+        candidates.extend((start - distance, start + distance))
+    candidates = [p for p in candidates if cursor <= p <= len(lines) - len(expected)]
+
+    for position in candidates:
+        if _find_mismatch(lines, position, expected) is None:
+            return position, False
+
+    stripped = [line.strip() for line in expected]
+    for position in candidates:
+        if all(lines[position + i].strip() == line for i, line in enumerate(stripped)):
+            return position, True
+    return None, False
+
+
+def _old_range(hunk: Hunk) -> Tuple[int, int]:
+    """hunk 涵蓋的原始行範圍（0-based、左閉右開，含 context 行）"""
+    start = hunk.old_start if hunk.old_count == 0 else hunk.old_start - 1
+    return start, start + hunk.old_count
+
+
+def _parse_path(value: str) -> Optional[str]:
+    # 檔頭可能帶有以 tab 分隔的時間戳記
+    path = value.split("\t")[0].strip()
+    return None if path in ("", "/dev/null") else path
+
+
+def _format_header(header) -> str:
+    return "@@ -{},{} +{},{} @@".format(*header)
+
+
+def _count(hunk_lines: List[str], prefixes: str) -> int:
+    # 空行（尚未轉換的空白 context 行）同時計入原始與新內容
+    return sum(1 for line in hunk_lines if (line[:1] or " ") in prefixes)
+
+
+def _hunk_complete(header, hunk_lines: List[str]) -> bool:
+    """hunk 內容是否已達到 header 宣告的行數（用來分辨 '--- ' 是檔頭還是被刪除的行）"""
+    return _count(hunk_lines, " -") >= header[1] and _count(hunk_lines, " +") >= header[3]
+
+
+def _check_counts(hunk: Hunk, number: int) -> None:
+    old_count = len(hunk.old_lines)
+    new_count = len(hunk.new_lines)
+    if old_count == hunk.old_count and new_count == hunk.new_count:
+        return
+    raise PatchError(
+        f"hunk #{number} 的標頭 {hunk.header} 與內容不符：內容實際包含 {old_count} 行原始內容"
+        f"（context + '-'）與 {new_count} 行新內容（context + '+'），"
+        f"標頭應為 @@ -{hunk.old_start},{old_count} +{hunk.new_start},{new_count} @@"
+    )
+
+
+def _find_mismatch(lines: List[str], start: int, expected: List[str]) -> Optional[int]:
+    """回傳第一個不吻合的行在 expected 中的索引；全部吻合時回傳 None"""
+    for offset, expected_line in enumerate(expected):
+        index = start + offset
+        if index >= len(lines) or lines[index].rstrip("\r") != expected_line:
+            return offset
+    return None
+
+
+def _describe_mismatch(lines: List[str], hunk: Hunk, number: int, start: int, offset: int) -> str:
+    if not hunk.old_lines:
+        # 純新增的 hunk 沒有可比對的內容，只可能是插入位置超出檔案
+        return f"hunk #{number} ({hunk.header}) 的插入位置第 {start} 行超出檔案結尾（檔案只有 {len(lines)} 行）"
+    line_number = start + offset + 1
+    expected = hunk.old_lines[offset]
+    if start + offset >= len(lines):
+        actual = f"檔案只有 {len(lines)} 行"
+    else:
+        actual = f"檔案內容為 {lines[start + offset]!r}"
+    message = f"hunk #{number} ({hunk.header}) 在第 {line_number} 行不吻合：預期 {expected!r}，{actual}"
+
+    # 提示正確位置，讓重試時能修正行號
+    if hunk.old_lines:
+        found = [
+            i + 1 for i in range(len(lines) - len(hunk.old_lines) + 1)
+            if _find_mismatch(lines, i, hunk.old_lines) is None
+        ]
+        if found:
+            message += f"；相同的原始內容出現在第 {', '.join(map(str, found[:3]))} 行，請修正 hunk 的起始行號"
+        elif hunk.new_lines and _find_mismatch(lines, start, hunk.new_lines) is None:
+            message += "；這個 hunk 看起來已經套用過了"
+    return message
@@ -0,0 +1,138 @@
+"""
+主機上的專案工作目錄（選用）
+
+設定 PROJECT_WORKSPACE_ROOT 後，新建立的專案檔案會放在主機的 <root>/<容器名稱> 目錄，
+以唯讀方式 bind mount 到 nginx 容器的 /usr/share/nginx/html。
+之後的讀取、diff 驗證與寫入都直接在主機檔案系統上進行，不再經過 Docker API：
+- 讀取經由 file_cache，以 inode、修改時間（奈秒）與大小組成的指紋確認檔案是否改變
+- 寫入先寫到 <root>/.staging 的暫存檔再 os.replace，nginx 只會看到舊的或新的完整內容，
+  暫存檔與工作目錄在同一個檔案系統（改名是原子的），但不在 bind mount 的目錄內，不會被對外提供
+
+未設定時維持原本的行為：檔案只存在容器內，讀寫都透過 Docker API。
+"""
+import os
+import re
+import shutil
+import tempfile
+from typing import Iterable, Optional
+
+from . import file_cache
+
+# 專案原始碼在容器內的目錄
+CONTAINER_DIR = "/usr/share/nginx/html"
+
+WORKSPACE_ROOT = os.getenv("PROJECT_WORKSPACE_ROOT", "")
+
+# system.create_container 建立的容器名稱；同時也是 Docker 容器名稱允許的字元
+CONTAINER_NAME_PATTERN = re.compile(r"^ai-web-ide_[A-Za-z0-9][A-Za-z0-9_.-]*_container$")
+
+
+class FileChangedError(IOError):
+    """寫入前發現檔案已被外部修改，沒有寫入"""
+
+
+# 寫入用的暫存目錄：位於 WORKSPACE_ROOT 之下，但不屬於任何專案的工作目錄
+STAGING_DIR_NAME = ".staging"
+
+
+def enabled() -> bool:
+    return bool(WORKSPACE_ROOT)
+
+
+def _resolve(container_name: str) -> str:
+    """
+    容器名稱對應的工作目錄路徑
+    container_name 可能來自 LLM 的工具參數，只接受 ai-web-ide_<名稱>_container 形式的單層名稱，
+    並確認解析符號連結後仍位於 WORKSPACE_ROOT 之下，否則拋出 ValueError
+    """
+    if (not CONTAINER_NAME_PATTERN.match(container_name) or ".." in container_name
+            or os.path.basename(container_name) != container_name):
+        raise ValueError(f"不合法的容器名稱：{container_name!r}")
+    root = os.path.realpath(WORKSPACE_ROOT)
+    path = os.path.join(root, container_name)
+    if not os.path.realpath(path).startswith(root + os.sep):
+        raise ValueError(f"容器 {container_name} 的工作目錄不在 {root} 之下")
+    return path
+
+
+def workspace_dir(container_name: str) -> Optional[str]:
+    """
+    容器對應的主機工作目錄；未啟用或該容器不是以工作目錄模式建立時回傳 None
+    容器名稱不合法或目錄位於 WORKSPACE_ROOT 之外時拋出 ValueError
+    """
+    if not WORKSPACE_ROOT:
+        return None
+    path = _resolve(container_name)
+    return path if os.path.isdir(path) else None
+
+
+def create_workspace(container_name: str, template_dir: str, filenames: Iterable[str]) -> str:
+    """從模板建立（或重設）容器的工作目錄，回傳絕對路徑；容器名稱不合法時拋出 ValueError"""
+    path = _resolve(container_name)
+    os.makedirs(path, exist_ok=True)
+    for filename in filenames:
+        shutil.copy(os.path.join(template_dir, filename), os.path.join(path, filename))
+    file_cache.get_cache().invalidate(container_name)
+    return path
+
+
+def remove_workspace(container_name: str) -> None:
+    path = workspace_dir(container_name)
+    if path:
+        shutil.rmtree(path)
+    file_cache.get_cache().invalidate(container_name)
+
+
+def _fingerprint(path: str) -> str:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return ""
+    return f"{stat.st_ino} {stat.st_mtime_ns} {stat.st_size}"
+
+
+def _content_digest(path: str) -> str:
+    try:
+        with open(path, encoding="utf-8", newline="") as f:
+            return file_cache.content_digest(f.read())
+    except FileNotFoundError:
+        return ""
+
+
+def read_file(container_name: str, directory: str, filename: str) -> file_cache.CachedFile:
+    """讀取工作目錄中的檔案；每次都以 stat 確認（本機 stat 不需要網路往返），指紋不變時直接使用快取"""
+    path = os.path.join(directory, filename)
+
+    def load():
+        with open(path, encoding="utf-8", newline="") as f:
+            return f.read()
+
+    return file_cache.get_cache().get(container_name, path, load, lambda: _fingerprint(path), max_age=0)
+
+
+def write_file(
+    container_name: str, directory: str, filename: str, content: str, expected_digest: Optional[str] = None
+) -> int:
+    """
+    以「寫入暫存檔後 os.replace」原子地寫入工作目錄中的檔案，回傳新的快取版本號
+    指定 expected_digest 時，目前檔案的內容雜湊不同就不寫入並拋出 FileChangedError
+    """
+    path = os.path.join(directory, filename)
+    if expected_digest is not None and _content_digest(path) != expected_digest:
+        file_cache.get_cache().invalidate(container_name, path)
+        raise FileChangedError(f"{path} 在讀取後被外部修改，未寫入")
+    staging = os.path.join(os.path.dirname(directory), STAGING_DIR_NAME)
+    os.makedirs(staging, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{filename}.", suffix=".tmp", dir=staging)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        # mkstemp 建立的檔案權限為 0600，nginx 需要可讀
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        file_cache.get_cache().invalidate(container_name, path)
+        raise
+    return file_cache.get_cache().record_write(container_name, path, content, _fingerprint(path)).version
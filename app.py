@@ -1,6 +1,7 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, session
 import os
 import re
+import threading
 import uuid
 
 from Functions.system import get_containers, create_container
@@ -14,6 +15,8 @@ from Functions.ai_chat import (
     delete_session,
     create_project_session_id,
 )
+from Functions.chat_jobs import get_or_create_job, parse_last_event_id
+from Functions.event_channel import format_sse
 from Functions.log_config import setup_logging, get_logger
 
 # 設定日誌模式 - 可透過變數控制
@@ -90,7 +93,9 @@ def chat_session(session_id: str):
             'session_id': session_id,
             'full_session_id': full_session_id,
             'project_name': project_name,
-            'last_message_time': None  # 新創建的 session
+            'last_message_time': None,  # 新創建的 session
+            'title': None,
+            'message_count': 0,
         })
 
     # 載入該專案的聊天歷史
@@ -170,11 +175,32 @@ def api_chat():
         return jsonify({"error": str(e)}), 500
 
 
+def _run_chat_job(job):
+    """在背景執行緒中執行聊天工作，事件寫入工作的事件紀錄"""
+    try:
+        logger.info(f"開始執行 AI 聊天 - 專案: {job.project_name}")
+        response = chat_with_ai_stream(
+            job.user_input,
+            job.session_id,
+            job.project_name,
+            job.publish
+        )
+        logger.info(f"AI 執行完成，回應長度: {len(response)}")
+        job.finish(response)
+    except Exception as e:
+        logger.error(f"執行 AI 聊天時發生錯誤: {e}", exc_info=True)
+        job.fail(str(e))
+
+
 @app.route("/api/chat_stream")
 def api_chat_stream():
-    """支援 Server-Sent Events 的聊天 API"""
+    """
+    支援 Server-Sent Events 的聊天 API
+    同一個 turn_id 只會執行一次；斷線重連時依 Last-Event-ID 從事件紀錄接續
+    """
     user_input = request.args.get("message", "")
     session_id = request.args.get("session_id", "")
+    turn_id = request.args.get("turn_id") or str(uuid.uuid4())
     project_name = session.get("project_name")
 
     if not user_input or not session_id:
@@ -183,77 +209,27 @@ def api_chat_stream():
     if not project_name:
         return jsonify({"error": "未選擇專案，請返回首頁選擇"}), 400
 
-    logger.info(f"收到 streaming 聊天請求 - 專案: {project_name}, 使用者輸入: {user_input}")
+    last_event_id = parse_last_event_id(
+        request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    )
+
+    def start(job):
+        threading.Thread(target=_run_chat_job, args=(job,), daemon=True).start()
+
+    try:
+        job, created = get_or_create_job(turn_id, session_id, project_name, user_input, start)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+
+    if created:
+        logger.info(f"收到 streaming 聊天請求 - 專案: {project_name}, 使用者輸入: {user_input}")
+    else:
+        logger.info(f"聊天工作 {turn_id} 重新連線，從事件 {last_event_id} 之後接續")
 
     def generate():
-        try:
-            import json
-            import time
-            import queue
-            import threading
-
-            # 建立一個佇列來收集狀態訊息
-            status_queue = queue.Queue()
-
-            def status_callback(message):
-                status_queue.put(message)
-
-            # 發送初始狀態
-            data = json.dumps({"type": "status", "message": "開始處理您的請求..."}, ensure_ascii=False)
-            yield f"data: {data}\n\n"
-            time.sleep(0.1)
-
-            # 在另一個執行緒中執行 AI 聊天
-            result_container = {"response": None, "error": None}
-
-            def run_chat():
-                try:
-                    logger.info(f"開始執行 AI 聊天 - 專案: {project_name}")
-                    result_container["response"] = chat_with_ai_stream(
-                        user_input,
-                        session_id,
-                        project_name,
-                        status_callback
-                    )
-                    logger.info(f"AI 執行完成，回應長度: {len(result_container['response'])}")
-                except Exception as e:
-                    logger.error(f"執行 AI 聊天時發生錯誤: {e}", exc_info=True)
-                    result_container["error"] = str(e)
-
-            chat_thread = threading.Thread(target=run_chat)
-            chat_thread.start()
-
-            # 持續檢查狀態佇列和執行緒狀態
-            while chat_thread.is_alive():
-                try:
-                    # 檢查是否有新的狀態訊息
-                    message = status_queue.get_nowait()
-                    data = json.dumps({"type": "status", "message": message}, ensure_ascii=False)
-                    yield f"data: {data}\n\n"
-                except queue.Empty:
-                    time.sleep(0.1)  # 短暫等待
-
-            # 處理剩餘的狀態訊息
-            while not status_queue.empty():
-                try:
-                    message = status_queue.get_nowait()
-                    data = json.dumps({"type": "status", "message": message}, ensure_ascii=False)
-                    yield f"data: {data}\n\n"
-                except queue.Empty:
-                    break
-
-            # 發送最終回應或錯誤
-            if result_container["error"]:
-                error_data = json.dumps({"type": "error", "message": result_container["error"]}, ensure_ascii=False)
-                yield f"data: {error_data}\n\n"
-            else:
-                response_data = json.dumps({"type": "response", "message": result_container["response"]}, ensure_ascii=False)
-                yield f"data: {response_data}\n\n"
-
-        except Exception as e:
-            logger.error(f"Stream 聊天時發生錯誤: {e}", exc_info=True)
-            error_data = json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False)
-            yield f"data: {error_data}\n\n"
+        # 阻塞等待事件並即時送出
+        for event in job.channel.subscribe(after=last_event_id):
+            yield format_sse(event)
 
     return app.response_class(
         generate(),
@@ -0,0 +1,136 @@
+"""
+ASGI 進入點
+
+聊天端點（/api/chat、/api/chat_stream）改由 asyncio 處理：agent 以 ainvoke 執行、
+OpenAI 以 async client 呼叫，等待中的串流不再佔用 worker 與執行緒，
+單一行程即可同時維持數百條串流。其餘頁面與 API 透過 WSGI 轉接沿用 Flask app。
+
+啟動：uvicorn asgi:application --port 5001
+"""
+import asyncio
+import uuid
+from typing import Set
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as flask_app
+from Functions.ai_chat import achat_with_ai, achat_with_ai_stream
+from Functions.chat_jobs import get_or_create_job, parse_last_event_id
+from Functions.event_channel import format_sse
+from Functions.log_config import get_logger
+
+logger = get_logger(__name__)
+
+# 背景執行中的聊天 task；保留參考避免被 GC
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _flask_session(request: Request) -> dict:
+    """讀取 Flask 簽章過的 session cookie，取得目前選擇的專案"""
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if serializer is None:
+        return {}
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return serializer.loads(cookie, max_age=max_age)
+    except BadSignature:
+        return {}
+
+
+async def api_chat(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "message" not in data or "session_id" not in data:
+        return JSONResponse({"error": "請求格式錯誤"}, status_code=400)
+
+    project_name = _flask_session(request).get("project_name")
+    if not project_name:
+        return JSONResponse({"error": "未選擇專案，請返回首頁選擇"}, status_code=400)
+
+    logger.info(f"收到 async 聊天請求 - 專案: {project_name}, 使用者輸入: {data['message']}")
+    try:
+        ai_response = await achat_with_ai(data["message"], data["session_id"], project_name)
+        return JSONResponse({"response": ai_response})
+    except Exception as e:
+        logger.error(f"與 AI 對話時發生錯誤: {e}", exc_info=True)
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def api_chat_stream(request: Request):
+    """
+    支援 Server-Sent Events 的 async 聊天 API
+    同一個 turn_id 只會執行一次；斷線重連時依 Last-Event-ID 從事件紀錄接續
+    """
+    user_input = request.query_params.get("message", "")
+    session_id = request.query_params.get("session_id", "")
+    turn_id = request.query_params.get("turn_id") or str(uuid.uuid4())
+    project_name = _flask_session(request).get("project_name")
+
+    if not user_input or not session_id:
+        return JSONResponse({"error": "請求參數錯誤"}, status_code=400)
+
+    if not project_name:
+        return JSONResponse({"error": "未選擇專案，請返回首頁選擇"}, status_code=400)
+
+    last_event_id = parse_last_event_id(
+        request.headers.get("Last-Event-ID") or request.query_params.get("last_event_id")
+    )
+
+    async def run_chat(job):
+        try:
+            response = await achat_with_ai_stream(job.user_input, job.session_id, job.project_name, job.publish)
+            logger.info(f"AI 執行完成，回應長度: {len(response)}")
+            job.finish(response)
+        except Exception as e:
+            logger.error(f"執行 AI 聊天時發生錯誤: {e}", exc_info=True)
+            job.fail(str(e))
+
+    def start(job):
+        # 以背景 task 執行，客戶端斷線時 agent 仍會完成並寫入資料庫
+        task = asyncio.create_task(run_chat(job))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    try:
+        job, created = get_or_create_job(turn_id, session_id, project_name, user_input, start)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+    if created:
+        logger.info(f"收到 async streaming 聊天請求 - 專案: {project_name}, 使用者輸入: {user_input}")
+    else:
+        logger.info(f"聊天工作 {turn_id} 重新連線，從事件 {last_event_id} 之後接續")
+
+    async def generate():
+        async for event in job.channel.asubscribe(after=last_event_id):
+            yield format_sse(event)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "Access-Control-Allow-Origin": "*",
+        },
+    )
+
+
+application = Starlette(
+    routes=[
+        Route("/api/chat", api_chat, methods=["POST"]),
+        Route("/api/chat_stream", api_chat_stream, methods=["GET"]),
+        # 其餘頁面與 API 交給原本的 Flask app
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ]
+)
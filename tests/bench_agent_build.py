@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+agent 建立成本的 microbenchmark
+
+- uncached：每次請求都重新建立 ChatOpenAI、system prompt、ChatPromptTemplate 與 agent（舊版行為）
+- cached：透過 get_agent_executor() 從 LRU 快取取得
+
+建立 agent 不會呼叫 OpenAI API，因此沒有設定 OPENAI_API_KEY 時會使用假的金鑰。
+
+用法：python tests/bench_agent_build.py --iterations 200
+"""
+
+import os
+
+from bench_utils import make_parser, measure
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from langchain_openai import ChatOpenAI  # noqa: E402
+
+from Functions import ai_chat, llm_client  # noqa: E402
+
+
+def build_uncached():
+    # 模擬舊版：每次都建立新的 ChatOpenAI（各自的 HTTP 連線池）與 agent
+    llm_client.get_chat_model.cache_clear()
+    ai_chat.build_agent_with_tools(ai_chat.get_registered_tools(), "bench_project")
+
+
+def build_cached():
+    ai_chat.get_agent_executor("bench_project")
+
+
+def main():
+    parser = make_parser(__doc__, iterations=200)
+    args = parser.parse_args()
+
+    # 預熱 import 與 tiktoken / pydantic 的延遲初始化
+    ChatOpenAI(model="gpt-4o", api_key=os.environ["OPENAI_API_KEY"])
+    build_cached()
+
+    print(f"agent 建立成本（{args.iterations} 次）")
+    measure("uncached", build_uncached, args.iterations)
+    measure("cached", build_cached, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+chat_store 效能測試
+
+建立一個含大量訊息（預設 1M 筆）的暫存資料庫，量測各查詢的單次延遲：
+- legacy：每次呼叫都 sqlite3.connect()，且 messages 表沒有索引（舊版行為）
+- pooled：透過 chat_store 連線池 + WAL + 複合索引 + sessions 摘要表
+
+用法：python tests/bench_chat_store.py --rows 1000000
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from bench_utils import make_parser, measure
+from Functions import chat_store
+
+
+def populate(rows: int, sessions: int, projects: int) -> None:
+    """以單一交易大量寫入測試資料"""
+    roles = ("user", "ai")
+
+    def generate():
+        for i in range(rows):
+            session_no = i % sessions
+            project = f"project_{session_no % projects}"
+            yield (
+                f"{project}::session-{session_no}",
+                project,
+                roles[(i // sessions) % 2],
+                f"message {i} " + "x" * 80,
+                f"2025-01-01 00:{(i // 60) % 60:02d}:{i % 60:02d}",
+            )
+
+    with chat_store.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO messages (session_id, project_name, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            generate(),
+        )
+        # 大量匯入繞過了 insert_message，需重建 sessions 摘要表
+        chat_store.rebuild_sessions(conn)
+
+
+def legacy_calls(db_path: str, sessions: int, projects: int):
+    """舊版寫法：每次查詢都開新連線"""
+    def load_history():
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY timestamp ASC",
+            (f"project_0::session-{random.randrange(0, sessions, projects)}",),
+        ).fetchall()
+        conn.close()
+
+    def latest_user():
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "SELECT content FROM messages WHERE session_id = ? AND role = 'user' "
+            "ORDER BY timestamp DESC LIMIT 1",
+            (f"project_0::session-{random.randrange(0, sessions, projects)}",),
+        ).fetchone()
+        conn.close()
+
+    def sessions_by_project():
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            "SELECT session_id, MAX(timestamp) FROM messages "
+            "WHERE project_name = ? AND role != 'system' GROUP BY session_id",
+            (f"project_{random.randrange(projects)}",),
+        ).fetchall()
+        conn.close()
+
+    return [
+        ("load_chat_history", load_history),
+        ("get_latest_user_message", latest_user),
+        ("get_sessions_by_project", sessions_by_project),
+    ]
+
+
+def pooled_calls(sessions: int, projects: int):
+    def load_history():
+        chat_store.fetch_messages(f"project_0::session-{random.randrange(0, sessions, projects)}")
+
+    def latest_user():
+        chat_store.fetch_latest_user_message(f"project_0::session-{random.randrange(0, sessions, projects)}")
+
+    def sessions_by_project():
+        chat_store.fetch_sessions(f"project_{random.randrange(projects)}")
+
+    def insert():
+        chat_store.insert_message("project_0::session-0", "project_0", "user", "bench")
+
+    return [
+        ("load_chat_history", load_history),
+        ("get_latest_user_message", latest_user),
+        ("get_sessions_by_project", sessions_by_project),
+        ("save_message_to_db", insert),
+    ]
+
+
+def main():
+    parser = make_parser(__doc__, iterations=50)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--projects", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "chat_history.db")
+        chat_store.configure(db_path)
+
+        print(f"寫入 {args.rows:,} 筆訊息...")
+        start = time.perf_counter()
+        populate(args.rows, args.sessions, args.projects)
+        print(f"  完成，耗時 {time.perf_counter() - start:.1f} 秒")
+
+        # 暫時移除索引，模擬舊版資料庫
+        with chat_store.transaction() as conn:
+            for (name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'messages'"
+            ).fetchall():
+                conn.execute(f"DROP INDEX {name}")
+
+        print("\n[legacy] 每次 connect、無索引")
+        for label, func in legacy_calls(db_path, args.sessions, args.projects):
+            measure(label, func, args.iterations, width=28)
+
+        with chat_store.transaction() as conn:
+            for statement in chat_store.INDEX_STATEMENTS:
+                conn.execute(statement)
+            conn.execute("ANALYZE")
+
+        print("\n[pooled] 連線池 + WAL + 複合索引 + sessions 摘要表")
+        for label, func in pooled_calls(args.sessions, args.projects):
+            measure(label, func, args.iterations, width=28)
+
+        chat_store.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
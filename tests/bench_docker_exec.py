@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Docker exec 往返成本的 microbenchmark（需要執行中的 Docker daemon 與專案容器）
+
+- fresh：每次都 docker.from_env() + containers.get() + exec_run（舊版行為）
+- shared：共用 docker_client 的 client 與容器查詢快取，只剩 exec_run 本身
+
+用法：python tests/bench_docker_exec.py --container ai-web-ide_demo_container --iterations 100
+"""
+
+import docker
+
+from bench_utils import make_parser, measure
+from Functions import docker_client
+
+COMMAND = ["cat", "/usr/share/nginx/html/index.html"]
+
+
+def exec_fresh(name: str) -> None:
+    client = docker.from_env()
+    client.containers.get(name).exec_run(COMMAND)
+    client.close()
+
+
+def exec_shared(name: str) -> None:
+    docker_client.with_container(name, lambda container: container.exec_run(COMMAND))
+
+
+def main():
+    parser = make_parser(__doc__, iterations=100)
+    parser.add_argument("--container", required=True)
+    args = parser.parse_args()
+
+    # 預熱：建立共用 client 並確認容器存在
+    exec_shared(args.container)
+
+    print(f"exec 往返成本（{args.iterations} 次，容器 {args.container}）")
+    measure("fresh", lambda: exec_fresh(args.container), args.iterations, width=8)
+    measure("shared", lambda: exec_shared(args.container), args.iterations, width=8)
+
+
+if __name__ == "__main__":
+    main()
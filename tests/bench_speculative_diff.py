@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+推測模式（錯開啟動的候選）與逐次重試的 diff 生成延遲比較
+
+預設以模擬的 LLM 呼叫重現 llm_diff 的兩種流程，不需要 OpenAI API 或容器：
+- sequential：一次一個請求，失敗後換格式重試，最多 3 次（舊版行為）
+- speculative：第一次嘗試以 speculative.first_valid 錯開啟動 K 個候選（不同格式與溫度），
+  採用第一個能套用的結果；全部失敗才逐次重試
+
+每次呼叫的延遲取自對數常態分佈（中位數 --latency 毫秒），
+各格式依 --failure 的機率產生無法套用的輸出。模擬只能比較兩種流程在假設的延遲與失敗率下的差異，
+實際的延遲與 token 花費需以 --live 量測。
+
+--live：以 docker_template 的檔案與 --todo 實際呼叫 OpenAI（需要 OPENAI_API_KEY），
+經由 sub_agent.llm_diff 比較兩種流程的延遲、啟動的請求數與 tokens。
+tokens 只計入完整回傳的回應；勝出後中途關閉的串流沒有用量資訊，因此推測模式的 tokens 是下限。
+
+用法：
+  python tests/bench_speculative_diff.py --edits 200 --candidates 3 --stagger 25
+  python tests/bench_speculative_diff.py --live --edits 5 --candidates 3 --todo "Change the main heading to Hello"
+"""
+
+import os
+import random
+import threading
+import time
+
+from bench_utils import ROOT, make_parser, measure
+from Functions import speculative
+
+FORMATS = ("search_replace", "udiff", "whole_file")
+MAX_RETRIES = 3
+
+
+class FakeLLM:
+    """以 sleep 模擬請求延遲，並依格式的失敗率決定輸出能否套用"""
+
+    def __init__(self, latency_ms: float, failure: float, seed: int):
+        self.latency = latency_ms / 1000
+        self.failure = {"search_replace": failure, "udiff": failure * 1.5, "whole_file": failure * 0.5}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def invoke(self, edit_format: str) -> bool:
+        with self.lock:
+            self.calls += 1
+            delay = self.latency * self.random.lognormvariate(0, 0.4)
+            ok = self.random.random() >= self.failure[edit_format]
+        time.sleep(delay)
+        return ok
+
+
+def sequential_edit(llm: FakeLLM, first_attempt: int = 0) -> bool:
+    for attempt in range(first_attempt, MAX_RETRIES):
+        if llm.invoke(FORMATS[attempt % len(FORMATS)]):
+            return True
+    return False
+
+
+def speculative_edit(llm: FakeLLM, candidates: int, stagger_ms: float = 0) -> bool:
+    def make_candidate(edit_format):
+        def candidate(cancelled):
+            if cancelled.is_set():
+                raise RuntimeError("已取消")
+            return llm.invoke(edit_format)
+        return candidate
+
+    def accept(index, ok):
+        if not ok:
+            raise ValueError("無法套用")
+        return ok
+
+    plan = [make_candidate(FORMATS[index % len(FORMATS)]) for index in range(candidates)]
+    if speculative.first_valid(plan, accept, stagger=stagger_ms / 1000).winner is not None:
+        return True
+    return sequential_edit(llm, first_attempt=1)
+
+
+def live(args) -> None:
+    from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+    from Functions import ai_tool, llm_client, sub_agent
+
+    with open(os.path.join(ROOT, "docker_template", "index.html"), encoding="utf-8") as f:
+        source = f.read()
+    ai_tool.read_source_file = lambda container, filename, max_age=None: source
+
+    get_chat_model = llm_client.get_chat_model
+    usage = UsageMetadataCallbackHandler()
+    llm_client.get_chat_model = lambda *a, **kw: get_chat_model(*a, **kw).with_config(callbacks=[usage])
+
+    print(f"llm_diff 實測（{args.edits} 次修改，TODO：{args.todo}）")
+    for label, candidates in (("sequential", 0), (f"speculative×{args.candidates}", args.candidates)):
+        sub_agent.SPECULATIVE_CANDIDATES = candidates
+        sub_agent.SPECULATIVE_STAGGER_SECONDS = args.stagger / 1000
+        usage.usage_metadata.clear()
+        stats = {"llm_calls": 0}
+        results = measure(label, lambda: sub_agent.llm_diff("bench", args.todo, "HTML", [], stats), args.edits, width=15)
+        failures = sum(result.startswith(("錯誤", "生成 diff 失敗")) for result in results)
+        tokens = sum(item.get("total_tokens", 0) for item in usage.usage_metadata.values())
+        print(f"    失敗={failures}  請求數={stats['llm_calls']}  完整回應的 tokens={tokens:,}")
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--stagger", type=float, default=0, help="相鄰候選的啟動間隔（毫秒）")
+    parser.add_argument("--latency", type=float, default=50, help="單次 LLM 呼叫延遲中位數（毫秒）")
+    parser.add_argument("--failure", type=float, default=0.3, help="search_replace 的失敗率，其餘格式依比例調整")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--live", action="store_true", help="實際呼叫 OpenAI，而非模擬")
+    parser.add_argument("--todo", default="Change the main heading text to 'Hello World'")
+    args = parser.parse_args()
+
+    if args.live:
+        live(args)
+        return
+
+    print(f"diff 生成延遲（模擬：{args.edits} 次修改，延遲中位數 {args.latency} ms，失敗率 {args.failure}，"
+          f"錯開 {args.stagger} ms）")
+    sequential_llm = FakeLLM(args.latency, args.failure, args.seed)
+    sequential = measure("sequential", lambda: sequential_edit(sequential_llm), args.edits, width=15)
+    speculative_llm = FakeLLM(args.latency, args.failure, args.seed)
+    candidates = measure(f"speculative×{args.candidates}",
+                         lambda: speculative_edit(speculative_llm, args.candidates, args.stagger), args.edits, width=15)
+    print(f"  失敗：sequential={sequential.count(False)}  speculative={candidates.count(False)}")
+    print(f"  LLM 呼叫次數：sequential={sequential_llm.calls}  speculative={speculative_llm.calls}")
+
+
+if __name__ == "__main__":
+    main()
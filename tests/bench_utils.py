@@ -0,0 +1,42 @@
+"""
+benchmark 腳本共用的量測與命令列參數
+
+各 bench_*.py 以 `python tests/bench_xxx.py` 直接執行；import 本模組時會把專案根目錄加入 sys.path，
+之後即可 `from Functions import ...`。
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Any, Callable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
+
+
+def make_parser(description: Optional[str], iterations: Optional[int] = None) -> argparse.ArgumentParser:
+    """以腳本的 docstring 作為說明建立參數解析器；iterations 不為 None 時加入 --iterations"""
+    parser = argparse.ArgumentParser(description=description, formatter_class=argparse.RawDescriptionHelpFormatter)
+    if iterations is not None:
+        parser.add_argument("--iterations", type=int, default=iterations)
+    return parser
+
+
+def percentile(sorted_samples: List[float], fraction: float) -> float:
+    return sorted_samples[max(int(len(sorted_samples) * fraction) - 1, 0)]
+
+
+def measure(label: str, func: Callable[[], Any], iterations: int, width: int = 12) -> List[Any]:
+    """執行 func iterations 次，印出每次耗時的 mean、p50、p95（毫秒），回傳每次的回傳值"""
+    samples, results = [], []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        results.append(func())
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(f"  {label:<{width}} mean={statistics.mean(samples):8.3f} ms  "
+          f"p50={statistics.median(samples):8.3f} ms  p95={percentile(samples, 0.95):8.3f} ms")
+    return results
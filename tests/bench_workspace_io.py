@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+主機工作目錄模式與 Docker exec 路徑的讀寫延遲比較
+
+- workspace：專案檔案在主機的暫存工作目錄，讀寫都是本機檔案 I/O（不需要 Docker）
+- exec：檔案只在容器內，讀取走 exec_run cat、寫入走 put_archive + mv（需要 --container）
+
+兩者都透過 ai_tool.read_source_file / write_source_file 量測；
+讀取分別量測停用快取（每次都實際讀取）與啟用快取的延遲。
+
+用法：python tests/bench_workspace_io.py --iterations 200 --container ai-web-ide_demo_container
+"""
+
+import itertools
+import os
+import tempfile
+
+from bench_utils import ROOT, make_parser, measure
+from Functions import ai_tool, file_cache, workspace
+
+TEMPLATE_DIR = os.path.join(ROOT, "docker_template")
+BENCH_CONTAINER = "ai-web-ide_bench_workspace_container"
+
+
+def run(label: str, container: str, iterations: int) -> None:
+    original = ai_tool.read_source_file(container, "index.html")
+
+    file_cache._cache = file_cache.FileCache(enabled=False)
+    measure(f"{label} read (no cache)", lambda: ai_tool.read_source_file(container, "index.html"), iterations, width=26)
+    file_cache._cache = file_cache.FileCache()
+    measure(f"{label} read (cached)", lambda: ai_tool.read_source_file(container, "index.html"), iterations, width=26)
+    # 每次寫入不同的內容
+    counter = itertools.count()
+    measure(f"{label} write",
+            lambda: ai_tool.write_source_file(container, "index.html", f"{original}<!-- {next(counter)} -->\n"),
+            iterations, width=26)
+
+    ai_tool.write_source_file(container, "index.html", original)
+
+
+def main():
+    parser = make_parser(__doc__, iterations=200)
+    parser.add_argument("--container", help="以 exec 路徑量測的容器名稱；未指定時只量測工作目錄模式")
+    args = parser.parse_args()
+
+    print(f"index.html 讀寫延遲（{args.iterations} 次）")
+    with tempfile.TemporaryDirectory() as root:
+        workspace.WORKSPACE_ROOT = root
+        workspace.create_workspace(BENCH_CONTAINER, TEMPLATE_DIR, ai_tool.PROJECT_FILES)
+        run("workspace", BENCH_CONTAINER, args.iterations)
+        workspace.WORKSPACE_ROOT = ""
+
+    if args.container:
+        run("exec", args.container, args.iterations)
+
+
+if __name__ == "__main__":
+    main()
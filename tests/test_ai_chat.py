@@ -0,0 +1,161 @@
+"""
+測試 ai_chat 的工具綁定、agent 快取與串流事件（不呼叫 OpenAI）
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_openai")
+
+from Functions import ai_tool  # noqa: E402,F401
+from Functions import ai_chat  # noqa: E402
+
+CONTAINER = "ai-web-ide_demo_container"
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    recorded = []
+
+    def record(name):
+        def func(*args, **kwargs):
+            recorded.append((name, args, kwargs))
+            return f"{name} ok"
+        return func
+
+    monkeypatch.setattr(ai_tool, "get_html_code", record("get_html_code"))
+    monkeypatch.setattr(ai_tool, "edit_request", record("edit_request"))
+    return recorded
+
+
+def test_bound_tool_accepts_omitted_container_name(calls):
+    bound = ai_chat._bind_tool(ai_chat.get_html_code, CONTAINER, "demo")
+
+    assert "container_name" not in bound.args
+    assert bound.invoke({}) == "get_html_code ok"
+    assert calls == [("get_html_code", (CONTAINER, None, None, False), {})]
+
+
+def test_bound_tool_always_uses_injected_container_name(calls):
+    bound = ai_chat._bind_tool(ai_chat.get_html_code, CONTAINER, "demo")
+
+    bound.invoke({"container_name": "../outside", "start": 3, "end": 5})
+
+    assert calls == [("get_html_code", (CONTAINER, 3, 5, False), {})]
+
+
+def test_bound_edit_request_injects_session_from_request_context(calls):
+    bound = ai_chat._bind_tool(ai_chat.edit_request, CONTAINER, "demo")
+    assert bound.args == {}
+
+    token = ai_chat._request_context.set({"session_id": "s1"})
+    try:
+        bound.invoke({"session_id": "guessed", "project_name": "other"})
+    finally:
+        ai_chat._request_context.reset(token)
+
+    assert calls == [("edit_request", (CONTAINER, "s1", "demo"), {})]
+
+
+def test_async_bound_tool_runs_in_the_tool_executor_with_request_context(monkeypatch):
+    import asyncio
+
+    seen = []
+
+    def edit_request(container_name, session_id, project_name):
+        seen.append((threading.current_thread().name, session_id))
+        return "edited"
+
+    monkeypatch.setattr(ai_tool, "edit_request", edit_request)
+    bound = ai_chat._bind_tool(ai_chat.edit_request, CONTAINER, "demo")
+
+    async def run():
+        ai_chat._request_context.set({"session_id": "s1"})
+        return await bound.ainvoke({})
+
+    assert asyncio.run(run()) == "edited"
+    ((thread_name, session_id),) = seen
+    assert thread_name.startswith("agent-tool") and session_id == "s1"
+
+
+def test_bound_tool_without_project_still_requires_container_name(calls):
+    bound = ai_chat._bind_tool(ai_chat.get_html_code, None, None)
+
+    assert "container_name" in bound.args
+    bound.invoke({"container_name": CONTAINER})
+    assert calls[0][1][0] == CONTAINER
+
+
+def test_agent_cache_reuses_and_evicts_least_recently_used(monkeypatch):
+    built = []
+
+    def fake_build(tools, project_name=None):
+        built.append(project_name)
+        return object()
+
+    monkeypatch.setattr(ai_chat, "build_agent_with_tools", fake_build)
+    monkeypatch.setattr(ai_chat, "AGENT_CACHE_SIZE", 2)
+    monkeypatch.setattr(ai_chat, "_agent_cache", type(ai_chat._agent_cache)())
+
+    a = ai_chat.get_agent_executor("a")
+    b = ai_chat.get_agent_executor("b")
+    assert ai_chat.get_agent_executor("a") is a
+    ai_chat.get_agent_executor("c")
+
+    # b 最久沒有使用，被移除後需要重新建立
+    assert ai_chat.get_agent_executor("a") is a
+    assert ai_chat.get_agent_executor("b") is not b
+    assert built == ["a", "b", "c", "b"]
+
+
+def test_agent_cache_builds_each_project_once_under_concurrency(monkeypatch):
+    barrier = threading.Barrier(4)
+
+    def fake_build(tools, project_name=None):
+        return object()
+
+    monkeypatch.setattr(ai_chat, "build_agent_with_tools", fake_build)
+    monkeypatch.setattr(ai_chat, "_agent_cache", type(ai_chat._agent_cache)())
+
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(ai_chat.get_agent_executor("shared"))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 同時建立時以先放入快取的為準，所有請求拿到同一個 agent
+    assert len({id(result) for result in results}) == 1
+
+
+def test_stream_event_handler_forwards_only_tokens_outside_tools():
+    events = []
+    handler = ai_chat.StreamEventHandler(lambda event, message: events.append((event, message)))
+
+    handler.on_llm_new_token("你")
+    handler.on_tool_start({"name": "edit_request"}, "")
+    # 工具內部（子代理）的 LLM token 不轉送
+    handler.on_llm_new_token("內部")
+    handler.on_tool_end("done", name="edit_request")
+    handler.on_llm_new_token("好")
+    handler.on_llm_new_token("")
+    handler.on_tool_start({}, "", name="unknown")
+    handler.on_tool_error(RuntimeError("boom"))
+    handler.on_llm_new_token("!")
+
+    assert events == [
+        ("token", "你"),
+        ("tool_start", ai_chat.TOOL_STATUS_MESSAGES["edit_request"]),
+        ("tool_end", "工具 edit_request 執行完成"),
+        ("token", "好"),
+        ("tool_start", "正在執行工具 unknown..."),
+        ("tool_end", "工具執行失敗：boom"),
+        ("token", "!"),
+    ]
@@ -0,0 +1,151 @@
+"""
+測試專案檔案的批次讀取：一次 get_archive 讀取全部檔案並填入快取（以假的容器取代 Docker）
+"""
+
+import io
+import tarfile
+
+import pytest
+
+pytest.importorskip("docker")
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_openai")
+
+from Functions import ai_tool, docker_client, file_cache  # noqa: E402
+
+FILES = {"index.html": "<h1>Hi</h1>\n", "index.css": "h1 { color: red; }\n", "index.js": "console.log(1);\n"}
+
+
+class FakeContainer:
+    def __init__(self):
+        self.archives = 0
+        self.execs = 0
+
+    def get_archive(self, path):
+        self.archives += 1
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            for name, content in FILES.items():
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(name=f"html/{name}")
+                info.size = len(data)
+                info.mtime = 1700000000
+                tar.addfile(info, io.BytesIO(data))
+        return iter([stream.getvalue()]), {"name": "html"}
+
+    def exec_run(self, cmd):
+        self.execs += 1
+        raise AssertionError("cached files should not be read again")
+
+
+@pytest.fixture
+def container(monkeypatch):
+    fake = FakeContainer()
+    monkeypatch.setattr(docker_client, "with_container", lambda name, action: action(fake))
+    monkeypatch.setattr(file_cache, "_cache", file_cache.FileCache(revalidate_seconds=60))
+    return fake
+
+
+def test_project_files_are_fetched_in_one_archive_and_cached(container):
+    files = ai_tool.read_project_files("demo")
+    html = ai_tool.get_html_code("demo")
+    view = ai_tool.get_project_files("demo")
+
+    assert files == FILES
+    assert html == " 1: <h1>Hi</h1>"
+    assert "=== index.css ===\n 1: h1 { color: red; }" in view
+    assert container.archives == 1 and container.execs == 0
+    assert file_cache.cache_stats()["misses"] == 3
+
+
+class RecordingContainer:
+    def __init__(self, rename_exit_code=0):
+        self.uploads = []
+        self.commands = []
+        self.rename_exit_code = rename_exit_code
+
+    def put_archive(self, path, data):
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            member = tar.getmembers()[0]
+            self.uploads.append((path, member.name, tar.extractfile(member).read().decode("utf-8")))
+        return True
+
+    def exec_run(self, cmd):
+        self.commands.append(cmd)
+        exit_code = self.rename_exit_code if cmd[0] in ("mv", "sh") else 0
+        return type("Result", (), {"exit_code": exit_code, "output": b"mv: failed"})()
+
+
+def test_write_uploads_to_a_temp_name_then_renames(monkeypatch):
+    fake = RecordingContainer()
+    monkeypatch.setattr(docker_client, "with_container", lambda name, action: action(fake))
+    monkeypatch.setattr(file_cache, "_cache", file_cache.FileCache(revalidate_seconds=60))
+
+    version = ai_tool.write_source_file("demo", "index.html", "<h1>New</h1>\n")
+
+    (path, temp_name, content), = fake.uploads
+    # 暫存檔不放在 nginx 提供的目錄內
+    assert path == ai_tool.STAGING_DIR != ai_tool.SOURCE_DIR
+    assert temp_name.startswith(".index.html.") and content == "<h1>New</h1>\n"
+    assert fake.commands == [["mv", "-f", f"{ai_tool.STAGING_DIR}/{temp_name}", f"{ai_tool.SOURCE_DIR}/index.html"]]
+    assert version == 1 and ai_tool.read_source_file("demo", "index.html") == "<h1>New</h1>\n"
+
+
+def test_failed_rename_removes_the_temp_file_and_drops_the_cache(monkeypatch):
+    fake = RecordingContainer(rename_exit_code=1)
+    monkeypatch.setattr(docker_client, "with_container", lambda name, action: action(fake))
+    monkeypatch.setattr(file_cache, "_cache", file_cache.FileCache(revalidate_seconds=60))
+
+    with pytest.raises(IOError):
+        ai_tool.write_source_file("demo", "index.html", "<h1>New</h1>\n")
+
+    assert fake.commands[-1][:2] == ["rm", "-f"]
+    assert file_cache.get_cache().version("demo", f"{ai_tool.SOURCE_DIR}/index.html") == 0
+
+
+def test_write_with_a_stale_digest_does_not_replace_the_file(monkeypatch):
+    fake = RecordingContainer(rename_exit_code=ai_tool._CHANGED_EXIT_CODE)
+    monkeypatch.setattr(docker_client, "with_container", lambda name, action: action(fake))
+    monkeypatch.setattr(file_cache, "_cache", file_cache.FileCache(revalidate_seconds=60))
+
+    with pytest.raises(ai_tool.FileChangedError):
+        ai_tool.write_source_file("demo", "index.html", "<h1>New</h1>\n", expected_digest="stale")
+
+    # 內容確認與改名在同一次 exec 中完成
+    (command,) = fake.commands
+    assert command[:2] == ["sh", "-c"] and command[-1] == "stale"
+    assert file_cache.get_cache().version("demo", f"{ai_tool.SOURCE_DIR}/index.html") == 0
+
+
+class MutableContainer:
+    """以 cat 與 sha256sum 讀取可被「外部」修改的檔案"""
+
+    def __init__(self, content):
+        self.content = content
+        self.commands = []
+
+    def exec_run(self, cmd):
+        self.commands.append(cmd[0])
+        if cmd[0] == "cat":
+            output = self.content
+        else:
+            output = f"{file_cache.content_digest(self.content)}  {cmd[-1]}\n"
+        return type("Result", (), {"exit_code": 0, "output": output.encode("utf-8")})()
+
+
+def test_max_age_zero_revalidates_inside_the_cache_window(monkeypatch):
+    fake = MutableContainer("<h1>Hi</h1>\n")
+    monkeypatch.setattr(docker_client, "with_container", lambda name, action: action(fake))
+    monkeypatch.setattr(file_cache, "_cache", file_cache.FileCache(revalidate_seconds=60))
+
+    # 未命中只需要一次 cat，指紋由內容雜湊算出
+    assert ai_tool.read_source_file("demo", "index.html") == "<h1>Hi</h1>\n"
+    assert fake.commands == ["cat"]
+    # 在終端機中修改了檔案（大小與修改時間的秒數都可能不變），仍在快取的確認期限內
+    fake.content = "<h1>Edit</h1>\n"
+
+    assert ai_tool.read_source_file("demo", "index.html") == "<h1>Hi</h1>\n"
+    assert ai_tool.read_source_file("demo", "index.html", max_age=0) == "<h1>Edit</h1>\n"
+    assert fake.commands == ["cat", "sha256sum", "cat"]
+    assert ai_tool.read_source_file("demo", "index.html", max_age=0) == "<h1>Edit</h1>\n"
+    assert fake.commands[3:] == ["sha256sum"]
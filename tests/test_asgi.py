@@ -0,0 +1,80 @@
+"""
+測試 ASGI 聊天 API：SSE 事件格式、Last-Event-ID 重連接續與請求格式錯誤
+"""
+
+import json
+import uuid
+
+import pytest
+
+pytest.importorskip("a2wsgi")
+pytest.importorskip("httpx")
+
+from starlette.testclient import TestClient  # noqa: E402
+
+import asgi  # noqa: E402
+
+
+def _session_cookie(data: dict) -> dict:
+    serializer = asgi.flask_app.session_interface.get_signing_serializer(asgi.flask_app)
+    return {asgi.flask_app.config["SESSION_COOKIE_NAME"]: serializer.dumps(data)}
+
+
+def _parse_sse(body: str):
+    """將 SSE 回應拆成 (id, data) 清單；忽略心跳註解行"""
+    frames = []
+    for block in body.split("\n\n"):
+        if not block or block.startswith(":"):
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        assert set(fields) == {"id", "data"}
+        frames.append((int(fields["id"]), json.loads(fields["data"])))
+    return frames
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    async def fake_stream(user_input, session_id, project_name, event_callback):
+        calls.append((user_input, session_id, project_name))
+        event_callback("token", "你")
+        event_callback("token", "好")
+        return "你好"
+
+    monkeypatch.setattr(asgi, "achat_with_ai_stream", fake_stream)
+    with TestClient(asgi.application, cookies=_session_cookie({"project_name": "demo"})) as test_client:
+        test_client.calls = calls
+        yield test_client
+
+
+def test_chat_stream_sends_numbered_sse_frames_and_resumes_after_last_event_id(client):
+    params = {"message": "hi", "session_id": "s1", "turn_id": str(uuid.uuid4())}
+
+    response = client.get("/api/chat_stream", params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    frames = _parse_sse(response.text)
+    assert [event_id for event_id, _ in frames] == [1, 2, 3, 4]
+    assert [data["type"] for _, data in frames] == ["status", "token", "token", "response"]
+    assert frames[-1][1]["message"] == "你好"
+
+    # 同一個 turn_id 重連：只送出 Last-Event-ID 之後的事件，且不會重新執行
+    resumed = client.get("/api/chat_stream", params=params, headers={"Last-Event-ID": "2"})
+    assert resumed.status_code == 200
+    assert _parse_sse(resumed.text) == frames[2:]
+    assert client.calls == [("hi", "s1", "demo")]
+
+
+def test_chat_stream_requires_a_selected_project(client):
+    client.cookies.clear()
+    response = client.get("/api/chat_stream", params={"message": "hi", "session_id": "s1"})
+    assert response.status_code == 400
+    assert client.calls == []
+
+
+def test_chat_rejects_a_malformed_body(client):
+    response = client.post("/api/chat", content=b"not json", headers={"Content-Type": "application/json"})
+    assert response.status_code == 400
+    assert "error" in response.json()
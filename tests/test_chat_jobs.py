@@ -0,0 +1,41 @@
+"""
+測試聊天工作：同一個 turn_id 只執行一次，重連時依 Last-Event-ID 接續
+"""
+
+import pytest
+
+from Functions.chat_jobs import get_or_create_job, parse_last_event_id
+
+
+def test_same_turn_id_starts_only_once():
+    started = []
+
+    def start(job):
+        started.append(job.id)
+        job.publish("token", "你好")
+        job.finish("你好")
+
+    job, created = get_or_create_job("turn-once", "s1", "demo", "hi", start)
+    again, created_again = get_or_create_job("turn-once", "s1", "demo", "hi", start)
+
+    assert created is True and created_again is False
+    assert again is job
+    assert started == ["turn-once"]
+
+    # 重連時從最後收到的事件之後接續
+    events = list(job.channel.subscribe(after=1, heartbeat_interval=1))
+    assert [(e.id, e.type) for e in events] == [(2, "token"), (3, "response")]
+
+
+def test_turn_id_from_other_session_is_rejected():
+    get_or_create_job("turn-owned", "s1", "demo", "hi", lambda job: job.finish("ok"))
+    with pytest.raises(ValueError):
+        get_or_create_job("turn-owned", "s2", "demo", "hi", lambda job: job.finish("ok"))
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id(None) == 0
+    assert parse_last_event_id("") == 0
+    assert parse_last_event_id("7") == 7
+    assert parse_last_event_id("abc") == 0
+    assert parse_last_event_id("-3") == 0
@@ -0,0 +1,137 @@
+"""
+測試 chat_store：遷移、pragma、索引與連線池
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from Functions import chat_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    pool = chat_store.configure(str(tmp_path / "chat_history.db"), max_size=4)
+    yield pool
+    pool.close()
+
+
+def test_migrations_set_user_version_and_indexes(store):
+    with chat_store.connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(messages)")}
+
+    assert version == len(chat_store.MIGRATIONS)
+    assert journal_mode == "wal"
+    assert {"idx_messages_session_time", "idx_messages_session_role_time",
+            "idx_messages_project_session"} <= indexes
+
+
+def test_legacy_database_gets_project_name_column(tmp_path):
+    """舊版資料庫（無 project_name 欄位）應由遷移自動升級"""
+    db_path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            role TEXT,
+            content TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("INSERT INTO messages (session_id, role, content) VALUES ('s1', 'system', 'init')")
+    conn.execute("INSERT INTO messages (session_id, role, content) VALUES ('s1', 'user', 'hi')")
+    conn.commit()
+    conn.close()
+
+    pool = chat_store.configure(db_path)
+    try:
+        assert chat_store.fetch_messages("s1") == [("system", "init"), ("user", "hi")]
+        # sessions 摘要表應由遷移從既有訊息回填
+        [(session_id, _, _, title, message_count)] = chat_store.fetch_sessions()
+        assert (session_id, title, message_count) == ("s1", "hi", 1)
+        with chat_store.connection() as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+        assert "project_name" in columns
+    finally:
+        pool.close()
+
+
+def test_session_roundtrip(store):
+    assert chat_store.ensure_session("demo::s1", "demo", "init") is True
+    assert chat_store.ensure_session("demo::s1", "demo", "init") is False
+
+    chat_store.insert_message("demo::s1", "demo", "user", "第一句")
+    chat_store.insert_message("demo::s1", "demo", "ai", "回覆")
+    chat_store.insert_message("demo::s1", "demo", "user", "第二句")
+
+    assert chat_store.fetch_messages("demo::s1") == [
+        ("system", "init"), ("user", "第一句"), ("ai", "回覆"), ("user", "第二句"),
+    ]
+    assert chat_store.fetch_latest_user_message("demo::s1") == "第二句"
+    [(session_id, project, last_time, title, count)] = chat_store.fetch_sessions("demo")
+    assert (session_id, project, title, count) == ("demo::s1", "demo", "第一句", 3)
+    assert last_time is not None
+    assert chat_store.fetch_project_names() == ["demo"]
+
+    assert chat_store.delete_session_messages("demo::s1") == 4
+    assert chat_store.fetch_sessions("demo") == []
+    assert chat_store.fetch_sessions() == []
+
+
+def test_system_only_session_is_not_listed(store):
+    chat_store.ensure_session("demo::empty", "demo", "init")
+    assert chat_store.fetch_sessions("demo") == []
+
+
+def test_pool_handles_concurrent_writers(store):
+    """多個執行緒同時寫入時不應出現 database is locked"""
+    errors = []
+
+    def writer(worker_id):
+        try:
+            for i in range(50):
+                chat_store.insert_message(f"p::s{worker_id}", "p", "user", f"m{i}")
+        except Exception as e:  # pragma: no cover - 失敗時才會走到
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    sessions = chat_store.fetch_sessions("p")
+    assert len(sessions) == 8
+    assert all(row[4] == 50 for row in sessions)
+    assert store._created <= store.max_size
+
+
+def test_summary_covers_message_ids_incrementally(store):
+    ids = [chat_store.insert_message("demo::s1", "demo", role, f"m{i}")
+           for i, role in enumerate(["user", "ai"] * 5)]
+
+    assert chat_store.count_messages_after("demo::s1", 0) == 10
+    folded = chat_store.fetch_messages_after("demo::s1", 0, 4)
+    assert [row[0] for row in folded] == ids[:4]
+
+    assert chat_store.save_summary("demo::s1", "摘要一", ids[0], ids[3], 4) is True
+    assert chat_store.fetch_summary("demo::s1") == ("摘要一", ids[0], ids[3], 4)
+
+    # 涵蓋範圍沒有比較新的版本不會覆蓋既有摘要
+    assert chat_store.save_summary("demo::s1", "過期摘要", ids[0], ids[1], 2) is False
+    assert chat_store.fetch_summary("demo::s1")[0] == "摘要一"
+
+    # 視窗只讀摘要之後的訊息，由新到舊
+    recent = chat_store.fetch_recent_messages("demo::s1", 3, after_id=ids[3])
+    assert recent == [("ai", "m9"), ("user", "m8"), ("ai", "m7")]
+    assert chat_store.count_messages_after("demo::s1", ids[3]) == 6
+
+    chat_store.delete_session_messages("demo::s1")
+    assert chat_store.fetch_summary("demo::s1") is None
+    # session 已刪除時不應留下孤兒摘要
+    assert chat_store.save_summary("demo::s1", "孤兒", ids[0], ids[9], 10) is False
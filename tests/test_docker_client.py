@@ -0,0 +1,106 @@
+"""
+測試共用的 Docker client：延遲建立、健康檢查與容器查詢快取（以假的 client 取代 daemon）
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+docker = pytest.importorskip("docker")
+
+from Functions import docker_client  # noqa: E402
+
+
+class FakeContainers:
+    def __init__(self):
+        self.gets = 0
+        self.missing = set()
+        # 每次重建容器 generation 加一，容器 id 隨之改變
+        self.generation = 1
+
+    def get(self, name):
+        self.gets += 1
+        if name in self.missing:
+            raise docker.errors.NotFound(name)
+        return SimpleNamespace(id=f"{name}#{self.generation}", lookup=self.gets)
+
+
+class FakeClient:
+    def __init__(self):
+        self.containers = FakeContainers()
+        self.healthy = True
+        self.closed = False
+
+    def ping(self):
+        if not self.healthy:
+            raise ConnectionError("daemon unavailable")
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    created = []
+
+    def from_env(**kwargs):
+        created.append(FakeClient())
+        return created[-1]
+
+    monkeypatch.setattr(docker, "from_env", from_env)
+    docker_client.reset_client()
+    yield created
+    docker_client.reset_client()
+
+
+def test_client_is_created_once_and_shared(clients):
+    assert docker_client.get_client() is docker_client.get_client()
+    assert len(clients) == 1
+
+
+def test_unhealthy_client_is_replaced_after_health_check_interval(clients, monkeypatch):
+    monkeypatch.setattr(docker_client, "DOCKER_HEALTH_CHECK_INTERVAL", 0)
+    first = docker_client.get_client()
+    first.healthy = False
+
+    second = docker_client.get_client()
+
+    assert second is not first and first.closed
+    assert len(clients) == 2
+
+
+def test_container_lookups_are_cached_until_invalidated(clients):
+    first = docker_client.get_container("demo")
+    second = docker_client.get_container("demo")
+    docker_client.invalidate_container("demo")
+    third = docker_client.get_container("demo")
+
+    assert first is second and first.lookup == 1
+    assert third.lookup == 2
+
+
+def test_with_container_refreshes_a_stale_container_once(clients):
+    calls = []
+
+    def action(container):
+        calls.append(container.id)
+        if len(calls) == 1:
+            clients[0].containers.generation += 1
+            raise docker.errors.NotFound("container was recreated")
+        return "ok"
+
+    assert docker_client.with_container("demo", action) == "ok"
+    assert calls == ["demo#1", "demo#2"]
+
+
+def test_with_container_does_not_rerun_an_action_that_raised_not_found_itself(clients):
+    calls = []
+
+    def action(container):
+        calls.append(container.id)
+        raise docker.errors.NotFound("no such file")
+
+    with pytest.raises(docker.errors.NotFound, match="no such file"):
+        docker_client.with_container("demo", action)
+    assert calls == ["demo#1"]
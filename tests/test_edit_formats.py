@@ -0,0 +1,118 @@
+"""
+測試 LLM 修改格式：SEARCH/REPLACE、整檔輸出、格式選擇與轉回 unified diff
+"""
+
+import pytest
+
+from Functions import edit_formats
+from Functions.unified_diff import PatchError, apply_patch, make_diff
+
+ORIGINAL = """<html>
+<body>
+    <h1>Welcome</h1>
+    <p>Intro</p>
+</body>
+</html>
+"""
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    stats = {name: {"attempts": 0, "successes": 0, "tokens": 0} for name in edit_formats.FORMATS}
+    monkeypatch.setattr(edit_formats, "_format_stats", stats)
+
+
+def apply(name, output):
+    return edit_formats.FORMATS[name].apply(ORIGINAL, output, "index.html")
+
+
+def test_search_replace_blocks_apply_in_order():
+    output = """Here are the edits:
+<<<<<<< SEARCH
+    <h1>Welcome</h1>
+=======
+    <nav>Home</nav>
+    <h1>Welcome</h1>
+>>>>>>> REPLACE
+
+<<<<<<< SEARCH
+    <p>Intro</p>
+=======
+>>>>>>> REPLACE
+"""
+    updated, notes = apply("search_replace", output)
+    assert updated == ORIGINAL.replace("    <h1>", "    <nav>Home</nav>\n    <h1>").replace("    <p>Intro</p>\n", "")
+    assert notes == []
+
+
+def test_search_replace_tolerates_indentation_but_not_ambiguity():
+    updated, notes = apply("search_replace", "<<<<<<< SEARCH\n<p>Intro</p>\n=======\n    <p>Hello</p>\n>>>>>>> REPLACE\n")
+    assert "    <p>Hello</p>\n</body>" in updated
+    assert notes
+
+    with pytest.raises(PatchError, match="出現 2 次"):
+        edit_formats.FORMATS["search_replace"].apply(
+            "<li>x</li>\n<li>y</li>\n<li>x</li>\n", "<<<<<<< SEARCH\n<li>x</li>\n=======\n<li>z</li>\n>>>>>>> REPLACE\n", "f"
+        )
+    with pytest.raises(PatchError, match="找不到"):
+        apply("search_replace", "<<<<<<< SEARCH\n<footer>\n=======\n\n>>>>>>> REPLACE\n")
+    with pytest.raises(PatchError, match="SEARCH/REPLACE"):
+        apply("search_replace", "just change the title")
+
+
+def test_whole_file_extracts_fenced_content_and_rejects_elisions():
+    updated, _ = apply("whole_file", "```html\n<html>\n<body>\n</body>\n</html>\n```")
+    assert updated == "<html>\n<body>\n</body>\n</html>\n"
+
+    with pytest.raises(PatchError, match="省略"):
+        apply("whole_file", "```html\n<html>\n<!-- ... rest of the page -->\n</html>\n```")
+
+
+def test_whole_file_rejects_bare_ellipsis_when_the_file_shrinks():
+    with pytest.raises(PatchError, match="比原檔短"):
+        apply("whole_file", "```html\n<html>\n...\n</html>\n```")
+
+    # 長度不變時，新加入的 `...`（例如文字內容）不視為省略
+    updated, _ = apply("whole_file", "```\n" + ORIGINAL.replace("Welcome", "Loading...") + "```")
+    assert "Loading..." in updated
+
+
+def test_whole_file_is_only_offered_when_the_prompt_shows_the_full_source(monkeypatch):
+    monkeypatch.setattr(edit_formats, "WHOLE_FILE_MAX_LINES", 500)
+    monkeypatch.setattr(edit_formats.source_context, "CONTEXT_FULL_MAX_LINES", 200)
+
+    assert edit_formats.eligible_formats("line\n" * 150)[0] == "whole_file"
+    assert "whole_file" not in edit_formats.eligible_formats("line\n" * 300)
+
+
+def test_udiff_format_repairs_before_failing():
+    diff = "@@ -2,9 +2,9 @@\n <h1>Welcome</h1>\n-<p>Intro</p>\n+<p>Hi</p>\n"
+    updated, repairs = apply("udiff", diff)
+    assert "<h1>Welcome</h1>\n<p>Hi</p>\n</body>" in updated
+    assert repairs
+
+
+def test_every_format_feeds_the_same_diff_step():
+    updated, _ = apply("whole_file", "```\n" + ORIGINAL.replace("Welcome", "Hello") + "```")
+    diff = make_diff(ORIGINAL, updated, "index.html")
+    assert apply_patch(ORIGINAL, diff, "index.html") == updated
+    assert make_diff(ORIGINAL, ORIGINAL, "index.html") == ""
+
+
+def test_select_format_uses_file_size_and_success_rate(monkeypatch):
+    monkeypatch.setattr(edit_formats, "WHOLE_FILE_MAX_LINES", 10)
+    large = "line\n" * 50
+
+    assert edit_formats.select_format(ORIGINAL).name == "whole_file"
+    assert edit_formats.select_format(large).name == "search_replace"
+    assert edit_formats.select_format(ORIGINAL, exclude={"whole_file"}).name == "search_replace"
+
+    for _ in range(5):
+        edit_formats.record_result("search_replace", False, 500)
+        edit_formats.record_result("udiff", True, 300)
+    assert edit_formats.select_format(large).name == "udiff"
+
+    metrics = edit_formats.format_metrics()
+    assert metrics["udiff"]["success_rate"] == 1.0
+    assert metrics["udiff"]["tokens_per_applied_edit"] == 300
+    assert metrics["search_replace"]["success_rate"] == 0.0
@@ -0,0 +1,88 @@
+"""
+測試 EventChannel：推送式事件傳遞延遲、心跳與結束訊號
+"""
+
+import asyncio
+import statistics
+import threading
+import time
+
+from Functions.event_channel import HEARTBEAT, EventChannel, format_sse
+
+
+def test_event_delivery_latency():
+    """事件應在推送後立即送達，而不是等下一輪 100ms 輪詢"""
+    channel = EventChannel()
+    sent_at = {}
+    latencies = []
+
+    def producer():
+        for i in range(50):
+            time.sleep(0.005)
+            sent_at[i + 1] = time.perf_counter()
+            channel.publish("token", str(i))
+        channel.close()
+
+    threading.Thread(target=producer).start()
+    for event in channel.subscribe(heartbeat_interval=5):
+        latencies.append(time.perf_counter() - sent_at[event.id])
+
+    assert len(latencies) == 50
+    median_ms = statistics.median(latencies) * 1000
+    max_ms = max(latencies) * 1000
+    print(f"event delivery latency: median={median_ms:.3f} ms max={max_ms:.3f} ms")
+    assert median_ms < 10
+    assert max_ms < 100
+
+
+def test_heartbeat_when_idle():
+    channel = EventChannel()
+    events = channel.subscribe(heartbeat_interval=0.05)
+
+    start = time.perf_counter()
+    assert next(events) is HEARTBEAT
+    assert time.perf_counter() - start >= 0.04
+    assert format_sse(HEARTBEAT) == ": keep-alive\n\n"
+
+    channel.publish("status", "working")
+    assert next(events).message == "working"
+
+
+def test_completion_and_error_sentinels():
+    done = EventChannel()
+    done.publish("response", "ok")
+    done.close()
+    assert [e.type for e in done.subscribe(heartbeat_interval=1)] == ["response"]
+
+    failed = EventChannel()
+    failed.publish("status", "working")
+    failed.fail("boom")
+    events = list(failed.subscribe(heartbeat_interval=1))
+    assert [(e.type, e.message) for e in events] == [("status", "working"), ("error", "boom")]
+    assert format_sse(events[-1]) == 'id: 2\ndata: {"type": "error", "message": "boom"}\n\n'
+
+
+def test_subscribe_resumes_after_event_id():
+    channel = EventChannel()
+    for i in range(5):
+        channel.publish("token", str(i))
+    channel.close()
+    assert [e.message for e in channel.subscribe(after=3)] == ["3", "4"]
+
+
+def test_asubscribe_wakes_on_publish_from_thread():
+    channel = EventChannel()
+
+    async def consume():
+        return [e.message async for e in channel.asubscribe(heartbeat_interval=5)]
+
+    def producer():
+        time.sleep(0.02)
+        channel.publish("token", "a")
+        channel.publish("token", "b")
+        channel.close()
+
+    threading.Thread(target=producer).start()
+    start = time.perf_counter()
+    assert asyncio.run(consume()) == ["a", "b"]
+    assert time.perf_counter() - start < 1
@@ -0,0 +1,82 @@
+"""
+測試專案檔案快取：版本號、外部修改偵測與命中統計
+"""
+
+from Functions.file_cache import FileCache
+
+
+class FakeFile:
+    """以計數器模擬容器內的檔案，stat 指紋隨每次修改改變"""
+
+    def __init__(self, content):
+        self.content = content
+        self.mtime = 1
+        self.loads = 0
+        self.stats = 0
+
+    def load(self):
+        self.loads += 1
+        return self.content
+
+    def stat(self):
+        self.stats += 1
+        return f"42 {len(self.content)} {self.mtime}"
+
+    def modify(self, content):
+        self.content = content
+        self.mtime += 1
+
+
+def test_repeated_reads_hit_the_cache_without_loading():
+    cache = FileCache(revalidate_seconds=60)
+    file = FakeFile("<h1>Hi</h1>\n")
+
+    first = cache.get("c", "index.html", file.load, file.stat)
+    second = cache.get("c", "index.html", file.load, file.stat)
+
+    assert second.content == first.content and second.version == first.version == 1
+    assert file.loads == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_own_writes_update_content_and_version_without_reloading():
+    cache = FileCache(revalidate_seconds=0)
+    file = FakeFile("old\n")
+    cache.get("c", "index.html", file.load, file.stat)
+
+    file.modify("new\n")
+    cache.record_write("c", "index.html", "new\n")
+    entry = cache.get("c", "index.html", file.load, file.stat)
+
+    # 寫入後第一次確認直接採用新的指紋，不重新讀取
+    assert entry.content == "new\n" and entry.version == 2
+    assert file.loads == 1
+
+
+def test_external_change_is_detected_by_stat_after_revalidation_window():
+    cache = FileCache(revalidate_seconds=0)
+    file = FakeFile("old\n")
+    cache.get("c", "index.html", file.load, file.stat)
+
+    unchanged = cache.get("c", "index.html", file.load, file.stat)
+    file.modify("edited outside\n")
+    changed = cache.get("c", "index.html", file.load, file.stat)
+
+    assert unchanged.version == 1 and file.loads == 2
+    assert changed.content == "edited outside\n" and changed.version == 2
+    assert cache.stats()["external_changes"] == 1
+
+
+def test_invalidate_and_disabled_cache_always_load():
+    cache = FileCache(revalidate_seconds=60)
+    file = FakeFile("x\n")
+    cache.get("c", "index.html", file.load, file.stat)
+    cache.invalidate("c")
+    cache.get("c", "index.html", file.load, file.stat)
+
+    disabled = FileCache(enabled=False)
+    disabled.get("c", "index.html", file.load, file.stat)
+    disabled.get("c", "index.html", file.load, file.stat)
+
+    assert file.loads == 4
+    assert disabled.stats()["entries"] == 0
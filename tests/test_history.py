@@ -0,0 +1,199 @@
+"""
+測試聊天歷史視窗：token 計算與回合挑選
+"""
+
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain")
+
+from Functions import history  # noqa: E402
+
+
+@pytest.fixture
+def length_tokens(monkeypatch):
+    """以內容長度作為 token 數，讓預算的計算一目了然"""
+    monkeypatch.setattr(history, "count_message_tokens", lambda content, model="gpt-4o": len(content))
+
+
+def newest_first(*turns):
+    rows = [row for user, ai in turns for row in (("user", user), ("ai", ai))]
+    return list(reversed(rows))
+
+
+def test_select_recent_turns_keeps_newest_turns_within_budget(length_tokens):
+    rows = newest_first(("u1" * 10, "a1" * 10), ("u2" * 5, "a2" * 5), ("u3" * 5, "a3" * 5))
+
+    # 每個較新的回合 20 tokens，最舊的回合 40 tokens
+    assert history.select_recent_turns(rows, token_budget=45) == [
+        ("user", "u2" * 5), ("ai", "a2" * 5), ("user", "u3" * 5), ("ai", "a3" * 5),
+    ]
+    assert history.select_recent_turns(rows, token_budget=19) == []
+    assert len(history.select_recent_turns(rows, token_budget=80)) == 6
+
+
+def test_select_recent_turns_never_splits_a_turn(length_tokens):
+    rows = newest_first(("u1", "a1"), ("u2" * 10, "a2"))
+
+    # 預算只夠最新回合的 ai 訊息，不夠整個回合：不保留半個回合
+    assert history.select_recent_turns(rows, token_budget=10) == []
+
+
+def test_select_recent_turns_respects_max_turns(length_tokens):
+    rows = newest_first(("u1", "a1"), ("u2", "a2"), ("u3", "a3"))
+
+    assert history.select_recent_turns(rows, token_budget=1000, max_turns=2) == [
+        ("user", "u2"), ("ai", "a2"), ("user", "u3"), ("ai", "a3"),
+    ]
+
+
+def test_select_recent_turns_groups_consecutive_ai_messages_with_their_user_message(length_tokens):
+    rows = [("ai", "a2b"), ("ai", "a2a"), ("user", "u2"), ("ai", "a1"), ("user", "u1")]
+
+    assert history.select_recent_turns(rows, token_budget=10) == [("user", "u2"), ("ai", "a2a"), ("ai", "a2b")]
+
+
+def test_count_tokens_falls_back_when_encoding_cannot_be_loaded(monkeypatch):
+    def offline(*args, **kwargs):
+        raise ConnectionError("offline")
+
+    history._get_encoding.cache_clear()
+    monkeypatch.setattr(history.tiktoken, "encoding_for_model", offline)
+    monkeypatch.setattr(history.tiktoken, "get_encoding", offline)
+    try:
+        assert history.count_tokens("x" * 40) == 10
+        assert history.count_message_tokens("x" * 40) == 10 + history.TOKENS_PER_MESSAGE
+    finally:
+        history._get_encoding.cache_clear()
+
+
+# ---------- Rolling Summary ---------- #
+
+class FakeSummaryModel:
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, messages):
+        self.prompts.append(messages[-1].content)
+        return type("Response", (), {"content": f"摘要 {len(self.prompts)}"})()
+
+
+@pytest.fixture
+def summary_store(tmp_path, monkeypatch, length_tokens):
+    from Functions import chat_store, llm_client
+
+    pool = chat_store.configure(str(tmp_path / "chat_history.db"), max_size=2)
+    model = FakeSummaryModel()
+    monkeypatch.setattr(llm_client, "get_chat_model", lambda *args, **kwargs: model)
+    monkeypatch.setattr(history, "SUMMARY_TRIGGER_MESSAGES", 4)
+    yield chat_store, model
+    pool.close()
+
+
+def add_turns(chat_store, count, size=10, start=0):
+    ids = []
+    for i in range(start, start + count):
+        ids.append(chat_store.insert_message("demo::s1", "demo", "user", f"u{i}".ljust(size, ".")))
+        ids.append(chat_store.insert_message("demo::s1", "demo", "ai", f"a{i}".ljust(size, ".")))
+    return ids
+
+
+def test_update_summary_folds_everything_before_the_token_window(summary_store):
+    chat_store, model = summary_store
+    ids = add_turns(chat_store, 5)
+
+    # 每個回合 20 tokens：預算 40 保留最近 2 個回合，之前的 3 個回合（6 則）全部併入摘要
+    history._update_summary("demo::s1", token_budget=40, max_turns=20)
+
+    assert chat_store.fetch_summary("demo::s1") == ("摘要 1", ids[0], ids[5], 6)
+    assert "u0" in model.prompts[0] and "a2" in model.prompts[0] and "u3" not in model.prompts[0]
+
+
+def test_update_summary_skips_when_nothing_left_the_window(summary_store):
+    chat_store, model = summary_store
+    add_turns(chat_store, 3)
+
+    history._update_summary("demo::s1", token_budget=60, max_turns=20)
+
+    assert chat_store.fetch_summary("demo::s1") is None
+    assert model.prompts == []
+
+
+def test_update_summary_folds_evictions_below_the_batch_threshold(summary_store, monkeypatch):
+    chat_store, model = summary_store
+    monkeypatch.setattr(history, "SUMMARY_TRIGGER_MESSAGES", 20)
+    ids = add_turns(chat_store, 3)
+
+    # 只有 2 則訊息落出視窗，遠低於批次門檻：仍要立刻併入摘要，
+    # 並順便折疊視窗最前面的回合，只保留最新一回合
+    history._update_summary("demo::s1", token_budget=40, max_turns=20)
+
+    assert chat_store.fetch_summary("demo::s1") == ("摘要 1", ids[0], ids[3], 4)
+    assert "u0" in model.prompts[0] and "a1" in model.prompts[0] and "u2" not in model.prompts[0]
+
+    summary, window = history.select_window("demo::s1", token_budget=40 + len(history.summary_message_text("摘要 1", 4)))
+    assert summary is not None
+    assert [content[:2] for _, _, content in window] == ["u2", "a2"]
+
+
+def test_update_summary_merges_into_existing_summary(summary_store):
+    chat_store, model = summary_store
+    ids = add_turns(chat_store, 5)
+    history._update_summary("demo::s1", token_budget=40, max_turns=20)
+    ids += add_turns(chat_store, 2, start=5)
+
+    # 摘要本身佔用預算，視窗只剩最近 1 個回合；之後新落出視窗的 3 個回合併入既有摘要
+    budget = 20 + len(history.summary_message_text("摘要 1", 6))
+    history._update_summary("demo::s1", token_budget=budget, max_turns=20)
+
+    assert chat_store.fetch_summary("demo::s1") == ("摘要 2", ids[0], ids[11], 12)
+    assert model.prompts[1].startswith("Existing summary:\n摘要 1")
+    assert "u3" in model.prompts[1] and "u6" not in model.prompts[1]
+
+
+def test_schedule_during_a_running_fold_checks_again_afterwards(summary_store, monkeypatch):
+    import threading
+    import time
+
+    chat_store, model = summary_store
+    release = threading.Event()
+    invoke = model.invoke
+
+    def blocked_invoke(messages):
+        release.wait(5)
+        return invoke(messages)
+
+    monkeypatch.setattr(model, "invoke", blocked_invoke)
+    add_turns(chat_store, 5)
+    assert history.schedule_summary("demo::s1", token_budget=40, max_turns=20)
+
+    # 第一次摘要還在進行時又有新的回合落出視窗
+    add_turns(chat_store, 3, start=5)
+    assert not history.schedule_summary("demo::s1", token_budget=40, max_turns=20)
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while "demo::s1" in history._pending_sessions and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert "demo::s1" not in history._pending_sessions
+    assert len(model.prompts) >= 2
+    # 視窗之前已沒有尚未摘要的訊息
+    summary, window = history.select_window("demo::s1", token_budget=40, max_turns=20)
+    assert chat_store.count_messages_after("demo::s1", summary[2], window[0][0] if window else None) == 0
+
+
+def test_load_chat_history_prepends_summary_to_the_window(summary_store):
+    pytest.importorskip("langchain_openai")
+    from Functions import ai_chat
+
+    chat_store, _ = summary_store
+    add_turns(chat_store, 5)
+    history._update_summary("demo::s1", token_budget=40, max_turns=20)
+
+    budget = 40 + len(history.summary_message_text("摘要 1", 6))
+    messages = ai_chat.load_chat_history("s1", "demo", token_budget=budget)
+
+    assert messages[0].type == "system"
+    assert messages[0].content == history.summary_message_text("摘要 1", 6)
+    assert [message.content[:2] for message in messages[1:]] == ["u3", "a3", "u4", "a4"]
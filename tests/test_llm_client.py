@@ -0,0 +1,42 @@
+"""
+測試 async httpx 連線池依 event loop 分開
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+pytest.importorskip("langchain_openai")
+
+import httpx  # noqa: E402
+
+from Functions import llm_client  # noqa: E402
+
+
+def test_async_transport_is_created_per_event_loop():
+    created = []
+
+    def factory():
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, text=str(len(created))))
+        created.append(transport)
+        return transport
+
+    client = httpx.AsyncClient(transport=llm_client._PerLoopTransport(factory))
+
+    async def fetch_twice():
+        first = await client.get("https://example.test/")
+        second = await client.get("https://example.test/")
+        return first.text, second.text
+
+    # 同一個 loop 共用連線池，不同的 loop（例如兩次 asyncio.run）各自建立
+    assert asyncio.run(fetch_twice()) == ("1", "1")
+    assert asyncio.run(fetch_twice()) == ("2", "2")
+    assert len(created) == 2
+
+
+def test_shared_async_client_uses_per_loop_transport():
+    client = llm_client.get_async_http_client()
+
+    assert client is llm_client.get_async_http_client()
+    assert isinstance(client._transport, llm_client._PerLoopTransport)
@@ -0,0 +1,104 @@
+"""
+測試依 TODO 挑選原始碼範圍（相關區段 + 大綱）
+"""
+
+from Functions import source_context
+from Functions.source_context import extract_identifiers, select_context
+
+
+def build_page(sections=100):
+    lines = ["<!DOCTYPE html>", "<html>", "<head>", "  <title>Demo</title>", "</head>", "<body>"]
+    for i in range(sections):
+        lines.append(f'  <section id="section-{i}" class="card">')
+        lines.append(f"    <p>Paragraph {i}</p>")
+        lines.append("  </section>")
+    lines.append('  <button id="openModal" onclick="showModal()">Open</button>')
+    lines.extend(["</body>", "</html>"])
+    return "\n".join(lines) + "\n"
+
+
+def test_extract_identifiers_from_todo_and_notes():
+    identifiers = extract_identifiers([
+        "Add a click handler to the #openModal button that calls showModal()",
+        "Change the text of 'Paragraph 3' inside the .card element",
+        "function: closeModal - hides the modal",
+    ])
+    assert {"openModal", "showModal", "Paragraph 3", "card", "closeModal"} <= identifiers
+    assert "the" not in identifiers
+
+
+def test_small_files_are_sent_in_full():
+    source = "<html>\n<body>\n</body>\n</html>\n"
+    assert select_context(source, ["anything"], "HTML") == " 1: <html>\n 2: <body>\n 3: </body>\n 4: </html>"
+    assert select_context(source, ["anything"], "HTML", numbered=False) == source.rstrip("\n")
+
+
+def test_large_files_send_relevant_regions_with_real_line_numbers(monkeypatch):
+    monkeypatch.setattr(source_context, "CONTEXT_RADIUS", 2)
+    source = build_page()
+    lines = source.splitlines()
+    button_line = next(i for i, line in enumerate(lines, 1) if "openModal" in line)
+
+    context = select_context(source, ["Make the #openModal button larger"], "HTML")
+
+    assert f"{button_line}: " + lines[button_line - 1] in context
+    assert "Paragraph 10" not in context
+    # 其餘部分以大綱表示，仍保留真實行號；重複的結構合併成一行
+    assert ' 7: <section id="section-0" class="card">' in context
+    assert "similar lines through line" in context
+    assert len(context.splitlines()) < 30
+
+
+def test_falls_back_to_file_edges_without_matches():
+    source = build_page()
+    context = select_context(source, ["Add a footer"], "HTML")
+    assert " 1: <!DOCTYPE html>" in context
+    assert "</html>" in context
+
+
+def test_indexed_symbols_select_their_range_without_a_text_match():
+    from Functions.symbol_index import SymbolIndex
+
+    # 函式本體遠長於 CONTEXT_RADIUS，本體的最後幾行不含函式名稱
+    body = [f"  step{i}();" for i in range(40)]
+    lines = [f"const filler{i} = {i};" for i in range(300)] + ["function resetGame() {", *body, "}"]
+    source = "\n".join(lines) + "\n"
+    index = SymbolIndex()
+    index.update("c", "index.js", source)
+    locations = index.locations("c", "index.js")
+
+    assert locations["resetGame"] == [(301, 342)]
+    assert source_context.relevant_ranges(lines, {"resetGame"}, radius=0, locations=locations) == [(300, 342)]
+    # 索引中沒有的名稱仍逐行搜尋
+    assert source_context.relevant_ranges(lines, {"filler250"}, radius=0, locations=locations) == [(250, 251)]
+
+    context = select_context(source, ["Rename `resetGame` to restartGame"], "JavaScript", locations=locations)
+    assert "341:   step39();" in context
+    assert "341:   step39();" not in select_context(source, ["Rename `resetGame` to restartGame"], "JavaScript")
+
+
+def test_outline_spans_for_html_css_and_js():
+    html = build_page(sections=2)
+    css = "/* base */\nbody {\n  margin: 0;\n}\n@media (max-width: 600px) {\n  .card { padding: 0; }\n}\n"
+    js = 'function openModal() {\n  if (x) {\n    log("}");\n  }\n}\nconst add = (a, b) => a + b;\n'
+
+    assert (7, 9, "html > body > section#section-0.card") in source_context.outline_spans(html, "HTML")
+    assert source_context.outline_spans(css, "CSS") == [
+        (2, 4, "body"), (5, 7, "@media (max-width: 600px)"), (6, 6, ".card"),
+    ]
+    assert source_context.outline_spans(js, "JavaScript") == [(1, 5, "openModal"), (6, 6, "add")]
+
+
+def test_render_view_supports_ranges_byte_caps_and_outline():
+    source = build_page(sections=1000)
+
+    ranged = source_context.render_view(source, "HTML", start=10, end=12)
+    capped = source_context.render_view(source, "HTML", max_bytes=200)
+    outline = source_context.render_view(source, "HTML", outline_only=True, max_bytes=500)
+
+    assert ranged.splitlines()[:3] == [
+        '10:   <section id="section-1" class="card">', "11:     <p>Paragraph 1</p>", "12:   </section>",
+    ]
+    assert "共 3009 行" in ranged.splitlines()[-1]
+    assert len(capped.encode("utf-8")) < 400 and "已截斷" in capped
+    assert "7-9: html > body > section#section-0.card" in outline and "大綱已截斷" in outline
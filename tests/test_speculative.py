@@ -0,0 +1,108 @@
+"""
+測試並行推測執行：第一個通過驗證的候選勝出，其餘候選取消
+"""
+
+import threading
+import time
+
+from Functions import speculative
+
+
+def delayed(value, delay):
+    def candidate(cancelled):
+        time.sleep(delay)
+        return value
+    return candidate
+
+
+def accept_even(index, value):
+    if value % 2:
+        raise ValueError(f"{value} 不是偶數")
+    return value * 10
+
+
+def test_first_valid_candidate_wins_without_waiting_for_slower_ones():
+    start = time.perf_counter()
+    result = speculative.first_valid([delayed(2, 0.05), delayed(4, 1.0)], accept_even)
+
+    assert result.winner == 0
+    assert result.value == 20
+    assert result.completed == 1
+    assert time.perf_counter() - start < 0.5
+
+
+def test_invalid_candidates_are_skipped_in_completion_order():
+    result = speculative.first_valid([delayed(1, 0.0), delayed(3, 0.02), delayed(6, 0.05)], accept_even)
+
+    assert result.winner == 2
+    assert result.value == 60
+    assert [index for index, _ in result.errors] == [0, 1]
+
+
+def test_all_candidates_failing_returns_every_error():
+    def broken(cancelled):
+        raise RuntimeError("request failed")
+
+    result = speculative.first_valid([delayed(1, 0.0), broken], accept_even)
+
+    assert result.winner is None
+    assert sorted(index for index, _ in result.errors) == [0, 1]
+    assert any("request failed" in message for _, message in result.errors)
+
+
+def test_losing_candidates_see_the_cancel_signal():
+    seen = threading.Event()
+
+    def slow(cancelled):
+        cancelled.wait(1.0)
+        if cancelled.is_set():
+            seen.set()
+        return 8
+
+    result = speculative.first_valid([delayed(2, 0.05), slow], accept_even)
+
+    assert result.winner == 0
+    assert seen.wait(1.0)
+
+
+def test_timeout_stops_waiting():
+    result = speculative.first_valid([delayed(2, 1.0)], accept_even, timeout=0.05)
+
+    assert result.winner is None
+    assert result.errors == [(0, "逾時")]
+
+
+def test_staggered_candidates_are_not_started_when_an_earlier_one_wins():
+    started = []
+
+    def tracked(value, delay):
+        def candidate(cancelled):
+            started.append(value)
+            time.sleep(delay)
+            return value
+        return candidate
+
+    result = speculative.first_valid([tracked(2, 0.02), tracked(4, 0.0), tracked(6, 0.0)], accept_even, stagger=0.3)
+
+    assert result.winner == 0
+    assert result.started == 1
+    time.sleep(0.4)
+    assert started == [2]
+
+
+def test_staggered_candidate_starts_early_when_running_ones_fail():
+    start = time.perf_counter()
+    result = speculative.first_valid([delayed(1, 0.01), delayed(4, 0.01)], accept_even, stagger=5.0)
+
+    # 第一個候選失敗後立即啟動下一個，不等到 5 秒後的預定時間
+    assert result.winner == 1
+    assert result.started == 2
+    assert time.perf_counter() - start < 1.0
+
+
+def test_staggered_candidate_starts_on_schedule_when_the_first_is_slow():
+    result = speculative.first_valid([delayed(2, 1.0), delayed(4, 0.01)], accept_even, stagger=0.05)
+
+    assert result.winner == 1
+    assert result.started == 2
+    assert result.elapsed < 0.5
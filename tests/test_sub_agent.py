@@ -0,0 +1,320 @@
+"""
+測試 sub_agent 的 TODO 規劃（以假的 chat model 取代 OpenAI）
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("langchain_core")
+pytest.importorskip("langchain_openai")
+
+from langchain_core.messages import AIMessage, AIMessageChunk  # noqa: E402
+from langchain_core.runnables import RunnableLambda  # noqa: E402
+
+from Functions import llm_client, sub_agent, unified_diff  # noqa: E402
+
+PLANNER_DELAY = 0.2
+
+RESPONSES = {
+    "HTML": "1. Add a <nav> element above the heading\n2. Insert 'Home' link\nnote: css-class: nav - top navigation",
+    "CSS": "1. Style the .nav class",
+    "JavaScript": "No change required.",
+}
+
+EXPECTED = {
+    "note": ["css-class: nav - top navigation"],
+    "HTML": ["Add a <nav> element above the heading", "Insert 'Home' link"],
+    "CSS": ["Style the .nav class"],
+    "JavaScript": [],
+}
+
+
+def fake_planner(messages):
+    time.sleep(PLANNER_DELAY)
+    system = messages[0].content
+    for name, content in RESPONSES.items():
+        if f"{name} source code edits" in system:
+            return AIMessage(content=content)
+    raise AssertionError("unexpected prompt")
+
+
+class FakeChatModel:
+    """structured output 回傳固定的 TodoPlan；plan 為 None 時模擬呼叫失敗"""
+
+    def __init__(self, plan=None):
+        self.plan = plan
+        self.structured_calls = 0
+
+    def with_structured_output(self, schema):
+        def invoke(messages):
+            self.structured_calls += 1
+            if self.plan is None:
+                raise ValueError("invalid structured output")
+            return self.plan
+        return RunnableLambda(invoke)
+
+    def batch(self, inputs, config=None):
+        return RunnableLambda(fake_planner).batch(inputs, config)
+
+
+def use_model(monkeypatch, model):
+    monkeypatch.setattr(llm_client, "get_chat_model", lambda *args, **kwargs: model)
+
+
+def test_list_todo_uses_one_structured_call(monkeypatch):
+    model = FakeChatModel(sub_agent.TodoPlan(
+        html=["Add a <nav> element above the heading", "Insert 'Home' link", " "],
+        css=["Style the .nav class"],
+        javascript=[],
+        notes=["css-class: nav - top navigation"],
+    ))
+    use_model(monkeypatch, model)
+
+    assert sub_agent.list_todo("新增導覽列") == EXPECTED
+    assert model.structured_calls == 1
+
+
+def test_list_todo_falls_back_to_concurrent_per_file_planning(monkeypatch):
+    model = FakeChatModel(plan=None)
+    use_model(monkeypatch, model)
+
+    start = time.perf_counter()
+    result = sub_agent.list_todo("新增導覽列")
+    elapsed = time.perf_counter() - start
+
+    assert result == EXPECTED
+    assert model.structured_calls == 1
+    # 三個請求並行，總時間接近單次呼叫而非三倍
+    assert elapsed < PLANNER_DELAY * 2
+
+
+def test_merge_diffs_combines_hunks_and_rejects_overlaps():
+    first = "--- index.html\n+++ index.html\n@@ -2,3 +2,4 @@\n line2\n+new\n line3\n line4\n"
+    second = "```diff\n--- index.html\n+++ index.html\n@@ -7,3 +7,2 @@\n line7\n-line8\n line9\n```"
+    # 修改的 line3 緊接在第一個 diff 的插入位置之後
+    overlapping = "@@ -3,2 +3,2 @@\n-line3\n+changed\n line4\n"
+
+    merged, accepted, rejected = sub_agent._merge_diffs(
+        [(1, first), (2, second), (3, overlapping)], "index.html"
+    )
+
+    assert accepted == [1, 2]
+    assert rejected == [3]
+    # 第二個 hunk 的 new_start 需加上第一個 hunk 新增的一行
+    assert merged.splitlines()[2:] == [
+        "@@ -2,3 +2,4 @@", " line2", "+new", " line3", " line4",
+        "@@ -7,3 +8,2 @@", " line7", "-line8", " line9",
+    ]
+
+
+def test_merge_diffs_combines_hunks_that_only_share_context():
+    original = "".join(f"line{i}\n" for i in range(1, 9))
+    first = "@@ -2,3 +2,3 @@\n line2\n-line3\n+LINE3\n line4\n"
+    second = "@@ -4,3 +4,3 @@\n line4\n-line5\n+LINE5\n line6\n"
+
+    merged, accepted, rejected = sub_agent._merge_diffs([(1, first), (2, second)], "index.html")
+
+    assert accepted == [1, 2] and rejected == []
+    assert merged.splitlines()[2:] == [
+        "@@ -2,5 +2,5 @@", " line2", "-line3", "+LINE3", " line4", "-line5", "+LINE5", " line6",
+    ]
+    assert unified_diff.apply_patch(original, merged).splitlines()[1:6] == ["line2", "LINE3", "line4", "LINE5", "line6"]
+
+
+def test_merge_diffs_rejects_insertions_at_the_same_line():
+    first = "@@ -3,0 +4,1 @@\n+first\n"
+    second = "@@ -3,0 +4,1 @@\n+second\n"
+
+    _, accepted, rejected = sub_agent._merge_diffs([(1, first), (2, second)], "index.html")
+
+    assert accepted == [1] and rejected == [2]
+
+
+def test_merge_diffs_numbers_insertion_hunks_after_the_insertion_point():
+    original = "".join(f"line{i}\n" for i in range(1, 9))
+    replace = "@@ -1,1 +1,2 @@\n-line1\n+LINE1\n+extra\n"
+    insert = "@@ -5,0 +6,1 @@\n+inserted\n"
+
+    merged, accepted, _ = sub_agent._merge_diffs([(1, replace), (2, insert)], "index.html")
+
+    assert accepted == [1, 2]
+    # 插入在第 5 行之後：前一個 hunk 多出一行，新內容從第 7 行開始
+    assert "@@ -5,0 +7,1 @@" in merged.splitlines()
+    assert unified_diff.apply_patch(original, merged).splitlines()[5:8] == ["line5", "inserted", "line6"]
+
+
+def test_batch_diff_retries_only_the_todo_whose_hunk_fails(monkeypatch):
+    files = {"index.html": "".join(f"line{i}\n" for i in range(1, 11))}
+
+    def write(container, filename, content, expected_digest=None):
+        files[filename] = content
+        return 2
+
+    batch = sub_agent.BatchDiff(items=[
+        sub_agent.TodoDiff(index=1, diff="@@ -2,1 +2,1 @@\n-line2\n+LINE2\n"),
+        # context 不存在於檔案中，本地修正也無法定位
+        sub_agent.TodoDiff(index=2, diff="@@ -5,1 +5,1 @@\n-missing\n+changed\n"),
+        sub_agent.TodoDiff(index=3, diff="@@ -8,1 +8,1 @@\n-line8\n+LINE8\n"),
+    ])
+    retried = []
+
+    def fake_llm_diff(container_name, todo, lang, note_ls, stats=None):
+        retried.append(todo)
+        return "SKIP"
+
+    use_model(monkeypatch, FakeChatModel(batch))
+    monkeypatch.setattr(sub_agent, "BATCH_DIFF_ENABLED", True)
+    monkeypatch.setattr(sub_agent, "llm_diff", fake_llm_diff)
+    monkeypatch.setattr(sub_agent.ai_tool, "read_source_file", lambda container, filename, max_age=None: files[filename])
+    monkeypatch.setattr(sub_agent.ai_tool, "write_source_file", write)
+    monkeypatch.setattr(sub_agent.history, "count_tokens", lambda text: len(text) // 4)
+
+    stats = {"llm_calls": 0, "baseline_calls": 0, "tokens_saved": 0}
+    results = sub_agent._run_pipeline("demo_container", "HTML", ["edit 2", "edit 5", "edit 8"], [], stats)
+
+    assert retried == ["edit 5"]
+    assert files["index.html"].splitlines()[1] == "LINE2"
+    assert files["index.html"].splitlines()[7] == "LINE8"
+    assert files["index.html"].splitlines()[4] == "line5"
+    assert results == [
+        "[HTML] edit 2 - ✅ 成功套用（批次）",
+        "[HTML] edit 8 - ✅ 成功套用（批次）",
+        "[HTML] 最新代碼已更新（版本 2）",
+        "[HTML] edit 5 - 已跳過，無需修改",
+    ]
+    assert stats["llm_calls"] == 1 and stats["baseline_calls"] == 3
+
+
+def test_apply_diff_reapplies_when_the_file_changed_before_writing(monkeypatch):
+    from Functions import file_cache
+
+    files = {"cached": "line1\nline2\n", "current": "line1\nline2\nline3\n"}
+    reads, writes = [], []
+
+    def read(container, filename, max_age=None):
+        reads.append(max_age)
+        return files["cached"] if max_age is None else files["current"]
+
+    def write(container, filename, content, expected_digest=None):
+        writes.append(content)
+        if expected_digest != file_cache.content_digest(files["current"]):
+            raise sub_agent.ai_tool.FileChangedError("changed")
+        return 3
+
+    monkeypatch.setattr(sub_agent.ai_tool, "read_source_file", read)
+    monkeypatch.setattr(sub_agent.ai_tool, "write_source_file", write)
+
+    result = sub_agent.apply_diff("demo_container", "@@ -2,1 +2,1 @@\n-line2\n+LINE2\n", "html")
+
+    # 先以快取的內容套用；寫入時發現外部修改，確認後以最新內容重新套用
+    assert result["success"] and result["version"] == 3
+    assert reads == [None, 0]
+    assert writes[-1] == "line1\nLINE2\nline3\n"
+
+
+def test_create_diff_runs_file_pipelines_concurrently_in_fixed_order(monkeypatch):
+    delays = {"HTML": 0.3, "CSS": 0.1, "JavaScript": 0.2}
+
+    def fake_llm_diff(container_name, todo, lang, note_ls, stats=None):
+        stats["llm_calls"] += 1
+        time.sleep(delays[lang])
+        return "SKIP"
+
+    monkeypatch.setattr(sub_agent, "llm_diff", fake_llm_diff)
+    todo_list = {"HTML": ["edit html"], "CSS": ["edit css"], "JavaScript": ["edit js"], "note": []}
+
+    stats = {}
+    start = time.perf_counter()
+    results = sub_agent.create_diff("demo_container", todo_list, stats)
+    elapsed = time.perf_counter() - start
+
+    assert results == [
+        "[HTML] edit html - 已跳過，無需修改",
+        "[CSS] edit css - 已跳過，無需修改",
+        "[JavaScript] edit js - 已跳過，無需修改",
+    ]
+    assert stats["llm_calls"] == 3 and stats["baseline_calls"] == 3
+    assert elapsed < sum(delays.values())
+
+
+def test_file_locks_are_shared_while_held_and_dropped_afterwards():
+    with sub_agent._file_lock("demo_container", "HTML") as lock:
+        assert sub_agent._file_lock("demo_container", "HTML") is lock
+        assert ("demo_container", "index.html") in sub_agent._file_locks
+    del lock
+
+    assert ("demo_container", "index.html") not in sub_agent._file_locks
+
+
+def test_speculative_llm_diff_takes_first_candidate_that_applies(monkeypatch):
+    original = "<html>\n<body>\n<h1>Hi</h1>\n</body>\n</html>\n"
+    # 成功率最高的 whole_file 候選較慢，search_replace 候選先回傳可套用的結果，udiff 候選無法套用
+    outputs = {
+        "whole_file": "```html\n<html>\n<body>\n<h1>Hey</h1>\n</body>\n</html>\n```",
+        "search_replace": "<<<<<<< SEARCH\n<h1>Hi</h1>\n=======\n<h1>Hello</h1>\n>>>>>>> REPLACE",
+        "udiff": "@@ -9,1 +9,1 @@\n-missing\n+line\n",
+    }
+    delays = {"whole_file": 0.5, "search_replace": 0.05, "udiff": 0.0}
+
+    closed = []
+
+    class FakeEditModel:
+        def __init__(self, temperature):
+            self.temperature = temperature
+
+        def stream(self, messages, **kwargs):
+            system = messages[0].content
+            name = next(name for name, fmt in sub_agent.edit_formats.FORMATS.items() if fmt.task in system)
+            try:
+                for line in outputs[name].splitlines(keepends=True):
+                    time.sleep(delays[name] / len(outputs[name].splitlines()))
+                    yield AIMessageChunk(content=line)
+            finally:
+                closed.append(name)
+
+    monkeypatch.setattr(sub_agent, "SPECULATIVE_CANDIDATES", 3)
+    monkeypatch.setattr(sub_agent, "SPECULATIVE_STAGGER_SECONDS", 0)
+    monkeypatch.setattr(sub_agent.ai_tool, "read_source_file", lambda container, filename, max_age=None: original)
+    monkeypatch.setattr(sub_agent.history, "count_tokens", lambda text: len(text) // 4)
+    monkeypatch.setattr(llm_client, "get_chat_model", lambda model, temperature=0, streaming=False: FakeEditModel(temperature))
+
+    stats = {"llm_calls": 0}
+    start = time.perf_counter()
+    diff = sub_agent.llm_diff("demo_container", "Change the heading to Hello", "HTML", [], stats)
+
+    assert "-<h1>Hi</h1>" in diff and "+<h1>Hello</h1>" in diff
+    assert stats["llm_calls"] == 3
+    assert time.perf_counter() - start < 0.5
+    # 較慢的 whole_file 候選在勝出後中途關閉串流
+    time.sleep(0.3)
+    assert "whole_file" in closed
+
+
+def test_speculative_plan_counts_estimated_output_tokens(monkeypatch):
+    original = "<p>x</p>\n" * 100
+    monkeypatch.setattr(sub_agent, "SPECULATIVE_CANDIDATES", 3)
+    monkeypatch.setattr(sub_agent.history, "count_tokens", lambda text: len(text) // 4)
+    args = (original, "Change x", [], "index.html", "HTML")
+
+    monkeypatch.setattr(sub_agent, "SPECULATIVE_MAX_TOKENS", 10 ** 6)
+    plan = sub_agent._speculative_plan(*args)
+    prompts = [sum(len(message.content) // 4 for message in messages) for _, _, messages in plan]
+    outputs = [sub_agent._estimated_output_tokens(edit_format, len(original) // 4) for edit_format, _, _ in plan]
+    assert outputs[[edit_format.name for edit_format, _, _ in plan].index("whole_file")] == len(original) // 4
+
+    # 上限只夠前兩個候選的 prompt 加上輸出
+    monkeypatch.setattr(sub_agent, "SPECULATIVE_MAX_TOKENS", sum(prompts[:2]) + sum(outputs[:2]))
+    assert len(sub_agent._speculative_plan(*args)) == 2
+    monkeypatch.setattr(sub_agent, "SPECULATIVE_MAX_TOKENS", sum(prompts[:2]) + sum(outputs[:2]) - 1)
+    assert len(sub_agent._speculative_plan(*args)) == 1
+
+
+@pytest.mark.parametrize("module", ["Functions.sub_agent", "Functions.ai_tool", "Functions.ai_chat"])
+def test_modules_import_without_cycle_in_a_fresh_interpreter(module):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", f"import {module}"], cwd=root, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
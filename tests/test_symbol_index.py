@@ -0,0 +1,111 @@
+"""
+測試專案符號索引：符號解析、增量更新與懸空參照檢查
+"""
+
+import os
+
+from Functions.symbol_index import SymbolIndex, extract_symbols
+
+HTML = """<!DOCTYPE html>
+<html>
+<body>
+  <button id="openModal" class="btn primary" onclick="showModal()">Open</button>
+  <div id="modal" class="modal hidden"></div>
+</body>
+</html>
+"""
+
+CSS = """.btn { padding: 4px; }
+.primary, .modal { color: red; }
+#modal.hidden:not(.open) { display: none; }
+"""
+
+JS = """function showModal() {
+  document.getElementById("modal").classList.remove("hidden");
+}
+document.querySelector("#closeModal").addEventListener("click", () => {
+  document.getElementById("modal").classList.add("hidden");
+});
+"""
+
+
+def build(html=HTML, css=CSS, js=JS):
+    index = SymbolIndex()
+    index.update_files("c", {"index.html": html, "index.css": css, "index.js": js})
+    return index
+
+
+def test_extracts_symbols_with_locations():
+    html = {(s.kind, s.name, s.line) for s in extract_symbols("index.html", HTML)}
+    css = {(s.kind, s.name) for s in extract_symbols("index.css", CSS)}
+    js = {(s.kind, s.name, s.line) for s in extract_symbols("index.js", JS)}
+
+    assert {("id", "openModal", 4), ("class", "primary", 4), ("call", "showModal", 4), ("event", "click", 4)} <= html
+    assert {("css-class", "btn"), ("css-class", "modal"), ("css-id", "modal"), ("css-class", "hidden")} <= css
+    assert ("css-class", "open") not in css
+    assert {("function", "showModal", 1), ("js-id", "modal", 2), ("js-class", "hidden", 2),
+            ("js-id", "closeModal", 4), ("event", "click", 4)} <= js
+
+
+def test_update_only_reparses_changed_files():
+    index = build()
+
+    assert index.update("c", "index.css", CSS) is False
+    assert index.update("c", "index.css", CSS + ".card { margin: 0; }\n") is True
+    assert [s.line for s in index.lookup("c", "card")] == [4]
+
+
+def test_check_flags_dangling_references():
+    html = HTML.replace('onclick="showModal()"', 'onclick="openDialog(); alert(1)"')
+    index = build(html=html, css=CSS.replace(".btn { padding: 4px; }\n", ""))
+
+    messages = [problem.message for problem in index.check("c", ["css-class: card - card layout", "function: showModal - opens"])]
+
+    assert any("`closeModal`" in message and "index.js:4" in message for message in messages)
+    assert any("`openDialog`" in message for message in messages)
+    assert not any("`alert`" in message for message in messages)
+    assert any("`btn`" in message for message in messages)
+    assert any("`card`" in message and "note" in message for message in messages)
+    assert not any("`showModal`" in message for message in messages)
+
+
+def test_tailwind_pages_only_skip_utility_notes_and_js_classes():
+    html = HTML.replace("<body>", '<body>\n<script src="https://cdn.jsdelivr.net/npm/@tailwindcss/browser@4"></script>')
+    html = html.replace('class="modal hidden"', 'class="modal hidden md:w-[300px] hover:bg-black/50 -mt-2 card"')
+    index = build(html=html, css="")
+
+    flagged = {problem.name for problem in index.check("c", ["css-class: card - card layout"]) if problem.kind == "class"}
+
+    # 工具類別、note 中宣告的 card 與 JS 加入的 hidden 略過；自訂的 btn、primary、modal 仍需 CSS 定義
+    assert flagged == {"btn", "primary", "modal"}
+
+
+def test_tailwind_utility_patterns():
+    from Functions.symbol_index import is_tailwind_utility
+
+    for name in ("text-3xl", "font-bold", "underline", "flex", "px-4", "sm:grid-cols-2", "dark:hover:bg-gray-800",
+                 "w-[300px]", "!mt-0", "-translate-x-1/2", "bg-blue-500/75", "[&>*]:p-2"):
+        assert is_tailwind_utility(name), name
+    for name in ("btn", "card", "modal", "primary", "text-", "navbar-item"):
+        assert not is_tailwind_utility(name), name
+
+
+def read_template():
+    root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docker_template")
+    files = {}
+    for filename in ("index.html", "index.css", "index.js"):
+        with open(os.path.join(root, filename), encoding="utf-8") as f:
+            files[filename] = f.read()
+    return files
+
+
+def test_check_on_the_project_template():
+    files = read_template()
+    index = SymbolIndex()
+    index.update_files("c", files)
+    assert index.check("c") == []
+
+    # 模板載入 Tailwind，但新增的自訂 class 沒有寫進 index.css 仍要回報
+    index.update("c", "index.html", files["index.html"].replace('class="text-3xl', 'class="hero-title text-3xl'))
+    problems = [problem for problem in index.check("c") if problem.kind == "class"]
+    assert [problem.name for problem in problems] == ["hero-title"]
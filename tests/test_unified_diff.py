@@ -0,0 +1,189 @@
+"""
+測試純 Python 的 unified diff 解析與套用（案例取自 tests/test_correct_diff.py）
+"""
+
+import pytest
+
+from Functions.unified_diff import PatchError, apply_patch, parse, repair_diff
+
+ORIGINAL_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Welcome My Website!</title>
+</head>
+<body>
+    <h1 class="text-3xl font-bold underline">Welcome My Website!</h1>
+</body>
+</html>
+"""
+
+NAV = """\
++    <nav class="bg-gray-800 p-4">
++      <div class="container mx-auto">
++        <div class="flex justify-between">
++          <a href="#" class="text-white text-lg font-semibold">My Website</a>
++          <div>
++            <a href="#" class="text-gray-300 hover:text-white px-3">Home</a>
++            <a href="#" class="text-gray-300 hover:text-white px-3">About</a>
++            <a href="#" class="text-gray-300 hover:text-white px-3">Contact</a>
++          </div>
++        </div>
++      </div>
++    </nav>
++
+"""
+
+SIMPLE_DIFF = """--- index.html
++++ index.html
+@@ -4,3 +4,3 @@
+     <meta charset="UTF-8">
+-    <title>Welcome My Website!</title>
++    <title>Hello World!</title>
+ </head>
+"""
+
+# test_correct_diff.py 的 wrong_diff：行號錯誤、缺少結尾 context
+WRONG_DIFF = """--- index.html
++++ index.html
+@@ -10,3 +10,18 @@
+  <body>
+""" + NAV + """     <h1 class="text-3xl font-bold underline">Welcome My Website!</h1>
+"""
+
+# test_correct_diff.py 的 correct_diff：內容正確，但起始行差一行且 old 行數宣告為 3（實際 5）
+CORRECT_DIFF = """--- index.html
++++ index.html
+@@ -7,3 +7,18 @@
+ </head>
+ <body>
+""" + NAV + """     <h1 class="text-3xl font-bold underline">Welcome My Website!</h1>
+ </body>
+ </html>
+"""
+
+
+def test_simple_diff_applies():
+    patched = apply_patch(ORIGINAL_HTML, SIMPLE_DIFF, "index.html")
+    assert patched == ORIGINAL_HTML.replace("Welcome My Website!</title>", "Hello World!</title>")
+
+
+def test_wrong_diff_is_rejected_with_diagnostics():
+    with pytest.raises(PatchError) as excinfo:
+        apply_patch(ORIGINAL_HTML, WRONG_DIFF, "index.html")
+    assert "hunk #1" in str(excinfo.value)
+    assert "@@ -10," in str(excinfo.value)
+
+
+def test_miscounted_header_reports_expected_counts():
+    with pytest.raises(PatchError) as excinfo:
+        apply_patch(ORIGINAL_HTML, CORRECT_DIFF, "index.html")
+    assert "@@ -7,5 +7,18 @@" in str(excinfo.value)
+
+
+def test_context_mismatch_points_to_actual_location():
+    diff = CORRECT_DIFF.replace("@@ -7,3 +7,18 @@", "@@ -7,5 +7,18 @@")
+    with pytest.raises(PatchError) as excinfo:
+        apply_patch(ORIGINAL_HTML, diff, "index.html")
+    message = str(excinfo.value)
+    assert "第 7 行不吻合" in message
+    assert "第 6 行" in message
+
+    patched = apply_patch(ORIGINAL_HTML, diff.replace("@@ -7,5 +7,18 @@", "@@ -6,5 +6,18 @@"), "index.html")
+    assert '<nav class="bg-gray-800 p-4">' in patched
+    assert patched.splitlines()[6] == "<body>"
+    assert patched.endswith("</html>\n")
+
+
+def test_markdown_fences_and_multiple_hunks():
+    diff = "```diff\n" + SIMPLE_DIFF + """@@ -9,2 +9,3 @@
+ </body>
++<!-- footer -->
+ </html>
+```"""
+    patched = apply_patch(ORIGINAL_HTML, diff, "index.html")
+    assert patched.splitlines()[-2:] == ["<!-- footer -->", "</html>"]
+    assert "Hello World!" in patched
+
+
+def test_rejects_other_file_and_already_applied():
+    with pytest.raises(PatchError, match="index.css"):
+        apply_patch(ORIGINAL_HTML, SIMPLE_DIFF, "index.css")
+
+    patched = apply_patch(ORIGINAL_HTML, SIMPLE_DIFF, "index.html")
+    with pytest.raises(PatchError, match="已經套用過"):
+        apply_patch(patched, SIMPLE_DIFF, "index.html")
+
+
+def test_parse_without_hunks_fails():
+    with pytest.raises(PatchError):
+        parse("Sorry, I cannot produce a diff.")
+
+
+def test_repair_fixes_counts_and_offset_of_correct_diff():
+    repaired, fixes = repair_diff(ORIGINAL_HTML, CORRECT_DIFF, "index.html")
+
+    assert "@@ -6,5 +6,18 @@" in repaired
+    assert any("行數" in fix for fix in fixes)
+    assert any("起始行 7 → 6" in fix for fix in fixes)
+    patched = apply_patch(ORIGINAL_HTML, repaired, "index.html")
+    assert patched.splitlines()[7] == '    <nav class="bg-gray-800 p-4">'
+
+
+def test_repair_matches_context_ignoring_whitespace():
+    diff = """--- index.html
++++ index.html
+@@ -5,2 +5,2 @@
+ <meta charset="UTF-8">
+-<title>Welcome My Website!</title>
++    <title>Hello World!</title>
+"""
+    repaired, fixes = repair_diff(ORIGINAL_HTML, diff, "index.html")
+
+    assert any("忽略空白" in fix for fix in fixes)
+    patched = apply_patch(ORIGINAL_HTML, repaired, "index.html")
+    assert "    <meta charset=\"UTF-8\">" in patched
+    assert "    <title>Hello World!</title>" in patched
+
+
+def test_repair_recomputes_new_start_across_hunks():
+    diff = """@@ -2,1 +2,1 @@
+ <html lang="en">
++<!-- top -->
+@@ -9,1 +9,1 @@
+ </body>
++<!-- bottom -->
+"""
+    repaired, _ = repair_diff(ORIGINAL_HTML, diff, "index.html")
+    assert "@@ -2,1 +2,2 @@" in repaired
+    assert "@@ -9,1 +10,2 @@" in repaired
+    apply_patch(ORIGINAL_HTML, repaired, "index.html")
+
+
+def test_repair_numbers_pure_insertion_after_the_insertion_point():
+    body = "".join(f"line {i}\n" for i in range(1, 11))
+    diff = "@@ -1,1 +1,2 @@\n line 1\n+first\n@@ -5,0 +5,1 @@\n+inserted\n"
+
+    repaired, _ = repair_diff(body, diff)
+    # 插入在第 5 行之後，前一個 hunk 多出一行
+    assert "@@ -5,0 +7,1 @@" in repaired
+    assert apply_patch(body, repaired).splitlines()[5:8] == ["line 5", "inserted", "line 6"]
+
+
+def test_insertion_past_end_of_file_is_a_patch_error():
+    body = "".join(f"line {i}\n" for i in range(1, 31))
+
+    with pytest.raises(PatchError, match="插入位置第 50 行超出檔案結尾"):
+        repair_diff(body, "@@ -50,1 +50,2 @@\n+new1\n+new2\n")
+    with pytest.raises(PatchError, match="超出檔案結尾"):
+        apply_patch(body, "@@ -50,0 +51,2 @@\n+new1\n+new2\n")
+
+
+def test_repair_gives_up_outside_window():
+    body = "".join(f"line {i}\n" for i in range(1, 101))
+    diff = "@@ -80,3 +80,3 @@\n line 10\n-line 11\n+line eleven\n line 12\n"
+
+    with pytest.raises(PatchError, match="前後 5 行"):
+        repair_diff(body, diff, window=5)
+    repaired, _ = repair_diff(body, diff, window=80)
+    assert "@@ -10,3 +10,3 @@" in repaired
@@ -0,0 +1,91 @@
+"""
+測試主機工作目錄模式：本機讀取快取（inode / mtime 指紋）與原子寫入
+"""
+
+import os
+
+import pytest
+
+from Functions import file_cache, workspace
+
+CONTAINER = "ai-web-ide_demo_container"
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    template = tmp_path / "template"
+    template.mkdir()
+    (template / "index.html").write_text("<h1>Hi</h1>\n")
+    monkeypatch.setattr(workspace, "WORKSPACE_ROOT", str(tmp_path / "workspaces"))
+    monkeypatch.setattr(file_cache, "_cache", file_cache.FileCache(revalidate_seconds=60))
+    return workspace.create_workspace(CONTAINER, str(template), ["index.html"])
+
+
+def test_workspace_dir_only_exists_for_workspace_projects(project):
+    assert workspace.workspace_dir(CONTAINER) == project
+    assert workspace.workspace_dir("ai-web-ide_other_container") is None
+
+
+@pytest.mark.parametrize("name", ["..", "../ai-web-ide_demo_container", "ai-web-ide_demo_container/../..",
+                                  "/etc", "ai-web-ide_.._container", "demo", "ai-web-ide__container"])
+def test_rejects_container_names_that_are_not_project_containers(project, name):
+    with pytest.raises(ValueError):
+        workspace.workspace_dir(name)
+    with pytest.raises(ValueError):
+        workspace.create_workspace(name, os.path.dirname(project), [])
+
+
+def test_rejects_workspaces_that_resolve_outside_the_root(project, tmp_path):
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    os.symlink(outside, os.path.join(workspace.WORKSPACE_ROOT, "ai-web-ide_link_container"))
+
+    with pytest.raises(ValueError):
+        workspace.workspace_dir("ai-web-ide_link_container")
+    assert workspace.workspace_dir(CONTAINER) == project
+
+
+def test_reads_are_cached_until_the_file_changes_on_disk(project):
+    first = workspace.read_file(CONTAINER, project, "index.html")
+    second = workspace.read_file(CONTAINER, project, "index.html")
+
+    path = os.path.join(project, "index.html")
+    with open(path, "w") as f:
+        f.write("<h1>Edited</h1>\n")
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 1_000_000))
+    third = workspace.read_file(CONTAINER, project, "index.html")
+
+    assert first.content == second.content == "<h1>Hi</h1>\n"
+    assert third.content == "<h1>Edited</h1>\n" and third.version == 2
+    stats = file_cache.cache_stats()
+    assert stats["misses"] == 2 and stats["external_changes"] == 1
+
+
+def test_writes_replace_the_file_atomically_and_update_the_cache(project):
+    version = workspace.write_file(CONTAINER, project, "index.html", "<h1>New</h1>\n")
+    entry = workspace.read_file(CONTAINER, project, "index.html")
+
+    assert version == 1 and entry.content == "<h1>New</h1>\n"
+    assert file_cache.cache_stats()["misses"] == 0
+    assert sorted(os.listdir(project)) == ["index.html"]
+    # 暫存檔寫在 nginx 提供的目錄之外
+    assert os.listdir(os.path.join(os.path.dirname(project), workspace.STAGING_DIR_NAME)) == []
+    assert os.stat(os.path.join(project, "index.html")).st_mode & 0o777 == 0o644
+
+
+def test_write_with_a_stale_digest_keeps_the_external_edit(project):
+    path = os.path.join(project, "index.html")
+    original = workspace.read_file(CONTAINER, project, "index.html")
+    with open(path, "w") as f:
+        f.write("<h1>Edited</h1>\n")
+
+    with pytest.raises(workspace.FileChangedError):
+        workspace.write_file(CONTAINER, project, "index.html", "<h1>New</h1>\n", expected_digest=original.digest)
+
+    assert open(path).read() == "<h1>Edited</h1>\n"
+
+
+def test_remove_workspace_deletes_the_directory(project):
+    workspace.remove_workspace(CONTAINER)
+
+    assert not os.path.exists(project)